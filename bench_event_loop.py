@@ -0,0 +1,335 @@
+# coding: utf8
+
+# EventLoop 、 Waker 和 PollImpl 的微基准测试，只使用本地的 socketpair ，
+# 用于比较对 reactor 热路径的修改
+
+import logging
+import resource
+import socket
+import threading
+import time
+
+from concurrent_http_client.event_loop import EventLoop
+from concurrent_http_client.periodic_callback import PeriodicCallback
+from concurrent_http_client.poll_impl import PollImpl
+from concurrent_http_client.waker import Waker
+
+LOGGER = logging.getLogger(__name__)
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(sorted_values, p):
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_loop(setup):
+    """Starts a new `EventLoop`, calls ``setup(event_loop)`` on it and
+    returns when the loop is stopped.
+    """
+    event_loop = EventLoop()
+    event_loop.call_later(0, setup, event_loop)
+    try:
+        event_loop.start()
+    finally:
+        event_loop.close()
+
+
+def bench_add_callback(count=200000):
+    # 在事件循环的线程中添加回调
+    state = {"left": count}
+
+    def callback(event_loop):
+        state["left"] -= 1
+        if not state["left"]:
+            event_loop.stop()
+
+    def setup(event_loop):
+        for _ in range(count):
+            event_loop.add_callback(callback, event_loop)
+
+    start_time = time.time()
+    run_loop(setup)
+    time_elapsed = time.time() - start_time
+    LOGGER.info("add_callback same thread: %d callbacks %.0f/s %.2fus each",
+                count, count / time_elapsed, time_elapsed / count * 1e6)
+
+
+def bench_add_callback_threads(count=100000, thread_count=4):
+    # 从其它线程添加回调，每次都会唤醒事件循环
+    lock = threading.Lock()
+    state = {"left": count * thread_count}
+    started = threading.Event()
+
+    def callback(event_loop):
+        with lock:
+            state["left"] -= 1
+            left = state["left"]
+        if not left:
+            event_loop.stop()
+
+    def produce(event_loop):
+        started.wait()
+        for _ in range(count):
+            event_loop.add_callback(callback, event_loop)
+
+    holder = []
+
+    def setup(event_loop):
+        holder.append(event_loop)
+        started.set()
+
+    threads = []
+    loop_thread = threading.Thread(target=run_loop, args=(setup,))
+    loop_thread.start()
+    started.wait()
+    start_time = time.time()
+    for _ in range(thread_count):
+        thread = threading.Thread(target=produce, args=(holder[0],))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    loop_thread.join()
+    time_elapsed = time.time() - start_time
+    total = count * thread_count
+    LOGGER.info("add_callback %d threads: %d callbacks %.0f/s %.2fus each",
+                thread_count, total, total / time_elapsed,
+                time_elapsed / total * 1e6)
+
+
+def bench_wake_latency(count=2000):
+    # 空闲的事件循环从另一个线程被唤醒，到回调执行的延迟
+    started = threading.Event()
+    called = threading.Event()
+    latencies = []
+    holder = []
+
+    def callback(submit_time):
+        latencies.append(time.time() - submit_time)
+        called.set()
+
+    def setup(event_loop):
+        holder.append(event_loop)
+        started.set()
+
+    loop_thread = threading.Thread(target=run_loop, args=(setup,))
+    loop_thread.start()
+    started.wait()
+    event_loop = holder[0]
+    for _ in range(count):
+        # 让事件循环进入 poll
+        time.sleep(0.0002)
+        called.clear()
+        event_loop.add_callback(callback, time.time())
+        called.wait()
+    event_loop.stop()
+    loop_thread.join()
+    latencies.sort()
+    LOGGER.info("cross-thread wake latency: p50=%.1fus p99=%.1fus max=%.1fus",
+                percentile(latencies, 50) * 1e6,
+                percentile(latencies, 99) * 1e6,
+                latencies[-1] * 1e6)
+
+
+def bench_timeouts(count=100000):
+    # call_at/remove_timeout 的开销，以及大量被取消的定时器对之后的
+    # 事件循环迭代的影响；然后执行 count 个到期的定时器
+    result = {}
+    state = {"left": count}
+
+    def noop():
+        pass
+
+    def fire(event_loop):
+        state["left"] -= 1
+        if not state["left"]:
+            result["fire"] = time.time() - result["fire_start"]
+            event_loop.stop()
+
+    def after_churn(event_loop):
+        result["iteration"] = time.time() - result["churn_end"]
+        result["fire_start"] = time.time()
+        now = event_loop.time()
+        for _ in range(count):
+            event_loop.call_at(now, fire, event_loop)
+
+    def setup(event_loop):
+        deadline = event_loop.time() + 3600
+        start_time = time.time()
+        timeouts = [event_loop.call_at(deadline, noop)
+                    for _ in range(count)]
+        result["add"] = time.time() - start_time
+        start_time = time.time()
+        for timeout in timeouts:
+            event_loop.remove_timeout(timeout)
+        result["remove"] = time.time() - start_time
+        result["churn_end"] = time.time()
+        event_loop.add_callback(after_churn, event_loop)
+
+    run_loop(setup)
+    LOGGER.info("call_at: %.2fus each, remove_timeout: %.2fus each, "
+                "next iteration after churn: %.1fms, "
+                "due timeouts: %.2fus each",
+                result["add"] / count * 1e6,
+                result["remove"] / count * 1e6,
+                result["iteration"] * 1000,
+                result["fire"] / count * 1e6)
+
+
+def bench_handler_dispatch(fd_count, dispatch_count=200000):
+    # fd_count 个一直可读的 socket ，测量每次调用 handler 的开销
+    pairs = [socket.socketpair() for _ in range(fd_count)]
+    state = {"left": dispatch_count}
+    result = {}
+
+    def handler(fd, events):
+        # 不读取数据，水平触发时 fd 一直可读
+        state["left"] -= 1
+        if state["left"] == 0:
+            result["elapsed"] = time.time() - result["start_time"]
+            result["cpu"] = cpu_time() - result["start_cpu"]
+            event_loop = result["event_loop"]
+            for reader, _ in pairs:
+                event_loop.remove_handler(reader.fileno())
+            event_loop.stop()
+
+    def setup(event_loop):
+        result["event_loop"] = event_loop
+        for reader, writer in pairs:
+            writer.send(b"x")
+            event_loop.add_handler(reader.fileno(), handler, EventLoop.READ)
+        result["start_time"] = time.time()
+        result["start_cpu"] = cpu_time()
+
+    try:
+        run_loop(setup)
+    finally:
+        for reader, writer in pairs:
+            reader.close()
+            writer.close()
+    LOGGER.info("handler dispatch with %4d ready fds: %.2fus each "
+                "(cpu %.2fus)",
+                fd_count, result["elapsed"] / dispatch_count * 1e6,
+                result["cpu"] / dispatch_count * 1e6)
+
+
+def bench_periodic_callback(callback_count=100, callback_time=10,
+                            duration=2.0):
+    # callback_count 个间隔 callback_time 毫秒的 PeriodicCallback ，
+    # 测量每次调用的 CPU 时间和相对于计划时间的延迟
+    lags = []
+    result = {}
+
+    def make_callback(event_loop, periodic):
+        def callback():
+            lags.append(event_loop.time() - periodic[0]._next_timeout)
+        return callback
+
+    def finish(event_loop, periodics):
+        result["cpu"] = cpu_time() - result["start_cpu"]
+        for periodic in periodics:
+            periodic.stop()
+        event_loop.stop()
+
+    def setup(event_loop):
+        periodics = []
+        for _ in range(callback_count):
+            holder = []
+            periodic = PeriodicCallback(
+                event_loop, make_callback(event_loop, holder),
+                callback_time)
+            holder.append(periodic)
+            periodics.append(periodic)
+        result["start_cpu"] = cpu_time()
+        for periodic in periodics:
+            periodic.start()
+        event_loop.call_later(duration, finish, event_loop, periodics)
+
+    run_loop(setup)
+    lags.sort()
+    LOGGER.info("PeriodicCallback x%d every %dms: %d calls, "
+                "cpu %.2fus each, lag p50=%.2fms p99=%.2fms",
+                callback_count, callback_time, len(lags),
+                result["cpu"] / len(lags) * 1e6,
+                percentile(lags, 50) * 1000, percentile(lags, 99) * 1000)
+
+
+def bench_waker(count=100000):
+    waker = Waker()
+    try:
+        start_time = time.time()
+        for _ in range(count):
+            waker.wake()
+            waker.consume()
+        time_elapsed = time.time() - start_time
+    finally:
+        waker.close()
+    LOGGER.info("Waker wake+consume: %.2fus each",
+                time_elapsed / count * 1e6)
+
+
+def bench_poll_impl(fd_count, rounds=20):
+    # register/modify/unregister 的开销，以及 fd_count 个 fd 都就绪时
+    # poll(0) 的开销
+    pairs = [socket.socketpair() for _ in range(fd_count)]
+    impl = PollImpl()
+    timings = {"register": 0.0, "modify": 0.0, "unregister": 0.0,
+               "poll": 0.0}
+    try:
+        for reader, writer in pairs:
+            writer.send(b"x")
+        fds = [reader.fileno() for reader, _ in pairs]
+        for _ in range(rounds):
+            start_time = time.time()
+            for fd in fds:
+                impl.register(fd, EventLoop.READ)
+            timings["register"] += time.time() - start_time
+            start_time = time.time()
+            for fd in fds:
+                impl.modify(fd, EventLoop.READ | EventLoop.WRITE)
+            timings["modify"] += time.time() - start_time
+            start_time = time.time()
+            impl.poll(0)
+            timings["poll"] += time.time() - start_time
+            start_time = time.time()
+            for fd in fds:
+                impl.unregister(fd)
+            timings["unregister"] += time.time() - start_time
+    finally:
+        impl.close()
+        for reader, writer in pairs:
+            reader.close()
+            writer.close()
+    operations = float(fd_count * rounds)
+    LOGGER.info("PollImpl with %4d fds: register=%.2fus modify=%.2fus "
+                "unregister=%.2fus poll(all ready)=%.1fus",
+                fd_count,
+                timings["register"] / operations * 1e6,
+                timings["modify"] / operations * 1e6,
+                timings["unregister"] / operations * 1e6,
+                timings["poll"] / rounds * 1e6)
+
+
+def test():
+    bench_add_callback()
+    bench_add_callback_threads()
+    bench_wake_latency()
+    bench_timeouts()
+    for fd_count in (1, 10, 100, 1000):
+        bench_handler_dispatch(fd_count)
+    bench_periodic_callback()
+    bench_waker()
+    for fd_count in (1, 10, 100, 1000):
+        bench_poll_impl(fd_count)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test()
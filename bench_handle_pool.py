@@ -0,0 +1,61 @@
+# coding: utf8
+
+import logging
+import resource
+import time
+
+from concurrent_http_client.curl_async_http_client import \
+    CurlAsyncHTTPClient
+from concurrent_http_client.event_loop import EventLoop
+from concurrent_http_client.waker import Waker
+
+LOGGER = logging.getLogger(__name__)
+
+def rss_kb():
+    # 只支持 Linux
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+def bench(name, max_clients, worker_count, min_clients):
+    event_loops = [EventLoop() for _ in range(worker_count)]
+    waker = Waker()
+    rss_before = rss_kb()
+    start_time = time.time()
+    clients = [CurlAsyncHTTPClient(
+                    max_clients,
+                    event_loop,
+                    waker,
+                    lambda: None,
+                    min_clients=min_clients)
+               for event_loop in event_loops]
+    time_elapsed = time.time() - start_time
+    rss_after = rss_kb()
+    LOGGER.info(
+        "%-6s max_clients=%d workers=%d min_clients=%d "
+        "startup=%.1fms rss=+%dKB",
+        name,
+        max_clients,
+        worker_count,
+        min_clients,
+        time_elapsed * 1000,
+        rss_after - rss_before)
+    for client in clients:
+        client.close()
+    for event_loop in event_loops:
+        event_loop.close()
+    waker.close()
+
+def test(max_clients=1000, worker_count=16):
+    # 先测试占用内存少的情况，避免复用之前释放的内存
+    bench("lazy", max_clients, worker_count, 0)
+    bench("warm", max_clients, worker_count, 10)
+    # 与旧的实现相同：启动时创建 max_clients 个句柄
+    bench("eager", max_clients, worker_count, max_clients)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test()
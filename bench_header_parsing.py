@@ -0,0 +1,98 @@
+# coding: utf8
+
+# 对比在 curl 的头部回调中逐行解析，与只保存原始头部、在访问时才解析的
+# 每个响应的 CPU 开销
+
+import logging
+import time
+
+from concurrent_http_client import httputil
+from concurrent_http_client.escape import native_str
+from concurrent_http_client.exceptions import HTTPInputException
+
+LOGGER = logging.getLogger(__name__)
+
+RESPONSE_HEADERS = [
+    b"HTTP/1.1 200 OK\r\n",
+    b"Server: nginx\r\n",
+    b"Date: Mon, 19 Oct 2026 08:00:00 GMT\r\n",
+    b"Content-Type: text/html; charset=utf-8\r\n",
+    b"Content-Length: 18342\r\n",
+    b"Connection: keep-alive\r\n",
+    b"Vary: Accept-Encoding\r\n",
+    b"Cache-Control: max-age=60\r\n",
+    b"ETag: \"5f1e-8a2c\"\r\n",
+    b"Last-Modified: Sun, 18 Oct 2026 08:00:00 GMT\r\n",
+    b"Set-Cookie: a=1; path=/\r\n",
+    b"Set-Cookie: b=2; path=/\r\n",
+    b"X-Request-Id: 3d1c0f2e-8a53-4b6e-9d4f-2c1e6b0a7f91\r\n",
+    b"Strict-Transport-Security: max-age=31536000\r\n",
+    b"\r\n",
+]
+
+REDIRECT_HEADERS = [
+    b"HTTP/1.1 302 Found\r\n",
+    b"Location: /next\r\n",
+    b"Content-Length: 0\r\n",
+    b"\r\n",
+] + RESPONSE_HEADERS
+
+
+def eager_header_callback(headers, header_line):
+    # 之前的实现：在 curl 的回调中逐行解析
+    header_line = native_str(header_line.decode('latin1'))
+    header_line = header_line.rstrip()
+    if header_line.startswith("HTTP/"):
+        headers.clear()
+        try:
+            (__, __, reason) = httputil.parse_response_start_line(header_line)
+            header_line = "X-Http-Reason: %s" % reason
+        except HTTPInputException:
+            return
+    if not header_line:
+        return
+    headers.parse_line(header_line)
+
+def eager(lines):
+    headers = httputil.HTTPHeaders()
+    for line in lines:
+        eager_header_callback(headers, line)
+    headers.get("X-Http-Reason")
+    return headers
+
+def lazy(lines, access):
+    raw_headers = []
+    callback = raw_headers.append
+    for line in lines:
+        callback(line)
+    httputil.parse_raw_content_length(raw_headers)
+    httputil.parse_raw_reason(raw_headers)
+    if access:
+        return httputil.parse_raw_headers(raw_headers)
+
+def bench(name, func, count):
+    start_time = time.time()
+    for i in range(count):
+        func()
+    time_elapsed = time.time() - start_time
+    LOGGER.info(
+        "%-24s %d responses, %.2fus/response",
+        name,
+        count,
+        time_elapsed / count * 10 ** 6)
+
+def test(count=100000):
+    assert sorted(eager(REDIRECT_HEADERS).get_all()) == \
+        sorted(lazy(REDIRECT_HEADERS, True).get_all())
+    for name, lines in (("direct", RESPONSE_HEADERS),
+                        ("redirect", REDIRECT_HEADERS)):
+        bench("%s eager" % name, lambda: eager(lines), count)
+        bench("%s lazy" % name, lambda: lazy(lines, False), count)
+        bench("%s lazy+access" % name, lambda: lazy(lines, True), count)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test()
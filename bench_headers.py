@@ -0,0 +1,92 @@
+# coding: utf8
+
+# HTTPHeaders 的构造、解析和查找的开销，使用几组常见的响应头部
+
+import logging
+import time
+
+from concurrent_http_client import httputil
+
+LOGGER = logging.getLogger(__name__)
+
+PAGE_HEADERS = [
+    ("Server", "nginx"),
+    ("Date", "Mon, 19 Oct 2026 08:00:00 GMT"),
+    ("Content-Type", "text/html; charset=utf-8"),
+    ("Content-Length", "18342"),
+    ("Connection", "keep-alive"),
+    ("Vary", "Accept-Encoding"),
+    ("Cache-Control", "max-age=60"),
+    ("ETag", "\"5f1e-8a2c\""),
+    ("Last-Modified", "Sun, 18 Oct 2026 08:00:00 GMT"),
+    ("X-Request-Id", "3d1c0f2e-8a53-4b6e-9d4f-2c1e6b0a7f91"),
+    ("Strict-Transport-Security", "max-age=31536000"),
+]
+
+API_HEADERS = [
+    ("content-type", "application/json"),
+    ("content-length", "512"),
+    ("date", "Mon, 19 Oct 2026 08:00:00 GMT"),
+    ("x-ratelimit-limit", "5000"),
+    ("x-ratelimit-remaining", "4999"),
+    ("x-ratelimit-reset", "1792396800"),
+    ("access-control-allow-origin", "*"),
+    ("x-content-type-options", "nosniff"),
+]
+
+# 登录页面等会设置大量的 cookie
+COOKIE_HEADERS = PAGE_HEADERS + [
+    ("Set-Cookie", "c%d=%s; path=/; HttpOnly" % (i, "v" * 32))
+    for i in range(50)
+]
+
+RESPONSE_SETS = [
+    ("page", PAGE_HEADERS),
+    ("api", API_HEADERS),
+    ("cookies", COOKIE_HEADERS),
+]
+
+def raw_lines(headers):
+    return [b"HTTP/1.1 200 OK\r\n"] + [
+        ("%s: %s\r\n" % (name, value)).encode("latin1")
+        for name, value in headers] + [b"\r\n"]
+
+def build(headers):
+    h = httputil.HTTPHeaders()
+    for name, value in headers:
+        h.add(name, value)
+    return h
+
+def lookup(h):
+    h.get("Content-Type")
+    h.get("Content-Length")
+    h.get("Set-Cookie")
+    "Location" in h
+    h.get_list("set-cookie")
+
+def bench(name, func, count):
+    start_time = time.time()
+    for i in range(count):
+        func()
+    time_elapsed = time.time() - start_time
+    LOGGER.info(
+        "%-16s %d responses, %.2fus/response",
+        name,
+        count,
+        time_elapsed / count * 10 ** 6)
+
+def test(count=50000):
+    for name, headers in RESPONSE_SETS:
+        lines = raw_lines(headers)
+        parsed = httputil.parse_raw_headers(lines)
+        bench("%s build" % name, lambda: build(headers), count)
+        bench("%s parse" % name,
+              lambda: httputil.parse_raw_headers(lines), count)
+        bench("%s lookup" % name, lambda: lookup(parsed), count)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test()
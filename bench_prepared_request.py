@@ -0,0 +1,79 @@
+# coding: utf8
+
+import logging
+import time
+from io import BytesIO
+
+from concurrent_http_client import httputil
+from concurrent_http_client.curl_async_http_client import \
+    CurlAsyncHTTPClient
+from concurrent_http_client.event_loop import EventLoop
+from concurrent_http_client.httpclient import \
+    HTTPRequest, PreparedRequest
+from concurrent_http_client.waker import Waker
+
+LOGGER = logging.getLogger(__name__)
+
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+    "Cache-Control": "no-cache",
+}
+
+def setup_plain(client, curl, i):
+    request = HTTPRequest(
+        "http://127.0.0.1/item/%d" % i,
+        headers=httputil.HTTPHeaders(HEADERS),
+        connect_timeout=4,
+        request_timeout=10)
+    client._curl_setup_request(
+        curl, request, BytesIO(), [])
+
+def setup_prepared(client, curl, i, template):
+    request = template.request("http://127.0.0.1/item/%d" % i)
+    client._curl_setup_request(
+        curl, request, BytesIO(), [])
+
+def bench(name, func, count):
+    start_time = time.time()
+    for i in range(count):
+        func(i)
+    time_elapsed = time.time() - start_time
+    LOGGER.info(
+        "%-10s %d requests, %.2fus/request",
+        name,
+        count,
+        time_elapsed / count * 10 ** 6)
+
+def test(count=100000):
+    event_loop = EventLoop()
+    waker = Waker()
+    client = CurlAsyncHTTPClient(
+                1,
+                event_loop,
+                waker,
+                lambda: None,
+                min_clients=1)
+    curl = client._free_list[0]
+    template = PreparedRequest(
+        headers=HEADERS,
+        connect_timeout=4,
+        request_timeout=10)
+    try:
+        bench("plain",
+              lambda i: setup_plain(client, curl, i),
+              count)
+        bench("prepared",
+              lambda i: setup_prepared(client, curl, i, template),
+              count)
+    finally:
+        client.close()
+        waker.close()
+        event_loop.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test()
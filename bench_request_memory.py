@@ -0,0 +1,91 @@
+# coding: utf8
+
+# 统计在队列中堆积大量请求时，每个请求占用的内存。队列中的每一项与
+# AbstractManager.fetch 中的一致： (request, future, queue_start_time)
+
+import gc
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from concurrent.futures import Future
+
+from concurrent_http_client.httpclient import HTTPRequest, PreparedRequest
+
+LOGGER = logging.getLogger(__name__)
+
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+}
+
+def make_plain(i):
+    return HTTPRequest("http://127.0.0.1/item/%d" % i,
+                       headers=HEADERS,
+                       connect_timeout=4,
+                       request_timeout=10)
+
+def make_prepared(template):
+    def make(i):
+        return template.request("http://127.0.0.1/item/%d" % i)
+    return make
+
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except IOError:
+        # 非 Linux 系统上只能得到峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def bench(name, make_request, count, with_future):
+    gc.collect()
+    rss_before = rss()
+    start_time = time.time()
+    queue = []
+    if with_future:
+        for i in range(count):
+            queue.append((make_request(i), Future(), time.time()))
+    else:
+        for i in range(count):
+            queue.append(make_request(i))
+    time_elapsed = time.time() - start_time
+    current = rss() - rss_before
+    if with_future:
+        name = name + "+future"
+    LOGGER.info(
+        "%-16s %d queued requests, %.0f bytes/request, "
+        "%.0fMB in total, %.2fus/request",
+        name,
+        count,
+        float(current) / count,
+        current / 1024.0 / 1024.0,
+        time_elapsed / count * 10 ** 6)
+    del queue
+
+def test(name, with_future, count=1000000):
+    template = PreparedRequest(headers=HEADERS,
+                               connect_timeout=4,
+                               request_timeout=10)
+    make_request = {
+        "plain": make_plain,
+        "prepared": make_prepared(template),
+    }[name]
+    bench(name, make_request, count, with_future)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    if len(sys.argv) > 1:
+        test(sys.argv[1], sys.argv[2] == "1")
+    else:
+        # 每种情况在单独的进程中运行，避免复用之前释放的内存
+        for name in ("plain", "prepared"):
+            for with_future in ("0", "1"):
+                subprocess.check_call(
+                    [sys.executable, __file__, name, with_future])
@@ -0,0 +1,160 @@
+# coding: utf8
+
+# 基准测试使用的本地 HTTP 服务器。响应可以通过服务器的参数配置，
+# 也可以通过查询参数逐个请求覆盖：
+#   size=<响应体字节数>  delay=<秒>  status=<状态码>  chunked=0|1
+# 例如 /?size=65536&delay=0.01
+
+import multiprocessing
+import random
+import socket
+import struct
+import threading
+import time
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlsplit(self.path).query)
+
+        def option(name, default, type):
+            values = query.get(name)
+            return type(values[0]) if values else default
+
+        delay = option("delay", server.latency, float)
+        if server.latency_jitter:
+            delay += random.random() * server.latency_jitter
+        if delay > 0:
+            time.sleep(delay)
+        if server.reset_rate and random.random() < server.reset_rate:
+            # 不发送响应直接断开连接， curl 会报告 errno 52 或 56
+            self.close_connection = True
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            return
+        status = option("status", 200, int)
+        if server.error_rate and random.random() < server.error_rate:
+            status = server.error_status
+        size = option("size", len(server.body), int)
+        body = server.body if size == len(server.body) else b"x" * size
+        chunked = option("chunked", server.chunked, int)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        if not server.keep_alive:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if not chunked:
+            self.wfile.write(body)
+            return
+        chunk_size = server.chunk_size
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.do_GET()
+
+
+class BenchServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server answering every request with ``body_size``
+    bytes after ``latency`` (plus up to ``latency_jitter``) seconds.
+
+    ``chunked`` sends the body in ``chunk_size`` chunks, ``keep_alive``
+    False closes every connection, ``error_rate`` of the responses get
+    ``error_status`` and ``reset_rate`` of the connections are reset
+    without a response.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, body_size=1024, port=0, latency=0.0,
+                 latency_jitter=0.0, chunked=False, chunk_size=16384,
+                 keep_alive=True, error_rate=0.0, error_status=500,
+                 reset_rate=0.0):
+        HTTPServer.__init__(self, ("127.0.0.1", port), _Handler)
+        self.body = b"x" * body_size
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.keep_alive = keep_alive
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reset_rate = reset_rate
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def _serve(conn, options):
+    server = BenchServer(**options)
+    conn.send(server.url)
+    conn.close()
+    server.serve_forever()
+
+
+class BenchServerProcess(object):
+    """Runs a `BenchServer` in a child process, so that its CPU time and
+    memory are not counted as the ones of the benchmark.
+    """
+    def __init__(self, **options):
+        self.options = options
+        self.url = None
+        self._process = None
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(child_conn, self.options))
+        self._process.daemon = True
+        self._process.start()
+        self.url = parent_conn.recv()
+        parent_conn.close()
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,85 @@
+# coding: utf8
+
+import logging
+import time
+
+from bench_server import BenchServer
+from concurrent_http_client import poll_impl
+from concurrent_http_client.manager import \
+    CurlAsyncHTTPClientManager
+from concurrent_http_client.httpclient import \
+    HTTPRequest
+
+LOGGER = logging.getLogger(__name__)
+
+
+_PollImpl = poll_impl.PollImpl
+
+
+class _CountingPollImpl(object):
+    """Counts the calls that end up as epoll_ctl (or kevent) syscalls."""
+    counts = {"register": 0, "modify": 0, "unregister": 0}
+
+    def __init__(self):
+        self._impl = _PollImpl()
+
+    def register(self, fd, events):
+        self.counts["register"] += 1
+        return self._impl.register(fd, events)
+
+    def modify(self, fd, events):
+        self.counts["modify"] += 1
+        return self._impl.modify(fd, events)
+
+    def unregister(self, fd):
+        self.counts["unregister"] += 1
+        return self._impl.unregister(fd)
+
+    def poll(self, timeout):
+        return self._impl.poll(timeout)
+
+    def close(self):
+        self._impl.close()
+
+
+def test(request_count=5000, max_clients=50, keep_alive=True):
+    poll_impl.PollImpl = _CountingPollImpl
+    server = BenchServer().start()
+    manager = CurlAsyncHTTPClientManager(
+        max_clients=max_clients,
+        max_queue_size=request_count,
+        worker_count=1)
+    manager.start()
+    headers = None if keep_alive else {"Connection": "close"}
+    try:
+        start_time = time.time()
+        fs = [manager.fetch(HTTPRequest(server.url, headers=headers))
+              for _ in range(request_count)]
+        for f in fs:
+            f.result()
+        time_elapsed = time.time() - start_time
+    finally:
+        manager.stop()
+        server.stop()
+        poll_impl.PollImpl = _PollImpl
+    counts = _CountingPollImpl.counts
+    LOGGER.info(
+        "keep_alive=%s requests=%d elapsed=%.2fs "
+        "register=%d modify=%d unregister=%d ctl/request=%.2f",
+        keep_alive,
+        request_count,
+        time_elapsed,
+        counts["register"],
+        counts["modify"],
+        counts["unregister"],
+        float(sum(counts.values())) / request_count)
+    for key in counts:
+        counts[key] = 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T")
+    test(keep_alive=True)
+    test(keep_alive=False)
@@ -0,0 +1,187 @@
+# coding: utf8
+
+# 使用本地服务器的吞吐量基准测试：遍历 worker_count 、 max_clients 和
+# max_queue_size 的组合，报告 requests/s 、延迟的百分位数、每个请求的
+# CPU 时间和 RSS 。每个组合的结果是一行 JSON ，追加到命令行参数指定的
+# 文件（默认为标准输出），便于跟踪性能回归。
+# 服务器运行在子进程中，不计入 CPU 时间和 RSS
+
+import argparse
+import itertools
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+
+from bench_server import BenchServerProcess
+from concurrent_http_client.exceptions import QueueFullException
+from concurrent_http_client.manager import \
+    CurlAsyncHTTPClientManager
+from concurrent_http_client.httpclient import \
+    HTTPRequest
+
+LOGGER = logging.getLogger(__name__)
+
+# 服务器的场景：名称 -> BenchServer 的参数
+SCENARIOS = (
+    ("small", dict(body_size=1024)),
+    ("large", dict(body_size=1024 * 1024)),
+    ("chunked", dict(body_size=256 * 1024, chunked=True, chunk_size=8192)),
+    ("latency", dict(body_size=1024, latency=0.01, latency_jitter=0.01)),
+    ("no_keep_alive", dict(body_size=1024, keep_alive=False)),
+    ("errors", dict(body_size=1024, error_rate=0.05, reset_rate=0.01)),
+)
+
+WORKER_COUNTS = (1, 2, 4)
+MAX_CLIENTS = (10, 50)
+MAX_QUEUE_SIZES = (100, 10000)
+
+
+def rss_kb():
+    # 只支持 Linux
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def bench(url, request_count, worker_count, max_clients, max_queue_size):
+    manager = CurlAsyncHTTPClientManager(
+        max_clients=max_clients,
+        max_queue_size=max_queue_size,
+        worker_count=worker_count)
+    manager.start()
+    # 未完成的请求最多为队列长度（ worker 取走请求之前，所有的请求都在
+    # 队列中），超出时提交者等待，而不是让队列满
+    semaphore = threading.Semaphore(max_queue_size)
+    lock = threading.Lock()
+    latencies = []
+    counts = {"finished": 0, "errors": 0, "queue_full": 0}
+    finished = threading.Event()
+
+    def done(f, submit_time):
+        latency = time.time() - submit_time
+        error = f.exception()
+        if error is None:
+            error = f.result().error
+        with lock:
+            counts["finished"] += 1
+            if isinstance(error, QueueFullException):
+                counts["queue_full"] += 1
+            else:
+                latencies.append(latency)
+                if error is not None:
+                    counts["errors"] += 1
+            if counts["finished"] == request_count:
+                finished.set()
+        semaphore.release()
+
+    rss_before = rss_kb()
+    cpu_before = cpu_time()
+    start_time = time.time()
+    try:
+        for _ in range(request_count):
+            semaphore.acquire()
+            submit_time = time.time()
+            f = manager.fetch(HTTPRequest(url))
+            f.add_done_callback(
+                lambda f, submit_time=submit_time: done(f, submit_time))
+        finished.wait()
+        time_elapsed = time.time() - start_time
+        cpu_elapsed = cpu_time() - cpu_before
+        rss_after = rss_kb()
+    finally:
+        manager.stop()
+    latencies.sort()
+    return {
+        "requests": request_count,
+        "errors": counts["errors"],
+        "queue_full": counts["queue_full"],
+        "elapsed": time_elapsed,
+        "requests_per_second": request_count / time_elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_p999": percentile(latencies, 99.9),
+        "latency_max": latencies[-1] if latencies else None,
+        "cpu_per_request": cpu_elapsed / request_count,
+        "rss_kb": rss_after,
+        "rss_delta_kb": rss_after - rss_before,
+    }
+
+
+def format_ms(seconds):
+    # 所有的请求都因为队列满而失败时没有延迟
+    return "-" if seconds is None else "%.1fms" % (seconds * 1000)
+
+
+def test(request_count=2000, scenarios=SCENARIOS,
+         worker_counts=WORKER_COUNTS, max_clients=MAX_CLIENTS,
+         max_queue_sizes=MAX_QUEUE_SIZES, output=None):
+    out = open(output, "a") if output else sys.stdout
+    try:
+        for name, options in scenarios:
+            server = BenchServerProcess(**options).start()
+            try:
+                for worker_count, clients, max_queue_size in \
+                        itertools.product(worker_counts, max_clients,
+                                          max_queue_sizes):
+                    result = bench(server.url, request_count, worker_count,
+                                   clients, max_queue_size)
+                    LOGGER.info(
+                        "%-13s workers=%d max_clients=%-3d queue=%-5d "
+                        "%.0f req/s p50=%s p99=%s "
+                        "cpu/request=%.0fus rss=%dKB errors=%d "
+                        "queue_full=%d",
+                        name, worker_count, clients, max_queue_size,
+                        result["requests_per_second"],
+                        format_ms(result["latency_p50"]),
+                        format_ms(result["latency_p99"]),
+                        result["cpu_per_request"] * 1e6,
+                        result["rss_kb"],
+                        result["errors"],
+                        result["queue_full"])
+                    result.update(
+                        scenario=name,
+                        server=options,
+                        worker_count=worker_count,
+                        max_clients=clients,
+                        max_queue_size=max_queue_size,
+                        timestamp=time.time())
+                    out.write(json.dumps(result, sort_keys=True) + "\n")
+                    out.flush()
+            finally:
+                server.stop()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+        format="%(asctime)s %(filename)s:"
+            "%(lineno)d %(message)s",
+        datefmt="%F %T",
+        stream=sys.stderr)
+    parser = argparse.ArgumentParser(
+        description="Sweeps worker_count, max_clients and max_queue_size "
+                    "against a local server.")
+    parser.add_argument("output", nargs="?",
+                        help="file the JSON lines are appended to "
+                             "(default: standard output)")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="requests per sweep point (default: 2000)")
+    args = parser.parse_args()
+    test(request_count=args.requests, output=args.output)
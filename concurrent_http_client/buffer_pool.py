@@ -0,0 +1,297 @@
+# coding: utf8
+
+# 响应体缓冲区：从按大小分级的缓冲池中分配，并且可以在不复制的情况下
+# 以 memoryview 的形式访问响应体。超过阈值的响应体会被写入到文件中
+
+import mmap
+import os
+import tempfile
+import threading
+
+# 缓冲区的大小分级：4KB, 8KB, ..., 16MB 。更大的缓冲区按照实际大小分配，
+# 并且不会被缓存
+_MIN_CLASS_SHIFT = 12
+_MAX_CLASS_SHIFT = 24
+# 根据 Content-Length 预先分配的最大字节数，避免对方服务器声明一个
+# 巨大的 Content-Length 时，一次性分配过多的内存
+_MAX_RESERVE = 1 << 26
+
+
+def _size_class(size):
+    shift = _MIN_CLASS_SHIFT
+    while (1 << shift) < size:
+        shift = shift + 1
+    return shift
+
+
+class BufferPool(object):
+    """A thread-safe pool of ``bytearray`` objects, grouped into
+    power-of-two size classes.
+
+    At most ``max_bytes`` bytes are kept in the pool; buffers released
+    beyond that limit are left to the garbage collector.
+
+    >>> pool = BufferPool()
+    >>> buf = pool.acquire(5000)
+    >>> len(buf)
+    8192
+    >>> pool.release(buf)
+    >>> pool.acquire(6000) is buf
+    True
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._free = dict(
+            (shift, []) for shift in
+            range(_MIN_CLASS_SHIFT, _MAX_CLASS_SHIFT + 1))
+        self._pooled_bytes = 0
+        self._stats = {"acquired": 0, "reused": 0, "released": 0}
+
+    def acquire(self, size):
+        """Returns a ``bytearray`` of at least ``size`` bytes."""
+        shift = _size_class(size)
+        if shift > _MAX_CLASS_SHIFT:
+            with self._lock:
+                self._stats["acquired"] += 1
+            return bytearray(size)
+        with self._lock:
+            self._stats["acquired"] += 1
+            free = self._free[shift]
+            if free:
+                self._stats["reused"] += 1
+                self._pooled_bytes -= 1 << shift
+                return free.pop()
+        return bytearray(1 << shift)
+
+    def release(self, buf):
+        """Returns a buffer obtained from `acquire` to the pool.  The
+        caller must not use the buffer, or any view of it, afterwards.
+        """
+        size = len(buf)
+        shift = _size_class(size)
+        if shift > _MAX_CLASS_SHIFT or (1 << shift) != size:
+            return
+        with self._lock:
+            if self._pooled_bytes + size > self._max_bytes:
+                return
+            self._stats["released"] += 1
+            self._pooled_bytes += size
+            self._free[shift].append(buf)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pooled_bytes"] = self._pooled_bytes
+        return stats
+
+
+class ResponseBuffer(object):
+    """A write-once, file-like response body backed by a pooled
+    ``bytearray``.
+
+    It supports the subset of the ``BytesIO`` interface used by
+    `HTTPResponse` (``write``, ``read``, ``seek``, ``tell``,
+    ``getvalue``, ``getbuffer`` and ``close``).  `getbuffer` returns a
+    ``memoryview`` of the body without copying it.
+
+    Once the body grows beyond ``spill_threshold`` bytes it is moved to
+    ``spill_path``, or to an anonymous temporary file, and the rest of
+    the transfer is streamed there.  `getbuffer` then returns a view of
+    a read-only ``mmap`` of the file.
+
+    ``size_hint``, if given, is called before the first write and may
+    return the expected size of the body (see `reserve`).  The sizes
+    to reserve are capped at ``max_size`` (the request's
+    ``max_body_length``), since they come from the server.
+
+    >>> buffer = ResponseBuffer(BufferPool())
+    >>> buffer.write(b"hello, ")
+    7
+    >>> buffer.write(b"world")
+    5
+    >>> bytes(buffer.getbuffer())
+    b'hello, world'
+    >>> buffer.seek(7)
+    7
+    >>> buffer.read()
+    b'world'
+    """
+    def __init__(self, pool=None, spill_threshold=None, spill_path=None,
+                 size_hint=None, max_size=None):
+        self._pool = pool
+        self._size_hint = size_hint
+        self._max_size = max_size
+        self._spill_threshold = spill_threshold
+        self._spill_path = spill_path
+        self._buf = None
+        self._file = None
+        self._mmap = None
+        self._length = 0
+        self._pos = 0
+        self.closed = False
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    @property
+    def length(self):
+        """The number of bytes written so far."""
+        return self._length
+
+    @property
+    def file(self):
+        """The file the body was spilled to, or None."""
+        return self._file
+
+    def _spill(self):
+        if self._spill_path is not None:
+            self._file = open(self._spill_path, "w+b")
+        else:
+            self._file = tempfile.TemporaryFile()
+        buf, self._buf = self._buf, None
+        if buf is not None:
+            self._file.write(memoryview(buf)[:self._length])
+            self._release(buf)
+
+    def _acquire(self, size):
+        if self._pool is None:
+            return bytearray(1 << _size_class(size))
+        return self._pool.acquire(size)
+
+    def _release(self, buf):
+        if self._pool is not None:
+            self._pool.release(buf)
+
+    def reserve(self, size):
+        """Preallocates room for ``size`` bytes, typically taken from
+        the ``Content-Length`` header.  Only effective before the
+        first write.
+        """
+        if self._length or size <= 0 or self._file is not None:
+            return
+        if self._max_size:
+            size = min(size, self._max_size)
+        if self._spill_threshold is not None and \
+                size > self._spill_threshold:
+            self._spill()
+            return
+        size = min(size, _MAX_RESERVE)
+        if self._buf is not None:
+            if len(self._buf) >= size:
+                return
+            self._release(self._buf)
+        self._buf = self._acquire(size)
+
+    def write(self, chunk):
+        if self._size_hint is not None:
+            # 响应头部在第一次写入之前已经接收完毕
+            size_hint, self._size_hint = self._size_hint, None
+            size = size_hint()
+            if size:
+                self.reserve(size)
+        length = len(chunk)
+        end = self._length + length
+        if self._file is None and self._spill_threshold is not None \
+                and end > self._spill_threshold:
+            self._spill()
+        if self._file is not None:
+            self._file.write(chunk)
+            self._length = end
+            return length
+        buf = self._buf
+        if buf is None or end > len(buf):
+            new_buf = self._acquire(
+                max(end, 2 * len(buf) if buf is not None else 0))
+            if buf is not None:
+                new_buf[:self._length] = memoryview(buf)[:self._length]
+                self._release(buf)
+            self._buf = buf = new_buf
+        buf[self._length:end] = chunk
+        self._length = end
+        return length
+
+    def getbuffer(self):
+        """Returns a read-only view of the body without copying it.
+        The view is only valid until `release` is called.
+        """
+        if self._file is not None and self._length:
+            if self._mmap is None:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), self._length,
+                                       access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)
+        if self._buf is None:
+            return memoryview(b"")
+        view = memoryview(self._buf)[:self._length]
+        if hasattr(view, "toreadonly"):  # Python 3.8+
+            view = view.toreadonly()
+        return view
+
+    def getvalue(self):
+        if self._file is not None:
+            self._file.seek(0)
+            return self._file.read(self._length)
+        if self._buf is None:
+            return b""
+        return bytes(memoryview(self._buf)[:self._length])
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos = self._pos + pos
+        elif whence == 2:
+            pos = self._length + pos
+        self._pos = max(0, pos)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        start = min(self._pos, self._length)
+        if size is None or size < 0:
+            end = self._length
+        else:
+            end = min(self._length, start + size)
+        self._pos = end
+        if self._file is not None:
+            self._file.seek(start)
+            return self._file.read(end - start)
+        if self._buf is None:
+            return b""
+        return bytes(memoryview(self._buf)[start:end])
+
+    def release(self):
+        """Returns the underlying buffer to the pool.  Views obtained
+        from `getbuffer` must not be used afterwards.
+        """
+        buf, self._buf = self._buf, None
+        self._length = self._pos = 0
+        self.closed = True
+        if buf is not None:
+            self._release(buf)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 仍然有 memoryview 引用该 mmap ，由垃圾回收关闭
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    close = release
+
+    def discard(self):
+        """Releases the buffer and removes the partially written
+        ``spill_path``, if any.
+        """
+        spilled = self._file is not None
+        self.release()
+        if spilled and self._spill_path is not None:
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
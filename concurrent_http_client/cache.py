@@ -0,0 +1,511 @@
+# coding: utf8
+
+# 位于 AbstractManager.fetch 之前的内存 HTTP 缓存（ RFC 7234 的私有缓存）：
+# 新鲜的响应直接返回，不进入队列；过期的响应带上 If-None-Match /
+# If-Modified-Since 重新验证， 304 响应与缓存的响应合并为完整的响应。
+# 缓存按字节数限制大小，按 LRU 淘汰
+
+import calendar
+import collections
+import copy
+import email.utils
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+from io import BytesIO
+
+from . import httputil
+from .httpclient import HTTPResponse
+from .escape import native_str
+
+LOGGER = logging.getLogger(__name__)
+
+# 可以缓存的状态码（ RFC 7231 6.1 中默认可缓存的状态码的子集）
+CACHEABLE_STATUSES = frozenset([200, 203, 300, 301, 308, 404, 410])
+
+# 304 响应中的这些头部不能更新缓存的响应
+_NOT_UPDATED_HEADERS = frozenset(["Content-Length", "Content-Encoding",
+                                  "Transfer-Encoding", "X-Http-Reason"])
+
+# 每个条目除了响应体和头部以外的大致开销
+_ENTRY_OVERHEAD = 512
+
+# 可能改变响应内容的请求选项（不通过请求头部传递），与 Vary 的值一起
+# 区分条目
+_KEY_OPTIONS = ("decompress_response", "accept_encoding", "follow_redirects",
+                "max_redirects", "validate_cert", "ca_certs",
+                "max_body_length")
+
+
+def parse_cache_control(value):
+    """Parses a ``Cache-Control`` header into a dict; directives
+    without an argument map to None.
+
+    >>> sorted(parse_cache_control('max-age=60, no-cache, private="x"').items())
+    [('max-age', '60'), ('no-cache', None), ('private', 'x')]
+    """
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        name, sep, argument = part.partition("=")
+        name = name.strip().lower()
+        if not name:
+            continue
+        directives[name] = argument.strip().strip('"') if sep else None
+    return directives
+
+
+def _parse_seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    parsed = email.utils.parsedate(value)
+    if parsed is None:
+        return None
+    return calendar.timegm(parsed)
+
+
+def _request_headers(request):
+    headers = request.headers
+    if not isinstance(headers, httputil.HTTPHeaders):
+        # 请求的头部可以是普通的 dict
+        headers = httputil.HTTPHeaders(headers)
+    return headers
+
+
+def _is_authenticated(request, headers):
+    return "Authorization" in headers or "Cookie" in headers or \
+        request.auth_username is not None or \
+        request.client_cert is not None
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item))
+                            for key, item in value.items()))
+    return value
+
+
+def _variant_key(request, headers, names):
+    return (request.url, tuple(headers.get(name) for name in names),
+            tuple(_hashable(getattr(request, name))
+                  for name in _KEY_OPTIONS))
+
+
+class _Entry(object):
+    __slots__ = ("key", "names", "code", "reason", "headers", "body",
+                 "effective_url", "stored_at", "age", "lifetime", "no_cache",
+                 "size")
+
+    def __init__(self, key, names, code, reason, headers, body,
+                 effective_url, stored_at):
+        self.key = key
+        # 响应的 Vary 指定的头部名称
+        self.names = names
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.effective_url = effective_url
+        self.size = len(body) + _ENTRY_OVERHEAD + sum(
+            len(name) + len(value) for name, value in headers.get_all())
+        self.refresh(headers, stored_at)
+
+    def refresh(self, headers, now):
+        self.stored_at = now
+        self.age = _parse_seconds(headers.get("Age")) or 0
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        self.no_cache = "no-cache" in directives
+        lifetime = _parse_seconds(directives.get("max-age"))
+        if lifetime is None and "Expires" in headers:
+            expires = _parse_date(headers.get("Expires"))
+            date = _parse_date(headers.get("Date")) or now
+            # 无效的 Expires 表示已经过期
+            lifetime = max(0, expires - date) if expires is not None else 0
+        self.lifetime = lifetime or 0
+
+    def current_age(self, now):
+        return self.age + max(0, now - self.stored_at)
+
+    def validators(self):
+        return self.headers.get("ETag"), self.headers.get("Last-Modified")
+
+    def to_meta(self):
+        return {"c": self.code, "r": self.reason,
+                "h": list(self.headers.get_all()),
+                "e": self.effective_url, "t": self.stored_at}
+
+    def to_response(self, request):
+        return HTTPResponse(
+            request=request, code=self.code, reason=self.reason,
+            headers=self.headers.copy(), buffer=BytesIO(self.body),
+            effective_url=self.effective_url, request_time=0.0,
+            start_time=time.time())
+
+
+def _entry_from_meta(key, names, meta, body):
+    headers = httputil.HTTPHeaders()
+    for name, value in meta["h"]:
+        headers.add(native_str(name), native_str(value))
+    return _Entry(key, names, meta["c"], native_str(meta["r"]), headers,
+                  body, native_str(meta["e"]), meta["t"])
+
+
+class HTTPCache(object):
+    """A private in-memory HTTP cache in front of `AbstractManager.fetch`.
+
+    Only GET requests without ``streaming_callback``, ``body_producer``,
+    credentials (``Authorization``, ``Cookie``, ``auth_username`` or
+    ``client_cert``) or conditional headers of their own are looked up.
+    Requests with different decoding, redirect, certificate verification
+    or body limit options never share entries.  Responses with one of
+    `CACHEABLE_STATUSES` are stored unless ``no-store`` is given or the
+    body is larger than ``max_entry_bytes``; responses to requests with
+    credentials only if they are ``public`` or have ``s-maxage``
+    (RFC 7234 3.2), since the entries are shared by every caller.  ``Vary`` selects the
+    variant by the request headers it names (``Vary: *`` is not stored).
+
+    A response is fresh for its ``max-age`` (or ``Expires`` - ``Date``)
+    minus its ``Age``.  Fresh responses are returned in an already
+    completed future.  Stale responses, and every response when the
+    request or the response says ``no-cache``, are revalidated with
+    their ``ETag`` / ``Last-Modified``; a 304 refreshes the entry and is
+    returned as the full cached response.  Successful unsafe requests
+    invalidate the entries of their URL.
+
+    At most ``max_bytes`` are kept, the least recently used entries are
+    evicted first.  It is thread-safe.
+
+    With a ``store`` (a `DiskCacheStore`), the entries are also written
+    to disk (by the store's writer thread), and looked up there, without
+    holding the cache's lock, when they are not in memory.  With
+    ``warm``, the most recently stored entries are loaded from the store
+    at construction.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=None,
+                 store=None, warm=False):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8 \
+            if max_entry_bytes is None else max_entry_bytes
+        self._lock = threading.Lock()
+        # (url, 请求头部中 Vary 指定的值) -> _Entry
+        self._entries = collections.OrderedDict()
+        # url -> (Vary 指定的头部名称, 该 url 的条目的键)
+        self._vary = {}
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "revalidated": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "bypasses": 0,
+            "disk_hits": 0,
+        }
+        self._store_backend = store
+        if store is not None and warm:
+            # 最近写入的条目最后插入，最晚被淘汰
+            for key, meta, body in reversed(store.recent(max_bytes)):
+                names = store.get_vary(key[0])
+                # 旧版本写入的条目没有请求选项
+                if names is None or len(key) != 3:
+                    continue
+                with self._lock:
+                    if key not in self._entries:
+                        self._insert(_entry_from_meta(key, names, meta, body))
+
+    def fetch(self, request, fetch):
+        """Returns a future of the response to ``request``, served from
+        the cache when possible; ``fetch`` sends a request.
+        """
+        if request.method != "GET":
+            if request.method in ("HEAD", "OPTIONS", "TRACE"):
+                return fetch(request)
+            future = fetch(request)
+            future.add_done_callback(
+                lambda f: self._invalidate_after(request.url, f))
+            return future
+        headers = _request_headers(request)
+        if request.streaming_callback is not None or \
+                request.body_producer is not None or \
+                "If-None-Match" in headers or \
+                "If-Modified-Since" in headers:
+            self._count("bypasses")
+            return fetch(request)
+        if _is_authenticated(request, headers):
+            # 不返回缓存的响应，只存储可以共享的响应
+            self._count("bypasses")
+            return self._fetch_and_store(request, fetch)
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in directives:
+            self._count("bypasses")
+            return fetch(request)
+
+        with self._lock:
+            entry = self._lookup(request, headers)
+        if entry is None and self._store_backend is not None:
+            # 读取磁盘时不持有锁
+            entry = self._load(request, headers)
+        now = time.time()
+        with self._lock:
+            if entry is not None:
+                self._touch(entry)
+                if not entry.no_cache and "no-cache" not in directives \
+                        and self._is_fresh(entry, directives, now):
+                    self._stats["hits"] += 1
+                    future = Future()
+                    future.set_result(entry.to_response(request))
+                    return future
+                etag, last_modified = entry.validators()
+                if etag is None and last_modified is None:
+                    entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["revalidations"] += 1
+
+        if entry is None:
+            return self._fetch_and_store(request, fetch)
+
+        # 重新验证时不能修改调用者的请求
+        conditional = copy.copy(request)
+        conditional.headers = httputil.HTTPHeaders(headers)
+        # PreparedRequest 模板使用预先计算的请求头，不会包含条件头部
+        conditional.prepared = None
+        if etag is not None:
+            conditional.headers["If-None-Match"] = etag
+        if last_modified is not None:
+            conditional.headers["If-Modified-Since"] = last_modified
+        outer = Future()
+        inner = fetch(conditional)
+        outer.add_done_callback(
+            lambda f: f.cancelled() and inner.cancel())
+        inner.add_done_callback(
+            lambda f: self._revalidated(request, entry, f, outer))
+        return outer
+
+    def _is_fresh(self, entry, directives, now):
+        age = entry.current_age(now)
+        max_age = _parse_seconds(directives.get("max-age"))
+        if max_age is not None and age > max_age:
+            return False
+        return entry.lifetime > age
+
+    def _touch(self, entry):
+        entries = self._entries
+        if entries.get(entry.key) is not entry:
+            # 在查找之后被淘汰或替换了
+            return
+        if hasattr(entries, "move_to_end"):
+            entries.move_to_end(entry.key)
+        else:
+            # Python 2 的 OrderedDict 没有 move_to_end
+            entries[entry.key] = entries.pop(entry.key)
+
+    def _lookup(self, request, headers):
+        vary = self._vary.get(request.url)
+        if vary is not None:
+            return self._entries.get(_variant_key(request, headers, vary[0]))
+        return None
+
+    def _load(self, request, headers):
+        store = self._store_backend
+        names = store.get_vary(request.url)
+        if names is None:
+            return None
+        key = _variant_key(request, headers, names)
+        loaded = store.get(key)
+        if loaded is None:
+            return None
+        entry = _entry_from_meta(key, names, loaded[0], loaded[1])
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            current = self._entries.get(key)
+            if current is not None:
+                # 其他线程同时从磁盘读取了同一个条目
+                return current
+            self._insert(entry)
+        return entry
+
+    def _revalidated(self, request, entry, inner, outer):
+        if inner.cancelled():
+            outer.cancel()
+            return
+        exc = inner.exception()
+        if exc is not None:
+            if outer.set_running_or_notify_cancel():
+                outer.set_exception(exc)
+            return
+        response = inner.result()
+        if response.code == 304:
+            self._count("revalidated")
+            now = time.time()
+            with self._lock:
+                for name, value in response.headers.get_all():
+                    if name not in _NOT_UPDATED_HEADERS:
+                        entry.headers[name] = value
+                entry.refresh(entry.headers, now)
+                cached = entry.to_response(request)
+                meta = entry.to_meta()
+            response.release()
+            response = cached
+            if self._store_backend is not None:
+                self._store_backend.put(entry.key, entry.names, meta,
+                                        entry.body)
+        else:
+            self._store(request, response)
+        if outer.set_running_or_notify_cancel():
+            outer.set_result(response)
+
+    def _fetch_and_store(self, request, fetch):
+        # 在调用者拿到响应之前存储，调用者可能在拿到响应之后立即调用
+        # release() 将缓冲区还给缓冲池
+        outer = Future()
+        inner = fetch(request)
+        outer.add_done_callback(
+            lambda f: f.cancelled() and inner.cancel())
+        inner.add_done_callback(
+            lambda f: self._stored(request, f, outer))
+        return outer
+
+    def _stored(self, request, inner, outer):
+        if inner.cancelled():
+            outer.cancel()
+            return
+        exc = inner.exception()
+        if exc is not None:
+            if outer.set_running_or_notify_cancel():
+                outer.set_exception(exc)
+            return
+        response = inner.result()
+        try:
+            self._store(request, response)
+        except Exception:
+            # 存储失败不影响调用者
+            LOGGER.error("Error storing %s", request.url, exc_info=True)
+        if outer.set_running_or_notify_cancel():
+            outer.set_result(response)
+
+    def _store(self, request, response):
+        if response.code not in CACHEABLE_STATUSES:
+            return
+        headers = response.headers
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in directives:
+            return
+        if _is_authenticated(request, _request_headers(request)) and \
+                "public" not in directives and "s-maxage" not in directives:
+            return
+        vary = headers.get("Vary")
+        names = ()
+        if vary:
+            names = tuple(sorted(set(httputil._normalize_header(
+                name.strip()) for name in vary.split(",") if name.strip())))
+            if "*" in names:
+                return
+        buffer = response.buffer
+        # 避免读出过大的（可能已经写入文件的）响应体
+        if buffer is None or \
+                getattr(buffer, "length", 0) > self.max_entry_bytes:
+            return
+        body = response.body
+        if len(body) > self.max_entry_bytes:
+            return
+        key = _variant_key(request, _request_headers(request), names)
+        entry = _Entry(key, names, response.code, response.reason,
+                       headers.copy(), body, response.effective_url,
+                       time.time())
+        if entry.lifetime <= 0 and entry.validators() == (None, None):
+            # 既不新鲜，也无法重新验证
+            return
+        with self._lock:
+            self._insert(entry)
+            self._stats["stores"] += 1
+        if self._store_backend is not None:
+            self._store_backend.put(key, names, entry.to_meta(), body)
+
+    def _insert(self, entry):
+        url = entry.key[0]
+        vary = self._vary.get(url)
+        if vary is not None and vary[0] != entry.names:
+            # Vary 改变之后，之前的条目都无法再命中
+            self._remove_url(url)
+            vary = None
+        if vary is None:
+            vary = self._vary[url] = (entry.names, set())
+        old = self._entries.pop(entry.key, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._entries[entry.key] = entry
+        self._bytes += entry.size
+        vary[1].add(entry.key)
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._discard(evicted)
+            self._stats["evictions"] += 1
+
+    def _discard(self, entry):
+        self._bytes -= entry.size
+        url = entry.key[0]
+        keys = self._vary[url][1]
+        keys.discard(entry.key)
+        if not keys:
+            del self._vary[url]
+
+    def _remove_url(self, url):
+        vary = self._vary.pop(url, None)
+        if vary is None:
+            return
+        for key in vary[1]:
+            self._bytes -= self._entries.pop(key).size
+
+    def _invalidate_after(self, url, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        response = future.result()
+        if response.code >= 400:
+            return
+        with self._lock:
+            if url in self._vary:
+                self._remove_url(url)
+                self._stats["invalidations"] += 1
+        if self._store_backend is not None:
+            self._store_backend.delete_url(url)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vary.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        """Returns the counters ``hits`` (fresh responses served),
+        ``misses``, ``revalidations`` (conditional requests sent),
+        ``revalidated`` (304 responses merged), ``stores``,
+        ``evictions``, ``invalidations`` (by unsafe requests) and
+        ``bypasses`` (requests not looked up), ``disk_hits`` (entries
+        loaded from the store), and the current
+        ``entries`` and ``bytes``.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
@@ -0,0 +1,228 @@
+# coding: utf8
+
+# 按源站（ scheme://host:port ）熔断：连续失败或者失败比例超过阈值时打开，
+# 之后的请求在 worker 中直接失败，不占用 curl 句柄，也不必等待连接超时。
+# 打开一段时间之后进入半开状态，只放行少量的探测请求，探测成功则关闭
+
+import collections
+import threading
+import time
+
+import pycurl
+
+from .exceptions import CurlException
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 说明源站不可用的错误，其他错误（比如 4xx ）不计入
+DEFAULT_FAILURE_ERRNOS = frozenset([
+    pycurl.E_COULDNT_RESOLVE_HOST,
+    pycurl.E_COULDNT_CONNECT,
+    pycurl.E_OPERATION_TIMEDOUT,
+    pycurl.E_GOT_NOTHING,
+    pycurl.E_SEND_ERROR,
+    pycurl.E_RECV_ERROR,
+    pycurl.E_SSL_CONNECT_ERROR,
+])
+
+DEFAULT_FAILURE_STATUSES = frozenset([502, 503, 504])
+
+
+def get_origin(url):
+    """Returns the ``scheme://host[:port]`` part of ``url``.
+
+    >>> get_origin("http://example.com:8080/a/b?c=d")
+    'http://example.com:8080'
+    >>> get_origin("https://example.com")
+    'https://example.com'
+    """
+    parts = url.split("/", 3)
+    if len(parts) < 3:
+        return url
+    return parts[0] + "//" + parts[2].rpartition("@")[2].lower()
+
+
+class _Probe(object):
+    """The token `CircuitBreaker.allow` returns for a probe request."""
+    __slots__ = ()
+
+
+class _Circuit(object):
+    __slots__ = ("state", "failures", "outcomes", "opened_at", "probes",
+                 "rejected", "opened")
+
+    def __init__(self, window):
+        self.state = CLOSED
+        # 连续失败的次数
+        self.failures = 0
+        # 最近的结果， True 表示失败
+        self.outcomes = collections.deque(maxlen=window)
+        self.opened_at = None
+        # 半开状态下正在进行的探测请求的 _Probe
+        self.probes = set()
+        self.rejected = 0
+        self.opened = 0
+
+
+class CircuitBreaker(object):
+    """Fails requests to an unhealthy origin without sending them.
+
+    The circuit of an origin opens after ``failure_threshold``
+    consecutive failures, or when at least ``error_rate`` of the last
+    ``window`` requests failed (once ``min_requests`` of them
+    completed).  A failure is a curl error in ``errnos`` or an HTTP
+    status in ``statuses``.
+
+    While open, requests fail immediately with `CircuitOpenException`.
+    After ``open_duration`` seconds the circuit is half-open: up to
+    ``half_open_probes`` requests are sent at a time, the first probe
+    success closes the circuit and a probe failure opens it again.
+    Results of requests sent before the circuit opened are ignored.
+
+    Circuits are only kept for origins with recent failures: a closed
+    circuit is dropped once its ``window`` holds no failure, and at most
+    ``max_origins`` circuits are kept, the least recently failed ones
+    being dropped first.
+
+    It is thread-safe and meant to be shared by all the workers of a
+    manager.
+    """
+    def __init__(self, failure_threshold=5, error_rate=0.5, window=20,
+                 min_requests=10, open_duration=30.0, half_open_probes=1,
+                 errnos=DEFAULT_FAILURE_ERRNOS,
+                 statuses=DEFAULT_FAILURE_STATUSES, max_origins=10000):
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.errnos = frozenset(errnos)
+        self.statuses = frozenset(statuses)
+        self.max_origins = max_origins
+        self._lock = threading.Lock()
+        # 只保存最近失败过的源站，按最近失败的时间排序
+        self._circuits = collections.OrderedDict()
+
+    def allow(self, origin):
+        """Returns False if a request to ``origin`` may not be sent,
+        otherwise a token to pass to `record` or `release`.
+        """
+        with self._lock:
+            circuit = self._circuits.get(origin)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                if time.time() - circuit.opened_at < self.open_duration:
+                    circuit.rejected += 1
+                    return False
+                circuit.state = HALF_OPEN
+                circuit.probes.clear()
+            if len(circuit.probes) >= self.half_open_probes:
+                circuit.rejected += 1
+                return False
+            probe = _Probe()
+            circuit.probes.add(probe)
+            return probe
+
+    def release(self, origin, token):
+        """Gives back a request allowed by `allow` that was not sent."""
+        with self._lock:
+            circuit = self._circuits.get(origin)
+            if circuit is not None:
+                circuit.probes.discard(token)
+
+    def is_failure(self, response):
+        error = response.error
+        if error is None:
+            return False
+        if isinstance(error, CurlException):
+            return error.errno in self.errnos
+        return response.code in self.statuses
+
+    def record(self, origin, failed, token=True):
+        """Records the outcome of a request sent to ``origin``;
+        ``token`` is the value `allow` returned for it.
+        """
+        with self._lock:
+            circuit = self._circuits.get(origin)
+            if circuit is None:
+                if not failed:
+                    return
+                circuit = _Circuit(self.window)
+            if circuit.state != CLOSED:
+                # 只有本次半开状态的探测请求能改变状态，打开之前发出的
+                # 请求和之前的探测请求的结果被忽略
+                if token not in circuit.probes:
+                    return
+                circuit.probes.discard(token)
+                if failed:
+                    self._keep(origin, circuit)
+                    self._open(circuit)
+                else:
+                    del self._circuits[origin]
+                return
+            circuit.outcomes.append(failed)
+            if not failed:
+                circuit.failures = 0
+                if not any(circuit.outcomes):
+                    # 窗口中已经没有失败，不再需要保存
+                    del self._circuits[origin]
+                return
+            self._keep(origin, circuit)
+            circuit.failures += 1
+            if circuit.failures >= self.failure_threshold:
+                self._open(circuit)
+                return
+            outcomes = circuit.outcomes
+            if len(outcomes) >= self.min_requests and \
+                    sum(outcomes) >= self.error_rate * len(outcomes):
+                self._open(circuit)
+
+    def _keep(self, origin, circuit):
+        # 按最近失败的时间排序，超过 max_origins 时删除最早的
+        self._circuits.pop(origin, None)
+        self._circuits[origin] = circuit
+        while len(self._circuits) > self.max_origins:
+            self._circuits.popitem(last=False)
+
+    def _open(self, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = time.time()
+        circuit.opened += 1
+        circuit.probes.clear()
+
+    def get_state(self, origin):
+        with self._lock:
+            circuit = self._circuits.get(origin)
+            return CLOSED if circuit is None else circuit.state
+
+    def get_stats(self):
+        """Returns, for every origin with recent failures (origins
+        without a circuit are closed), its ``state``, the number of
+        ``consecutive_failures``, the ``error_rate`` of the recent
+        requests, how many times it was ``opened``, the number of
+        ``rejected`` requests, and ``retry_in``, the seconds before an
+        open circuit lets a probe through.
+        """
+        now = time.time()
+        stats = {}
+        with self._lock:
+            for origin, circuit in self._circuits.items():
+                outcomes = circuit.outcomes
+                retry_in = None
+                if circuit.state == OPEN:
+                    retry_in = max(0.0, circuit.opened_at +
+                                   self.open_duration - now)
+                stats[origin] = {
+                    "state": circuit.state,
+                    "consecutive_failures": circuit.failures,
+                    "error_rate": (float(sum(outcomes)) / len(outcomes)
+                                   if outcomes else 0.0),
+                    "opened": circuit.opened,
+                    "rejected": circuit.rejected,
+                    "retry_in": retry_in,
+                }
+        return stats
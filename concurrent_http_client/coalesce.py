@@ -0,0 +1,146 @@
+# coding: utf8
+
+# 合并相同的请求：相同的请求正在进行时，之后的请求不进入队列，而是等待
+# 正在进行的传输的结果，所有的 future 由同一个响应完成，响应体只读共享
+
+import threading
+
+from concurrent.futures import Future
+from io import BytesIO
+
+from .cache import _hashable, _request_headers
+from .exceptions import HTTPException
+from .httpclient import HTTPResponse
+
+# 可能改变响应内容的请求头部
+DEFAULT_COALESCE_HEADERS = ("Accept", "Accept-Encoding", "Accept-Language",
+                            "Authorization", "Cookie", "Range",
+                            "If-None-Match", "If-Modified-Since", "If-Range",
+                            "If-Match", "If-Unmodified-Since")
+
+# 可能改变响应内容、发送的内容或者对端验证方式的请求选项（不通过请求头部
+# 传递，比如 USERPWD 、 USERAGENT 、 CAINFO ）
+_KEY_OPTIONS = ("auth_username", "auth_password", "auth_mode",
+                "proxy_host", "proxy_port", "proxy_username",
+                "proxy_password", "client_cert", "client_key",
+                "validate_cert", "ca_certs", "ssl_options", "user_agent",
+                "network_interface", "allow_ipv6",
+                "decompress_response", "accept_encoding", "follow_redirects",
+                "max_redirects", "max_body_length", "resolve_list",
+                "connect_to_list", "prepared")
+
+
+class RequestCoalescer(object):
+    """Sends one transfer for identical requests submitted while it is
+    in flight.
+
+    Requests are identical if they have the same method (one of
+    ``methods``), URL, values of the ``headers`` and the options that
+    can change the response or how the peer is verified (credentials,
+    proxy, certificate checks, user agent, network interface, decoding,
+    redirects, body limit, template ...); other options, such as timeouts, of the
+    request that started the transfer apply to all of them.  Requests
+    with ``body_producer``, ``streaming_callback``, ``header_callback``,
+    ``prepare_curl_callback`` or ``spill_path`` are never coalesced.
+
+    Every request gets its own future and `HTTPResponse`; the body bytes
+    are shared and must be treated as read-only.  It is thread-safe.
+    """
+    def __init__(self, headers=DEFAULT_COALESCE_HEADERS,
+                 methods=("GET", "HEAD")):
+        self.headers = tuple(headers)
+        self.methods = frozenset(methods)
+        self._lock = threading.Lock()
+        # Map: key -> the futures waiting for the transfer
+        self._in_flight = {}
+        self._stats = {"requests": 0, "transfers": 0, "coalesced": 0}
+
+    def is_eligible(self, request):
+        return request.method in self.methods and \
+            request.body_producer is None and \
+            request.streaming_callback is None and \
+            request.header_callback is None and \
+            request.prepare_curl_callback is None and \
+            request.spill_path is None
+
+    def get_key(self, request):
+        headers = _request_headers(request)
+        return (request.method, request.url,
+                tuple(headers.get(name) for name in self.headers),
+                tuple(_hashable(getattr(request, name))
+                      for name in _KEY_OPTIONS))
+
+    def fetch(self, request, fetch):
+        """Returns a future of the response to ``request``; ``fetch``
+        sends a request.
+        """
+        if not self.is_eligible(request):
+            return fetch(request)
+        key = self.get_key(request)
+        future = Future()
+        with self._lock:
+            self._stats["requests"] += 1
+            waiters = self._in_flight.get(key)
+            if waiters is not None:
+                self._stats["coalesced"] += 1
+                waiters.append((request, future))
+                return future
+            self._in_flight[key] = [(request, future)]
+            self._stats["transfers"] += 1
+        try:
+            inner = fetch(request)
+        except Exception:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            raise
+        inner.add_done_callback(lambda f: self._complete(key, f))
+        return future
+
+    def _complete(self, key, inner):
+        with self._lock:
+            waiters = self._in_flight.pop(key)
+        if inner.cancelled():
+            for _, future in waiters:
+                future.cancel()
+            return
+        exc = inner.exception()
+        if exc is not None:
+            for _, future in waiters:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(exc)
+            return
+        response = inner.result()
+        # 在完成任何 future 之前读出响应体
+        body = response.body if len(waiters) > 1 else None
+        request, future = waiters[0]
+        if future.set_running_or_notify_cancel():
+            future.set_result(response)
+        for request, future in waiters[1:]:
+            if future.set_running_or_notify_cancel():
+                future.set_result(_share(response, request, body))
+
+    def get_stats(self):
+        """Returns the counters ``requests`` (eligible requests),
+        ``transfers`` (transfers started) and ``coalesced`` (transfers
+        saved), and the number of keys ``in_flight``.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._in_flight)
+        return stats
+
+
+def _share(response, request, body):
+    error = response.error
+    if isinstance(error, HTTPException):
+        # 由状态码产生的错误引用了响应，需要重新生成
+        error = None
+    return HTTPResponse(
+        request=request, code=response.code, reason=response.reason,
+        headers=response.headers.copy(),
+        buffer=None if body is None else BytesIO(body),
+        effective_url=response.effective_url, error=error,
+        request_time=response.request_time, start_time=response.start_time,
+        time_info=response.time_info, primary_ip=response.primary_ip,
+        speed_download=response.speed_download,
+        speed_upload=response.speed_upload)
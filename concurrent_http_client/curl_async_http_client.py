@@ -2,7 +2,11 @@
 
 # 本段代码修改自：tornado
 
+import collections
+import itertools
 import logging
+import os
+import errno
 import time
 from io import BytesIO
 import functools
@@ -13,38 +17,180 @@ import pycurl
 from .periodic_callback import PeriodicCallback
 from .exceptions import *
 from . import httputil
-from .httpclient import HTTPResponse, _RequestProxy, HTTPRequest
+from .httpclient import HTTPResponse, TimeInfo, METRICS
 from .escape import native_str, utf8
+from .buffer_pool import ResponseBuffer
+from .hedge import _Hedge
+from .circuit_breaker import get_origin
+from .resolver import get_host_port, format_resolve
+from .tracing import monotonic, trace_transfer
+from .util import errno_from_exception, unicode_type
 
 curl_log = logging.getLogger(__name__)
 
 
+# libcurl versions from which the periodic socket_all() scan is not
+# needed by default.  The missing SOCKETFUNCTION/TIMERFUNCTION
+# notifications the scan works around were reported against older
+# releases; 7.60.0 is chosen conservatively.
+_FORCE_SCAN_FIXED_VERSION = 0x073c00
+
+# the various curl timings are documented at
+# http://curl.haxx.se/libcurl/c/curl_easy_getinfo.html
+_TIME_INFO_OPTIONS = dict(
+    namelookup=pycurl.NAMELOOKUP_TIME,
+    connect=pycurl.CONNECT_TIME,
+    appconnect=pycurl.APPCONNECT_TIME,
+    pretransfer=pycurl.PRETRANSFER_TIME,
+    starttransfer=pycurl.STARTTRANSFER_TIME,
+    total=pycurl.TOTAL_TIME,
+    redirect=pycurl.REDIRECT_TIME,
+)
+
+_DEFAULT_ACCEPT_ENCODING = "gzip,deflate"
+
+
+def supported_encodings():
+    """Returns the content encodings that the linked libcurl can
+    decode, such as ``("gzip", "deflate", "br")``.
+    """
+    features = pycurl.version_info()[4]
+    encodings = []
+    if features & pycurl.VERSION_LIBZ:
+        encodings.extend(("gzip", "deflate"))
+    if features & getattr(pycurl, "VERSION_BROTLI", 0):
+        encodings.append("br")
+    if features & getattr(pycurl, "VERSION_ZSTD", 0):
+        encodings.append("zstd")
+    return tuple(encodings)
+
+
+def _accept_encoding_option(accept_encoding, supported):
+    """Returns the value of the ``ENCODING`` option for a list of
+    encodings in order of preference; later ones are given lower
+    q-values.  Encodings libcurl cannot decode are left out.
+    A string is used as is; ``""`` lets libcurl advertise every
+    encoding it supports.
+
+    >>> _accept_encoding_option(("br", "gzip", "lzma"), ("gzip", "br"))
+    'br, gzip;q=0.9'
+    """
+    if isinstance(accept_encoding, (str, unicode_type)):
+        return accept_encoding
+    encodings = []
+    for encoding in accept_encoding:
+        if encoding in supported or encoding == "identity":
+            q = 1.0 - 0.1 * len(encodings)
+            if encodings:
+                encoding = "%s;q=%.1f" % (encoding, max(q, 0.1))
+            encodings.append(encoding)
+    return ", ".join(encodings) or "identity"
+
+
+# 没有收集任何计时信息时，所有响应共享同一个 TimeInfo
+_EMPTY_TIME_INFO = TimeInfo(*([None] * len(TimeInfo._fields)))
+
+
 class CurlAsyncHTTPClient(object):
     def __init__(self, max_clients,
                  event_loop, queue_waker,
-                 queue_getter):
+                 queue_getter, force_scan="auto",
+                 force_scan_interval=500,
+                 force_scan_threshold=1000,
+                 min_clients=0, idle_handle_timeout=60.0,
+                 buffer_pool=None, spill_threshold=None,
+                 collect_metrics=None,
+                 accept_encoding=_DEFAULT_ACCEPT_ENCODING,
+                 retry_policy=None, hedge_policy=None, circuit_breaker=None,
+                 resolver=None, metrics=None):
         self._event_loop = event_loop
         self._queue_waker = queue_waker
         self._queue_getter = queue_getter
+        self._buffer_pool = buffer_pool
+        self._spill_threshold = spill_threshold
+        # 响应完成时收集哪些指标（ METRICS 的子集， None 表示全部）。
+        # 请求可以通过 collect_metrics 覆盖
+        self._metric_plans = {}
+        self._metric_plan = self._get_metric_plan(collect_metrics)
+        # 请求头中 Accept-Encoding 的取值，按请求的 accept_encoding 缓存
+        self._supported_encodings = supported_encodings()
+        self._accept_encoding = accept_encoding
+        self._encoding_options = {}
+        self._encoding_stats = {
+            "responses": 0,
+            "compressed_responses": 0,
+            "compressed_bytes": 0,
+            "decompressed_bytes": 0,
+        }
+        # 请求可以通过 retry_policy 覆盖。等待退避的请求不占用 curl 句柄，
+        # 退避结束后放入 _retry_queue ，优先于队列中的新请求
+        self._retry_policy = retry_policy
+        self._retry_queue = collections.deque()
+        self._pending_retries = {}  # Map: id -> (timeout, item)
+        self._retry_ids = itertools.count()
+        # 请求可以通过 hedge_policy 覆盖
+        self._hedge_policy = hedge_policy
+        self._circuit_breaker = circuit_breaker
+        # ResolverCache ，在 worker 线程之外解析域名
+        self._resolver = resolver
+        self._resolving = {}  # Map: id -> item waiting for resolution
+        # ResponseMetrics ，按 worker 线程区分
+        self._metrics = metrics
+        self._worker_name = threading.current_thread().name
+        # 完成的请求数：completed 为正常的响应， failed 为出错的响应或
+        # 异常（包括熔断和设置请求时的错误）， cancelled 为完成之前被调用者
+        # 取消的请求， retries 为安排的重试次数
+        self._request_stats = {"completed": 0, "failed": 0, "cancelled": 0,
+                               "retries": 0}
 
         self._multi = pycurl.CurlMulti()
         self._multi.setopt(pycurl.M_TIMERFUNCTION,
             self._set_timeout)
         self._multi.setopt(pycurl.M_SOCKETFUNCTION,
             self._handle_socket)
-        self._curls = [self._curl_create() for _
-            in range(max_clients)]
-        self._free_list = self._curls[:]
+        # curl 句柄按需创建，最多 max_clients 个；空闲超过
+        # idle_handle_timeout 秒的句柄会被关闭，但至少保留 min_clients 个
+        self._max_clients = max_clients
+        self._min_clients = min(min_clients, max_clients)
+        self._idle_handle_timeout = idle_handle_timeout
+        self._curls = []
+        self._free_list = []
+        for _ in range(self._min_clients):
+            self._free_curl(self._new_curl())
         self._fds = {}
         self._timeout = None
+        self._finished_count = 0
+        self._last_progress_time = self._event_loop.time()
 
         # libcurl has bugs that sometimes cause it to not report all
         # relevant file descriptors and timeouts to TIMERFUNCTION/
         # SOCKETFUNCTION.  Mitigate the effects of such bugs by
-        # forcing a periodic scan of all active requests.
-        self._force_timeout_callback = PeriodicCallback(
-            self._event_loop, self._handle_force_timeout, 500)
-        self._force_timeout_callback.start()
+        # scanning all active requests, but only when none of them has
+        # made progress for force_scan_threshold milliseconds.
+        if force_scan == "auto":
+            force_scan = pycurl.version_info()[2] < \
+                _FORCE_SCAN_FIXED_VERSION
+        self._force_scan_threshold = force_scan_threshold / 1000.0
+        self._force_scan_stats = {
+            "enabled": bool(force_scan),
+            "checks": 0,
+            "scans": 0,
+            "hits": 0,
+            "scan_time": 0.0,
+        }
+        self._force_timeout_callback = None
+        if force_scan:
+            self._force_timeout_callback = PeriodicCallback(
+                self._event_loop, self._handle_force_timeout,
+                force_scan_interval)
+            self._force_timeout_callback.start()
+
+        self._trim_callback = None
+        if idle_handle_timeout:
+            self._trim_callback = PeriodicCallback(
+                self._event_loop, self._trim_idle_curls,
+                idle_handle_timeout * 1000 / 2.0)
+            self._trim_callback.start()
 
         # Work around a bug in libcurl 7.29.0: Some fields in the curl
         # multi object are initialized lazily, and its destructor will
@@ -56,19 +202,59 @@ class CurlAsyncHTTPClient(object):
         self._multi.remove_handle(dummy_curl_handle)
 
     def close(self):
-        self._force_timeout_callback.stop()
+        if self._force_timeout_callback is not None:
+            self._force_timeout_callback.stop()
+        if self._trim_callback is not None:
+            self._trim_callback.stop()
         if self._timeout is not None:
             self._event_loop.remove_timeout(self._timeout)
+        for timeout, _ in self._pending_retries.values():
+            self._event_loop.remove_timeout(timeout)
+        for fd in self._fds:
+            self._event_loop.remove_handler(fd)
+        self._fds.clear()
+        # 连接池属于 multi ，先关闭 multi （以及池中的连接），再关闭
+        # easy 句柄
+        self._multi.close()
         for curl in self._curls:
             curl.close()
-        self._multi.close()
 
         # Set below properties to None to reduce the reference count of current
         # instance, because those properties hold some methods of current
         # instance that will case circular reference.
         self._force_timeout_callback = None
+        self._trim_callback = None
         self._multi = None
 
+    def _get_metric_plan(self, collect_metrics):
+        """Returns the getinfo calls needed to collect ``collect_metrics``
+        as a tuple ``(timers, queue, primary_ip, speed_download,
+        speed_upload)``, where ``timers`` is a tuple of ``(TimeInfo
+        index, getinfo option)`` pairs.
+        """
+        if collect_metrics is not None and \
+                not isinstance(collect_metrics, frozenset):
+            collect_metrics = frozenset(collect_metrics)
+        plan = self._metric_plans.get(collect_metrics)
+        if plan is not None:
+            return plan
+        if collect_metrics is None:
+            names = frozenset(METRICS)
+        else:
+            names = collect_metrics
+            unknown = names.difference(METRICS)
+            if unknown:
+                raise ValueError(
+                    "unknown metrics: %s" % ", ".join(sorted(unknown)))
+        timers = tuple(
+            (index, _TIME_INFO_OPTIONS[name])
+            for index, name in enumerate(TimeInfo._fields)
+            if name in names and name in _TIME_INFO_OPTIONS)
+        plan = (timers, "queue" in names, "primary_ip" in names,
+                "speed_download" in names, "speed_upload" in names)
+        self._metric_plans[collect_metrics] = plan
+        return plan
+
     def wake_up(self, fd, events):
         self._queue_waker.consume()
         self._process_queue()
@@ -96,15 +282,27 @@ class CurlAsyncHTTPClient(object):
             # between.  This is a problem with the epoll EventLoop,
             # because the kernel can tell when a socket is closed and
             # removes it from the epoll automatically, causing future
-            # update_handler calls to fail. Since we can't tell when
-            # this has happened, always use remove and re-add
-            # instead of update.
-            if fd in self._fds:
-                self._event_loop.remove_handler(fd)
-            self._event_loop.add_handler(
-                fd,
-                self._handle_events,
-                event_loop_event)
+            # update_handler calls to fail.  A FD that is still in
+            # self._fds is modified in place; if it was closed and
+            # reused, the modify fails and the new socket is added.
+            if fd not in self._fds:
+                self._event_loop.add_handler(
+                    fd,
+                    self._handle_events,
+                    event_loop_event)
+            else:
+                try:
+                    self._event_loop.update_handler(fd, event_loop_event)
+                except (OSError, IOError) as e:
+                    # fd 被 libcurl 关闭后又被复用了，内核已经将其从
+                    # epoll 中移除
+                    if errno_from_exception(e) not in (
+                            errno.ENOENT, errno.EBADF):
+                        raise
+                    self._event_loop.add_handler(
+                        fd,
+                        self._handle_events,
+                        event_loop_event)
             self._fds[fd] = event_loop_event
 
     def _set_timeout(self, msecs):
@@ -118,6 +316,7 @@ class CurlAsyncHTTPClient(object):
         """Called by EventLoop when there is activity on one of our
         file descriptors.
         """
+        self._last_progress_time = self._event_loop.time()
         action = 0
         if events & self._event_loop.READ:
             action |= pycurl.CSELECT_IN
@@ -166,6 +365,16 @@ class CurlAsyncHTTPClient(object):
         """Called by EventLoop periodically to ask libcurl to process any
         events it may have forgotten about.
         """
+        stats = self._force_scan_stats
+        stats["checks"] += 1
+        if len(self._free_list) == len(self._curls):
+            return
+        now = self._event_loop.time()
+        if now - self._last_progress_time < self._force_scan_threshold:
+            return
+
+        start_time = time.time()
+        finished_count = self._finished_count
         while True:
             try:
                 ret, num_handles = self._multi.socket_all()
@@ -174,6 +383,77 @@ class CurlAsyncHTTPClient(object):
             if ret != pycurl.E_CALL_MULTI_PERFORM:
                 break
         self._finish_pending_requests()
+        self._last_progress_time = now
+        stats["scans"] += 1
+        # 扫描完成了至少一个请求，说明确实有通知被遗漏了
+        if self._finished_count != finished_count:
+            stats["hits"] += 1
+        stats["scan_time"] += time.time() - start_time
+
+    def get_force_scan_stats(self):
+        """Returns the counters of the periodic socket_all() scan:
+        ``checks`` (timer ticks), ``scans`` (socket_all() calls),
+        ``hits`` (scans that completed at least one request) and
+        ``scan_time`` (seconds spent scanning).
+        """
+        return dict(self._force_scan_stats)
+
+    def get_encoding_stats(self):
+        """Returns the content encoding counters of the responses that
+        were decompressed into a buffer (streamed responses are not
+        counted): ``responses``, ``compressed_responses``, and for the
+        latter the bytes received (``compressed_bytes``) and the bytes
+        after decoding (``decompressed_bytes``).
+        """
+        return dict(self._encoding_stats)
+
+    def get_stats(self):
+        """Returns a snapshot of the client; must be called on the thread
+        of its event loop.
+
+        ``in_flight`` transfers (including hedged ones) use curl handles,
+        ``free_handles`` are idle and at most ``max_clients`` handles are
+        created.  ``retry_queue``, ``pending_retries`` (waiting for their
+        backoff) and ``resolving`` count the requests taken from the
+        queue that do not use a handle.  ``fds`` is the number of sockets
+        watched for libcurl, ``completed``, ``failed``, ``cancelled``
+        (by the caller before the request was done) and ``retries`` are
+        counters, ``force_scan_enabled``, ``force_scan_checks``,
+        ``force_scan_scans``, ``force_scan_hits`` and ``force_scan_time``
+        come from `get_force_scan_stats`, and ``timeouts``, ``callbacks``
+        and ``handlers`` come from `EventLoop.get_stats`.
+        """
+        stats = dict(self._request_stats)
+        stats.update(
+            in_flight=len(self._curls) - len(self._free_list),
+            handles=len(self._curls),
+            free_handles=len(self._free_list),
+            max_clients=self._max_clients,
+            retry_queue=len(self._retry_queue),
+            pending_retries=len(self._pending_retries),
+            resolving=len(self._resolving),
+            fds=len(self._fds))
+        scan_stats = self._force_scan_stats
+        stats.update(
+            force_scan_enabled=int(scan_stats["enabled"]),
+            force_scan_checks=scan_stats["checks"],
+            force_scan_scans=scan_stats["scans"],
+            force_scan_hits=scan_stats["hits"],
+            force_scan_time=scan_stats["scan_time"])
+        stats.update(self._event_loop.get_stats())
+        return stats
+
+    def _get_encoding_option(self, accept_encoding):
+        if accept_encoding is None:
+            accept_encoding = self._accept_encoding
+        if isinstance(accept_encoding, list):
+            accept_encoding = tuple(accept_encoding)
+        option = self._encoding_options.get(accept_encoding)
+        if option is None:
+            option = _accept_encoding_option(
+                accept_encoding, self._supported_encodings)
+            self._encoding_options[accept_encoding] = option
+        return option
 
     def _finish_pending_requests(self):
         """Process any requests that were completed by the last
@@ -189,88 +469,351 @@ class CurlAsyncHTTPClient(object):
                 break
         self._process_queue()
 
+    def _new_curl(self):
+        curl = self._curl_create()
+        curl.info = None
+        self._curls.append(curl)
+        return curl
+
+    def _free_curl(self, curl):
+        curl.idle_since = self._event_loop.time()
+        self._free_list.append(curl)
+
+    def _trim_idle_curls(self):
+        """Called by EventLoop periodically to close the handles that
+        have been idle for longer than idle_handle_timeout.
+        """
+        deadline = self._event_loop.time() - self._idle_handle_timeout
+        # _free_list 按照句柄空闲的先后顺序排列，最早空闲的位于头部
+        count = 0
+        while (count < len(self._free_list) and
+                len(self._curls) - count > self._min_clients and
+                self._free_list[count].idle_since <= deadline):
+            count = count + 1
+        if not count:
+            return
+        idle_curls = self._free_list[:count]
+        del self._free_list[:count]
+        idle_set = set(idle_curls)
+        self._curls = [curl for curl in self._curls
+                       if curl not in idle_set]
+        # 连接池属于 multi ，关闭 easy 句柄之后，它打开的连接仍然可以被
+        # 其他句柄复用，并在 multi 关闭时关闭
+        for curl in idle_curls:
+            curl.close()
+        curl_log.debug("closed %d idle curl handles", count)
+
     def _process_queue(self):
         while True:
-            if not self._free_list:
+            if not self._free_list and \
+                    len(self._curls) >= self._max_clients:
                 break
-
-            item = self._queue_getter()
-            if item == None:
+            # 等待解析的请求不占用 curl 句柄，也要限制其数量，否则解析较慢
+            # 时一个 worker 会取走共享队列中的所有请求
+            if len(self._resolving) >= self._max_clients:
                 break
 
-            curl = self._free_list.pop()
-            request, future, queue_start_time = item
+            if self._retry_queue:
+                request, future, queue_start_time, retries, deadline, \
+                    addresses = self._retry_queue.popleft()
+            else:
+                item = self._queue_getter()
+                if item == None:
+                    break
+                request, future, queue_start_time = item
+                retries = 0
+                deadline = None
+                addresses = None
+
+            if request.trace is not None:
+                request.trace.on_dequeue(monotonic(), retries)
+
+            resolve = None
+            if self._resolver is not None and \
+                    request.resolve_list is None and not request.proxy_host:
+                host_port = get_host_port(request.url)
+                if host_port is not None:
+                    if addresses is None:
+                        addresses = self._resolver.lookup(*host_port)
+                    if addresses is None:
+                        # 解析完成之前不占用 curl 句柄
+                        self._wait_for_resolution(
+                            host_port, (request, future, queue_start_time,
+                                        retries, deadline))
+                        continue
+                    if not addresses:
+                        # 解析失败的结果在 negative_ttl 内被缓存，不让 curl
+                        # 在事件循环的线程中再次解析
+                        self._fail_resolution(request, future, host_port[0])
+                        continue
+                    resolve = [format_resolve(
+                        host_port[0], host_port[1], addresses)]
+
+            circuit_token = None
+            if self._circuit_breaker is not None:
+                origin = get_origin(request.url)
+                circuit_token = self._circuit_breaker.allow(origin)
+                if not circuit_token:
+                    # 源站熔断中，不必占用 curl 句柄
+                    self._complete(future, "failed",
+                                   exception=CircuitOpenException(origin))
+                    continue
+
+            if self._free_list:
+                curl = self._free_list.pop()
+            else:
+                curl = self._new_curl()
             try:
-                request.headers = httputil.HTTPHeaders(request.headers)
-                request = _RequestProxy(request, dict(HTTPRequest._DEFAULTS))
+                if request.collect_metrics is None:
+                    metric_plan = self._metric_plan
+                else:
+                    metric_plan = self._get_metric_plan(
+                        request.collect_metrics)
+                # 原始的响应头部，在访问 HTTPResponse.headers 时才解析
+                raw_headers = []
                 curl.info = {
-                    "headers": httputil.HTTPHeaders(),
-                    "buffer": BytesIO(),
+                    "headers": raw_headers,
+                    "buffer": self._new_buffer(request, raw_headers),
                     "request": request,
+                    "metric_plan": metric_plan,
                     "future": future, 
                     "queue_start_time": queue_start_time,
                     "curl_start_time": time.time(),
                     "curl_start_event_loop_time": self._event_loop.time(),
+                    "retries": retries,
+                    "deadline": deadline,
+                    "hedge": None,
+                    "circuit_token": circuit_token,
                 }
                 self._curl_setup_request(
                     curl, request, curl.info["buffer"],
                     curl.info["headers"])
+                if resolve is not None:
+                    curl.setopt(pycurl.RESOLVE, resolve)
+                    # 句柄上的 RESOLVE 与模板不一致，下次需要完整地设置
+                    curl.template = None
+                if deadline is not None:
+                    # 重试不能超过第一次尝试时的截止时间
+                    remaining = deadline - self._event_loop.time()
+                    curl.setopt(pycurl.TIMEOUT_MS,
+                                max(1, int(1000 * remaining)))
+                    curl.template = None
             except Exception as e:
-                self._free_list.append(curl)
-                try:
-                    if future.set_running_or_notify_cancel():
-                        future.set_exception(CurlSetupException(e))
-                except RuntimeError:
-                    pass
+                curl.info = None
+                self._free_curl(curl)
+                if self._circuit_breaker is not None:
+                    self._circuit_breaker.release(origin, circuit_token)
+                self._complete(future, "failed",
+                               exception=CurlSetupException(e))
             else:
                 self._multi.add_handle(curl)
+                self._last_progress_time = self._event_loop.time()
+                if request.trace is not None:
+                    request.trace.on_start(monotonic(), retries)
+                hedge_policy = request.hedge_policy
+                if hedge_policy is None:
+                    hedge_policy = self._hedge_policy
+                if hedge_policy is not None:
+                    self._arm_hedge(hedge_policy, curl)
+
+    def _wait_for_resolution(self, host_port, item):
+        resolve_id = next(self._retry_ids)
+        self._resolving[resolve_id] = item
+        self._resolver.resolve_async(
+            host_port[0], host_port[1],
+            functools.partial(self._event_loop.add_callback,
+                              self._resolution_ready, resolve_id))
+
+    def _fail_resolution(self, request, future, host):
+        error = CurlException(pycurl.E_COULDNT_RESOLVE_HOST,
+                              "Could not resolve host: %s" % host)
+        response = HTTPResponse(request, error.code, error=error,
+                                request_time=0, start_time=time.time())
+        self._complete(future, "failed", response)
+
+    def _resolution_ready(self, resolve_id, addresses):
+        item = self._resolving.pop(resolve_id, None)
+        if item is None:
+            return
+        # 与等待重试的请求一样，优先于队列中的新请求。直接使用解析的结果，
+        # 不再查询 ResolverCache ：其中的条目可能已经过期或被淘汰
+        self._retry_queue.append(item + (addresses,))
+        self._process_queue()
+        self._set_timeout(0)
+
+    def _new_buffer(self, request, raw_headers):
+        spill_threshold = request.spill_threshold
+        if spill_threshold is None:
+            spill_threshold = self._spill_threshold
+        return ResponseBuffer(
+            self._buffer_pool, spill_threshold, request.spill_path,
+            functools.partial(httputil.parse_raw_content_length,
+                              raw_headers),
+            request.max_body_length)
+
+    def _arm_hedge(self, hedge_policy, curl):
+        info = curl.info
+        request = info["request"]
+        # 两个传输不能写入同一个文件
+        if request.spill_path is not None or \
+                not hedge_policy.is_eligible(request):
+            return
+        hedge_policy.count("eligible")
+        hedge_policy.budget.deposit()
+        hedge = _Hedge(hedge_policy, curl)
+        info["hedge"] = hedge
+        delay = hedge_policy.get_delay()
+        if delay is not None:
+            hedge.timeout = self._event_loop.call_later(
+                delay, self._start_hedge, hedge, info)
+
+    def _start_hedge(self, hedge, info):
+        hedge.timeout = None
+        if len(hedge.curls) != 1 or hedge.curls[0].info is not info:
+            return
+        policy = hedge.policy
+        if not self._free_list and len(self._curls) >= self._max_clients:
+            policy.count("no_handle")
+            return
+        if not policy.budget.withdraw():
+            policy.count("budget_denied")
+            return
+        if self._free_list:
+            curl = self._free_list.pop()
+        else:
+            curl = self._new_curl()
+        request = info["request"]
+        raw_headers = []
+        curl.info = dict(info, headers=raw_headers,
+                         buffer=self._new_buffer(request, raw_headers))
+        try:
+            self._curl_setup_request(
+                curl, request, curl.info["buffer"], raw_headers)
+            # 与原始的传输使用相同的截止时间
+            deadline = info["deadline"]
+            if deadline is None and request.request_timeout:
+                deadline = info["curl_start_event_loop_time"] + \
+                    request.request_timeout
+            if deadline is not None:
+                remaining = deadline - self._event_loop.time()
+                curl.setopt(pycurl.TIMEOUT_MS,
+                            max(1, int(1000 * remaining)))
+                curl.template = None
+            if policy.fresh_connect:
+                curl.setopt(pycurl.FRESH_CONNECT, 1)
+                curl.fresh_connect = True
+        except Exception:
+            curl_log.debug("fail to start hedged transfer", exc_info=True)
+            curl.info = None
+            self._free_curl(curl)
+            return
+        self._multi.add_handle(curl)
+        hedge.curls.append(curl)
+        policy.count("hedges")
+        if request.trace is not None:
+            request.trace.on_start(monotonic(), info["retries"], True)
+        self._set_timeout(0)
+
+    def _finish_hedge(self, hedge, curl, curl_error):
+        """Returns True if the transfer on ``curl`` completes the
+        hedged request, False if it is dropped because it failed while
+        another transfer of the request is still running.
+        """
+        hedge.curls.remove(curl)
+        if hedge.timeout is not None:
+            self._event_loop.remove_timeout(hedge.timeout)
+            hedge.timeout = None
+        if hedge.curls:
+            if curl_error or curl.getinfo(pycurl.HTTP_CODE) >= 500:
+                return False
+            others, hedge.curls = hedge.curls, []
+            for other in others:
+                self._cancel_transfer(other)
+                hedge.policy.count("cancelled")
+        if curl is not hedge.primary:
+            hedge.policy.count("wins")
+        return True
+
+    def _cancel_transfer(self, curl):
+        info = curl.info
+        curl.info = None
+        self._multi.remove_handle(curl)
+        self._free_curl(curl)
+        info["buffer"].discard()
+        request = info["request"]
+        if request.trace is not None:
+            request.trace.on_finish(monotonic(), info["retries"], None,
+                                    _is_hedge(curl, info))
 
     def _finish(self, curl, curl_error=None, curl_message=None):
         info = curl.info
+        if info is None:
+            # 对冲请求中已经被取消的传输
+            return
         curl.info = None
+        self._finished_count += 1
+        self._last_progress_time = self._event_loop.time()
         self._multi.remove_handle(curl)
-        self._free_list.append(curl)
+        self._free_curl(curl)
+        hedge = info["hedge"]
+        if hedge is not None and \
+                not self._finish_hedge(hedge, curl, curl_error):
+            info["buffer"].discard()
+            request = info["request"]
+            if request.trace is not None:
+                request.trace.on_finish(monotonic(), info["retries"], None,
+                                        _is_hedge(curl, info))
+            return
         buffer = info["buffer"]
         if curl_error:
             error = CurlException(curl_error, curl_message)
             code = error.code
             effective_url = None
-            buffer.close()
+            buffer.discard()
             buffer = None
         else:
             error = None
             code = curl.getinfo(pycurl.HTTP_CODE)
             effective_url = curl.getinfo(pycurl.EFFECTIVE_URL)
             buffer.seek(0)
-        try:
-            primary_ip = curl.getinfo(pycurl.PRIMARY_IP)
-        except:
-            primary_ip = None
-        try:
-            speed_download = curl.getinfo(pycurl.SPEED_DOWNLOAD)
-        except:
-            speed_download = None
-        try:
-            speed_upload = curl.getinfo(pycurl.SPEED_UPLOAD)
-        except:
-            speed_upload = None
-
-        # the various curl timings are documented at
-        # http://curl.haxx.se/libcurl/c/curl_easy_getinfo.html
-        time_info = dict(
-            queue=info["curl_start_event_loop_time"] - info["queue_start_time"],
-            namelookup=curl.getinfo(pycurl.NAMELOOKUP_TIME),
-            connect=curl.getinfo(pycurl.CONNECT_TIME),
-            appconnect=curl.getinfo(pycurl.APPCONNECT_TIME),
-            pretransfer=curl.getinfo(pycurl.PRETRANSFER_TIME),
-            starttransfer=curl.getinfo(pycurl.STARTTRANSFER_TIME),
-            total=curl.getinfo(pycurl.TOTAL_TIME),
-            redirect=curl.getinfo(pycurl.REDIRECT_TIME),
-        )
+            request = info["request"]
+            if request.decompress_response and \
+                    not request.streaming_callback:
+                self._count_encoding(curl, buffer)
+        # 只收集需要的指标，每个 getinfo 调用都有开销
+        timers, collect_queue, collect_primary_ip, \
+            collect_speed_download, collect_speed_upload = info["metric_plan"]
+        primary_ip = speed_download = speed_upload = None
+        if collect_primary_ip:
+            try:
+                primary_ip = curl.getinfo(pycurl.PRIMARY_IP)
+            except:
+                pass
+        if collect_speed_download:
+            try:
+                speed_download = curl.getinfo(pycurl.SPEED_DOWNLOAD)
+            except:
+                pass
+        if collect_speed_upload:
+            try:
+                speed_upload = curl.getinfo(pycurl.SPEED_UPLOAD)
+            except:
+                pass
+
+        if timers or collect_queue:
+            values = [None] * len(TimeInfo._fields)
+            if collect_queue:
+                values[0] = info["curl_start_event_loop_time"] - \
+                    info["queue_start_time"]
+            for index, option in timers:
+                values[index] = curl.getinfo(option)
+            time_info = TimeInfo._make(values)
+        else:
+            time_info = _EMPTY_TIME_INFO
         response = HTTPResponse(
-            request=info["request"], code=code, headers=info["headers"],
+            request=info["request"], code=code, raw_headers=info["headers"],
             buffer=buffer, effective_url=effective_url, error=error,
-            reason=info['headers'].get("X-Http-Reason", None),
+            reason=httputil.parse_raw_reason(info["headers"]),
             request_time=self._event_loop.time() - info["curl_start_event_loop_time"],
             start_time=info["curl_start_time"],
             time_info=time_info,
@@ -278,12 +821,90 @@ class CurlAsyncHTTPClient(object):
             speed_download=speed_download,
             speed_upload=speed_upload)
         future = info["future"]
+        request = info["request"]
+        if request.trace is not None:
+            request.trace.on_finish(monotonic(), info["retries"], response,
+                                    _is_hedge(curl, info))
+        if hedge is not None and error is None:
+            hedge.policy.record(response.request_time)
+        if self._metrics is not None:
+            self._metrics.observe(response, self._worker_name)
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.record(
+                get_origin(request.url),
+                self._circuit_breaker.is_failure(response),
+                info["circuit_token"])
+        retry_policy = request.retry_policy
+        if retry_policy is None:
+            retry_policy = self._retry_policy
+        if retry_policy is not None and \
+                self._schedule_retry(retry_policy, info, response):
+            self._request_stats["retries"] += 1
+            return
+        self._complete(future, "completed" if error is None else "failed",
+                       response)
+
+    def _complete(self, future, outcome, response=None, exception=None):
+        """Completes ``future`` and counts the request as ``outcome``,
+        or as ``cancelled`` if it was cancelled in the meantime.
+        """
         try:
-            if future.set_running_or_notify_cancel():
+            if not future.set_running_or_notify_cancel():
+                self._request_stats["cancelled"] += 1
+                return
+            self._request_stats[outcome] += 1
+            if exception is not None:
+                future.set_exception(exception)
+            else:
                 future.set_result(response)
         except RuntimeError:
             pass
 
+    def _schedule_retry(self, retry_policy, info, response):
+        """Returns True if the request will be retried instead of being
+        completed with ``response``.
+        """
+        retries = info["retries"]
+        if retries == 0:
+            retry_policy.on_first_attempt()
+        if response.error is None or info["future"].cancelled():
+            return False
+        request = info["request"]
+        now = self._event_loop.time()
+        deadline = info["deadline"]
+        if deadline is None and request.request_timeout:
+            deadline = info["curl_start_event_loop_time"] + \
+                request.request_timeout
+        max_delay = None if deadline is None else deadline - now
+        delay = retry_policy.get_delay(request, response, retries, max_delay)
+        if delay is None:
+            return False
+        response.release()
+        item = (request, info["future"], info["queue_start_time"],
+                retries + 1, deadline, None)
+        retry_id = next(self._retry_ids)
+        timeout = self._event_loop.call_later(
+            delay, self._retry_ready, retry_id)
+        self._pending_retries[retry_id] = (timeout, item)
+        return True
+
+    def _retry_ready(self, retry_id):
+        _, item = self._pending_retries.pop(retry_id)
+        self._retry_queue.append(item)
+        self._process_queue()
+        self._set_timeout(0)
+
+    def _count_encoding(self, curl, buffer):
+        stats = self._encoding_stats
+        stats["responses"] += 1
+        # SIZE_DOWNLOAD 是解码之前的响应体大小
+        compressed = int(curl.getinfo(pycurl.SIZE_DOWNLOAD))
+        decompressed = buffer.length
+        if compressed != decompressed:
+            stats["compressed_responses"] += 1
+            stats["compressed_bytes"] += compressed
+            stats["decompressed_bytes"] += decompressed
+
     def _curl_create(self):
         curl = pycurl.Curl()
         if curl_log.isEnabledFor(logging.DEBUG):
@@ -292,34 +913,45 @@ class CurlAsyncHTTPClient(object):
         if hasattr(pycurl, 'PROTOCOLS'):  # PROTOCOLS first appeared in pycurl 7.19.5 (2014-07-12)
             curl.setopt(pycurl.PROTOCOLS, pycurl.PROTO_HTTP | pycurl.PROTO_HTTPS)
             curl.setopt(pycurl.REDIR_PROTOCOLS, pycurl.PROTO_HTTP | pycurl.PROTO_HTTPS)
+        # The PreparedRequest whose options are currently set on the handle
+        curl.template = None
+        # 对冲请求的传输设置了 FRESH_CONNECT ，下一次使用之前需要重置
+        curl.fresh_connect = False
         return curl
 
     def _curl_setup_request(self, curl, request, buffer, headers):
+        if curl.fresh_connect:
+            curl.setopt(pycurl.FRESH_CONNECT, 0)
+            curl.fresh_connect = False
+        prepared = request.prepared
+        if prepared is None:
+            curl.template = None
+            self._curl_setup_options(curl, request)
+        elif curl.template is not prepared:
+            # 句柄上一次应用的不是该模板，需要重新设置全部选项
+            curl.template = None
+            if prepared.curl_header_lines is None:
+                prepared.curl_header_lines = _curl_header_lines(
+                    prepared.headers)
+            self._curl_setup_options(curl, prepared.prototype,
+                                     prepared.curl_header_lines)
+            curl.template = prepared
         curl.setopt(pycurl.URL, native_str(request.url))
+        self._curl_setup_body(curl, request)
 
-        # libcurl's magic "Expect: 100-continue" behavior causes delays
-        # with servers that don't support it (which include, among others,
-        # Google's OpenID endpoint).  Additionally, this behavior has
-        # a bug in conjunction with the curl_multi_socket_action API
-        # (https://sourceforge.net/tracker/?func=detail&atid=100976&aid=3039744&group_id=976),
-        # which increases the delays.  It's more trouble than it's worth,
-        # so just turn off the feature (yes, setting Expect: to an empty
-        # value is the official way to disable this)
-        if "Expect" not in request.headers:
-            request.headers["Expect"] = ""
-
-        # libcurl adds Pragma: no-cache by default; disable that too
-        if "Pragma" not in request.headers:
-            request.headers["Pragma"] = ""
-
-        curl.setopt(pycurl.HTTPHEADER,
-                    ["%s: %s" % (native_str(k), native_str(v))
-                     for k, v in request.headers.get_all()])
-
-        curl.setopt(pycurl.HEADERFUNCTION,
-                    functools.partial(self._curl_header_callback,
-                                      headers, request.header_callback))
+        if request.header_callback is None:
+            # 只保存原始的头部，不在 curl 的回调中逐行解析
+            header_function = headers.append
+        else:
+            header_function = functools.partial(
+                self._curl_header_callback, headers, request.header_callback)
         if request.streaming_callback:
+            bind_transfer = getattr(
+                request.streaming_callback, "bind_transfer", None)
+            if bind_transfer is not None:
+                # 支持暂停的 streaming_callback （比如 ResponseStream ）
+                bind_transfer(functools.partial(
+                    self._resume_transfer, curl, curl.info))
             def write_function(chunk):
                 return request.streaming_callback(chunk)
         elif request.max_body_length:
@@ -336,7 +968,39 @@ class CurlAsyncHTTPClient(object):
             write_function = _Writer(request.max_body_length, buffer)
         else:
             write_function = buffer.write
+        if request.trace is not None:
+            header_function, write_function = trace_transfer(
+                request.trace, curl.info["retries"],
+                _is_hedge(curl, curl.info), header_function, write_function)
+        curl.setopt(pycurl.HEADERFUNCTION, header_function)
         curl.setopt(pycurl.WRITEFUNCTION, write_function)
+
+    def _resume_transfer(self, curl, info):
+        """Resumes a transfer paused by its write function.  May be
+        called from any thread.
+        """
+        self._event_loop.add_callback(self._unpause_transfer, curl, info)
+
+    def _unpause_transfer(self, curl, info):
+        # 句柄可能已经被用于其他请求了
+        if curl.info is not info:
+            return
+        try:
+            curl.pause(pycurl.PAUSE_CONT)
+        except pycurl.error:
+            # 写函数拒绝了重新传递的数据（比如 ResponseStream 被关闭了），
+            # curl multi 会以失败结束该请求
+            curl_log.debug("fail to unpause transfer", exc_info=True)
+        self._set_timeout(0)
+
+    def _curl_setup_options(self, curl, request, header_lines=None):
+        """Sets the options that do not depend on the URL or the body
+        of the request.
+        """
+        if header_lines is None:
+            header_lines = _curl_header_lines(request.headers)
+        curl.setopt(pycurl.HTTPHEADER, header_lines)
+        curl.header_lines = header_lines
         curl.setopt(pycurl.FOLLOWLOCATION, request.follow_redirects)
         curl.setopt(pycurl.MAXREDIRS, request.max_redirects)
         curl.setopt(pycurl.CONNECTTIMEOUT_MS, int(1000 * request.connect_timeout))
@@ -348,7 +1012,8 @@ class CurlAsyncHTTPClient(object):
         if request.network_interface:
             curl.setopt(pycurl.INTERFACE, request.network_interface)
         if request.decompress_response:
-            curl.setopt(pycurl.ENCODING, "gzip,deflate")
+            curl.setopt(pycurl.ENCODING,
+                        self._get_encoding_option(request.accept_encoding))
         else:
             curl.setopt(pycurl.ENCODING, "none")
         if request.proxy_host and request.proxy_port:
@@ -413,40 +1078,6 @@ class CurlAsyncHTTPClient(object):
         else:
             raise KeyError('unknown method ' + request.method)
 
-        body_expected = request.method in ("POST", "PATCH", "PUT")
-        body_present = request.body is not None
-        if not request.allow_nonstandard_methods:
-            # Some HTTP methods nearly always have bodies while others
-            # almost never do. Fail in this case unless the user has
-            # opted out of sanity checks with allow_nonstandard_methods.
-            if ((body_expected and not body_present) or
-                    (body_present and not body_expected)):
-                raise ValueError(
-                    'Body must %sbe None for method %s (unless '
-                    'allow_nonstandard_methods is true)' %
-                    ('not ' if body_expected else '', request.method))
-
-        if body_expected or body_present:
-            if request.method == "GET":
-                # Even with `allow_nonstandard_methods` we disallow
-                # GET with a body (because libcurl doesn't allow it
-                # unless we use CUSTOMREQUEST). While the spec doesn't
-                # forbid clients from sending a body, it arguably
-                # disallows the server from doing anything with them.
-                raise ValueError('Body must be None for GET request')
-            request_buffer = BytesIO(utf8(request.body or ''))
-
-            def ioctl(cmd):
-                if cmd == curl.IOCMD_RESTARTREAD:
-                    request_buffer.seek(0)
-            curl.setopt(pycurl.READFUNCTION, request_buffer.read)
-            curl.setopt(pycurl.IOCTLFUNCTION, ioctl)
-            if request.method == "POST":
-                curl.setopt(pycurl.POSTFIELDSIZE, len(request.body or ''))
-            else:
-                curl.setopt(pycurl.UPLOAD, True)
-                curl.setopt(pycurl.INFILESIZE, len(request.body or ''))
-
         if request.auth_username is not None:
             if request.auth_mode is None or request.auth_mode == "basic":
                 curl.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_BASIC)
@@ -495,7 +1126,11 @@ class CurlAsyncHTTPClient(object):
             try:
                 curl.setopt(pycurl.DNS_SERVERS, request.dns_servers or "")
             except pycurl.error as exc:
-                if exc.args[0] != pycurl.E_NOT_BUILT_IN:
+                # 没有 c-ares 的 libcurl 返回 E_NOT_BUILT_IN ，较新的版本
+                # 返回 E_UNKNOWN_OPTION
+                if exc.args[0] not in (pycurl.E_NOT_BUILT_IN,
+                                       getattr(pycurl, "E_UNKNOWN_OPTION",
+                                               48)):
                     raise
         if getattr(pycurl, "DNS_CACHE_TIMEOUT", None):
             curl.setopt(pycurl.DNS_CACHE_TIMEOUT, request.dns_cache_timeout or 120)
@@ -508,23 +1143,71 @@ class CurlAsyncHTTPClient(object):
         if request.prepare_curl_callback is not None:
             request.prepare_curl_callback(curl)
 
+    def _curl_setup_body(self, curl, request):
+        body_expected = request.method in ("POST", "PATCH", "PUT")
+        body_present = request.body is not None or \
+            request.body_producer is not None
+        if not request.allow_nonstandard_methods:
+            # Some HTTP methods nearly always have bodies while others
+            # almost never do. Fail in this case unless the user has
+            # opted out of sanity checks with allow_nonstandard_methods.
+            if ((body_expected and not body_present) or
+                    (body_present and not body_expected)):
+                raise ValueError(
+                    'Body must %sbe None for method %s (unless '
+                    'allow_nonstandard_methods is true)' %
+                    ('not ' if body_expected else '', request.method))
+
+        if body_expected or body_present:
+            if request.method == "GET":
+                # Even with `allow_nonstandard_methods` we disallow
+                # GET with a body (because libcurl doesn't allow it
+                # unless we use CUSTOMREQUEST). While the spec doesn't
+                # forbid clients from sending a body, it arguably
+                # disallows the server from doing anything with them.
+                raise ValueError('Body must be None for GET request')
+            if request.body_producer is not None:
+                if request.body is not None:
+                    raise ValueError(
+                        'body and body_producer cannot both be set')
+                reader = _BodyReader(request.body_producer)
+                body_size = request.body_size
+                if body_size is None:
+                    body_size = reader.size()
+                bind_transfer = getattr(
+                    request.body_producer, "bind_transfer", None)
+                if bind_transfer is not None:
+                    # 支持暂停的 body_producer （比如 RequestBodyStream ）
+                    bind_transfer(functools.partial(
+                        self._resume_transfer, curl, curl.info))
+                curl.setopt(pycurl.READFUNCTION, reader.read)
+                curl.setopt(pycurl.IOCTLFUNCTION, reader.ioctl)
+            else:
+                request_buffer = BytesIO(utf8(request.body or ''))
+
+                def ioctl(cmd):
+                    if cmd == curl.IOCMD_RESTARTREAD:
+                        request_buffer.seek(0)
+                curl.setopt(pycurl.READFUNCTION, request_buffer.read)
+                curl.setopt(pycurl.IOCTLFUNCTION, ioctl)
+                body_size = len(request.body or '')
+            if body_size is None:
+                # 长度未知时，使用分块传输编码
+                curl.setopt(pycurl.HTTPHEADER, curl.header_lines +
+                            ["Transfer-Encoding: chunked"])
+                # 下一次使用该句柄时，需要重新设置请求头
+                curl.template = None
+                body_size = -1
+            if request.method == "POST":
+                curl.setopt(pycurl.POSTFIELDSIZE, body_size)
+            else:
+                curl.setopt(pycurl.UPLOAD, True)
+                curl.setopt(pycurl.INFILESIZE, body_size)
+
     def _curl_header_callback(self, headers, header_callback, header_line):
-        header_line = native_str(header_line.decode('latin1'))
-        if header_callback is not None:
-            header_callback(header_line)
         # header_line as returned by curl includes the end-of-line characters.
-        # whitespace at the start should be preserved to allow multi-line headers
-        header_line = header_line.rstrip()
-        if header_line.startswith("HTTP/"):
-            headers.clear()
-            try:
-                (__, __, reason) = httputil.parse_response_start_line(header_line)
-                header_line = "X-Http-Reason: %s" % reason
-            except HTTPInputException:
-                return
-        if not header_line:
-            return
-        headers.parse_line(header_line)
+        headers.append(header_line)
+        header_callback(native_str(header_line.decode('latin1')))
 
     def _curl_debug(self, debug_type, debug_msg):
         debug_types = ('I', '<', '>', '<', '>')
@@ -539,9 +1222,104 @@ class CurlAsyncHTTPClient(object):
             curl_log.debug('%s %r', debug_types[debug_type], debug_msg)
 
     def get_proccessing_requests(self):
+        futures = set()
         for curl in self._curls:
             info = getattr(curl, "info", None)
             if info == None:
                 continue
+            # 对冲请求的多个传输属于同一个请求
+            if id(info["future"]) in futures:
+                continue
+            futures.add(id(info["future"]))
             yield info["request"], info["future"], info["queue_start_time"]
+        # 等待重试的请求
+        for item in self._retry_queue:
+            yield item[:3]
+        for _, item in self._pending_retries.values():
+            yield item[:3]
+        # 等待域名解析的请求
+        for item in self._resolving.values():
+            yield item[:3]
+
+
+def _is_hedge(curl, info):
+    # 对冲请求中后发出的传输
+    hedge = info["hedge"]
+    return hedge is not None and curl is not hedge.primary
+
+
+def _curl_header_lines(headers):
+    # libcurl's magic "Expect: 100-continue" behavior causes delays
+    # with servers that don't support it (which include, among others,
+    # Google's OpenID endpoint).  Additionally, this behavior has
+    # a bug in conjunction with the curl_multi_socket_action API
+    # (https://sourceforge.net/tracker/?func=detail&atid=100976&aid=3039744&group_id=976),
+    # which increases the delays.  It's more trouble than it's worth,
+    # so just turn off the feature (yes, setting Expect: to an empty
+    # value is the official way to disable this)
+    # 不修改请求的 headers ，它可能被多个请求共享。普通的 dict 只在
+    # 这里临时转换，以便不区分大小写地查找
+    if not isinstance(headers, httputil.HTTPHeaders):
+        headers = httputil.HTTPHeaders(headers)
+    header_lines = ["%s: %s" % (native_str(k), native_str(v))
+                    for k, v in headers.get_all()]
+    if "Expect" not in headers:
+        header_lines.append("Expect: ")
+
+    # libcurl adds Pragma: no-cache by default; disable that too
+    if "Pragma" not in headers:
+        header_lines.append("Pragma: ")
+    return header_lines
+
+
+class _BodyReader(object):
+    """Feeds a ``body_producer`` to curl's READFUNCTION.
+
+    The producer is either a file-like object with a ``read(size)``
+    method (a file, ``BytesIO``, ``mmap``, `RequestBodyStream`...), whose
+    ``read`` may return ``pycurl.READFUNC_PAUSE`` when no data is ready,
+    or an iterable of byte strings.
+    """
+    def __init__(self, producer):
+        self._producer = producer
+        self._start = None
+        if hasattr(producer, "read"):
+            self.read = producer.read
+            try:
+                self._start = producer.tell()
+            except (AttributeError, IOError, OSError):
+                pass
+        else:
+            self._iterator = iter(producer)
+            self._pending = None
+
+    def size(self):
+        """Returns the number of bytes left to read, or None if unknown.
+        """
+        if self._start is None:
+            return None
+        try:
+            self._producer.seek(0, os.SEEK_END)
+            end = self._producer.tell()
+            self._producer.seek(self._start)
+        except (AttributeError, IOError, OSError):
+            return None
+        return end - self._start
+
+    def read(self, size):
+        pending = self._pending
+        while not pending:
+            try:
+                pending = memoryview(utf8(next(self._iterator)))
+            except StopIteration:
+                return b""
+        self._pending = pending[size:]
+        return pending[:size].tobytes()
 
+    def ioctl(self, cmd):
+        if cmd != pycurl.IOCMD_RESTARTREAD:
+            return pycurl.IOE_UNKNOWNCMD
+        if self._start is None:
+            return pycurl.IOE_FAILRESTART
+        self._producer.seek(self._start)
+        return pycurl.IOE_OK
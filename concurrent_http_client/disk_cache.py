@@ -0,0 +1,520 @@
+# coding: utf8
+
+# HTTPCache 的磁盘存储，同一台机器上的多个进程可以共享同一个目录：
+# 响应追加写入段文件（ NNNNNNNN.seg ），每个响应在索引文件（ index ）中
+# 追加一行 JSON 。写入时使用文件锁，读取时只需要读出索引新增的行，再通过
+# mmap 读取段文件。超过大小上限时删除最旧的段，超过 ttl 的段也会被删除，
+# 最旧的段中被读取的响应会被重新写入最新的段，因此近似于 LRU 。
+# 压缩和写入都在后台的写线程中进行，不阻塞 worker 线程的事件循环
+
+import contextlib
+import errno
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # 没有 fcntl 的平台上不能在进程之间共享
+    fcntl = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .escape import native_str
+from .util import unicode_type
+
+LOGGER = logging.getLogger(__name__)
+
+_INDEX_NAME = "index"
+_LOCK_NAME = "lock"
+_SEGMENT_FORMAT = "%08d.seg"
+
+
+def _key_string(key):
+    return json.dumps([key[0]] + [list(part) for part in key[1:]],
+                      separators=(",", ":"))
+
+
+def _native(value):
+    # JSON 将 tuple 写为 list ，将 str 读为 unicode
+    if isinstance(value, list):
+        return tuple(_native(item) for item in value)
+    if isinstance(value, unicode_type):
+        return native_str(value)
+    return value
+
+
+def _key_tuple(key_string):
+    parts = json.loads(key_string)
+    return (native_str(parts[0]),) + tuple(_native(part)
+                                          for part in parts[1:])
+
+
+class _Record(object):
+    __slots__ = ("key", "url", "names", "segment", "offset", "meta_length",
+                 "body_length", "compressed", "stored_at")
+
+    def __init__(self, op):
+        self.key = op["k"]
+        self.url = op["u"]
+        self.names = tuple(op["v"])
+        self.segment = op["s"]
+        self.offset = op["o"]
+        self.meta_length = op["m"]
+        self.body_length = op["b"]
+        self.compressed = op["z"]
+        self.stored_at = op["t"]
+
+    def to_op(self):
+        return {"k": self.key, "u": self.url, "v": list(self.names),
+                "s": self.segment, "o": self.offset, "m": self.meta_length,
+                "b": self.body_length, "z": self.compressed,
+                "t": self.stored_at}
+
+
+class DiskCacheStore(object):
+    """Stores `HTTPCache` entries in ``directory``.
+
+    Bodies of at least ``min_compress_size`` bytes are compressed with
+    zlib.  The segment files take at most ``max_bytes`` (each segment
+    is at most ``segment_bytes``); entries older than ``ttl`` seconds
+    are not returned, and their segments are removed.
+
+    Several processes may use the same directory at the same time:
+    writes are serialized with ``flock``, and every process follows the
+    append-only index to see the entries written by the others.
+
+    `put`, `delete_url` and the promotions of entries read from the
+    oldest segment are queued and done on a background writer thread;
+    when more than ``max_pending`` writes are queued, new ones are
+    dropped.  `flush` waits for the queued writes.
+    """
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024,
+                 segment_bytes=16 * 1024 * 1024, ttl=None,
+                 compress_level=6, min_compress_size=256,
+                 max_pending=1000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # 至少保留几个段，淘汰时才不会一次删除太多的响应
+        self.segment_bytes = max(1, min(segment_bytes, max_bytes // 4))
+        self.ttl = ttl
+        self.compress_level = compress_level
+        self.min_compress_size = min_compress_size
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._index_path = os.path.join(directory, _INDEX_NAME)
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(directory, _LOCK_NAME), "ab")
+        self._index_file = None
+        self._maps = {}     # Map: segment -> mmap
+        self._reset()
+        self._stats = {
+            "reads": 0,
+            "read_hits": 0,
+            "expired": 0,
+            "writes": 0,
+            "bytes_written": 0,
+            "promotions": 0,
+            "evicted_segments": 0,
+            "compactions": 0,
+            "dropped_writes": 0,
+            "bad_lines": 0,
+        }
+        with self._lock:
+            self._refresh()
+        self._writes = queue.Queue(max_pending)
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.setName("disk-cache-writer")
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+    def _reset(self):
+        if self._index_file is not None:
+            self._index_file.close()
+        for m in self._maps.values():
+            m.close()
+        self._index_file = None
+        self._index_ino = None
+        self._index_offset = 0
+        self._index_lines = 0
+        self._maps = {}
+        self._records = {}  # Map: key string -> _Record
+        self._urls = {}     # Map: url -> (Vary names, set of key strings)
+        self._segments = {} # Map: segment -> [newest stored_at, set of keys]
+        self._max_segment = -1
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, _SEGMENT_FORMAT % segment)
+
+    def _refresh(self):
+        """Applies the index lines appended since the last call."""
+        try:
+            st = os.stat(self._index_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            st = None
+        if st is None or st.st_ino != self._index_ino:
+            # 索引被重写了，重新读取
+            self._reset()
+            if st is None:
+                return
+            try:
+                self._index_file = open(self._index_path, "rb")
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return
+            self._index_ino = os.fstat(self._index_file.fileno()).st_ino
+        self._index_file.seek(self._index_offset)
+        data = self._index_file.read()
+        end = data.rfind(b"\n")
+        if end < 0:
+            return
+        # 最后一行可能还没有写完
+        self._index_offset += end + 1
+        for line in data[:end].split(b"\n"):
+            try:
+                op = json.loads(line.decode("utf-8"))
+                self._apply(op)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # 写入索引时崩溃的进程留下的不完整的行，跳过
+                self._stats["bad_lines"] += 1
+
+    def _apply(self, op):
+        self._index_lines += 1
+        if not isinstance(op, dict):
+            raise TypeError("index line is not an object")
+        if "d" in op:
+            self._forget(op["d"])
+        elif "x" in op:
+            self._drop(op["x"])
+        elif "n" in op:
+            self._max_segment = max(self._max_segment, op["n"])
+        else:
+            record = _Record(op)
+            self._forget(record.key)
+            url = self._urls.get(record.url)
+            if url is not None and url[0] != record.names:
+                # Vary 改变之后，之前的条目都无法再命中
+                for key in list(url[1]):
+                    self._forget(key)
+                url = None
+            if url is None:
+                url = self._urls[record.url] = (record.names, set())
+            url[1].add(record.key)
+            self._records[record.key] = record
+            segment = self._segments.get(record.segment)
+            if segment is None:
+                segment = self._segments[record.segment] = [0, set()]
+            segment[0] = max(segment[0], record.stored_at)
+            segment[1].add(record.key)
+            self._max_segment = max(self._max_segment, record.segment)
+
+    def _forget(self, key):
+        record = self._records.pop(key, None)
+        if record is None:
+            return
+        keys = self._urls[record.url][1]
+        keys.discard(key)
+        if not keys:
+            del self._urls[record.url]
+        segment = self._segments.get(record.segment)
+        if segment is not None:
+            segment[1].discard(key)
+
+    def _drop(self, segment):
+        self._max_segment = max(self._max_segment, segment)
+        entry = self._segments.pop(segment, None)
+        if entry is not None:
+            for key in list(entry[1]):
+                self._forget(key)
+        m = self._maps.pop(segment, None)
+        if m is not None:
+            m.close()
+
+    def _read(self, record):
+        end = record.offset + record.meta_length + record.body_length
+        m = self._maps.get(record.segment)
+        if m is None or len(m) < end:
+            # 段文件在映射之后又追加了内容
+            if m is not None:
+                m.close()
+                del self._maps[record.segment]
+            try:
+                with open(self._segment_path(record.segment), "rb") as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError):
+                return None
+            self._maps[record.segment] = m
+            if len(m) < end:
+                return None
+        meta_end = record.offset + record.meta_length
+        return m[record.offset:meta_end], m[meta_end:end]
+
+    def get_vary(self, url):
+        """Returns the names of the headers the entries of ``url`` vary
+        on, or None if there is no entry for ``url``.
+        """
+        with self._lock:
+            self._refresh()
+            url = self._urls.get(url)
+            return None if url is None else url[0]
+
+    def get(self, key):
+        """Returns ``(meta, body)`` stored for ``key``, or None."""
+        return self._load(_key_string(key), True)
+
+    def _load(self, key, promote):
+        with self._lock:
+            self._stats["reads"] += 1
+            self._refresh()
+            record = self._records.get(key)
+            if record is None:
+                return None
+            if self.ttl is not None and \
+                    time.time() - record.stored_at > self.ttl:
+                self._stats["expired"] += 1
+                return None
+            data = self._read(record)
+            if data is None:
+                return None
+            meta, body = data
+            self._stats["read_hits"] += 1
+            if promote and len(self._segments) > 1 and \
+                    record.segment == min(self._segments):
+                # 最旧的段会最先被删除，把被读取的响应移到最新的段
+                self._queue_write(self._promote, record, meta, body)
+        if record.compressed:
+            body = zlib.decompress(body)
+        return json.loads(meta.decode("utf-8")), body
+
+    def _queue_write(self, function, *args):
+        try:
+            self._writes.put_nowait((function, args))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped_writes"] += 1
+
+    def _write_loop(self):
+        while True:
+            function, args = self._writes.get()
+            try:
+                if function is None:
+                    return
+                function(*args)
+            except Exception:
+                LOGGER.error("fail to write the disk cache", exc_info=True)
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        """Waits until the queued writes are done."""
+        self._writes.join()
+
+    def _promote(self, record, meta, body):
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                if self._records.get(record.key) is record:
+                    self._append(record.key, record.url, record.names,
+                                 meta, body, record.compressed,
+                                 record.stored_at)
+                    self._stats["promotions"] += 1
+
+    def put(self, key, names, meta, body):
+        """Queues storing ``meta`` (a JSON-serializable dict with the
+        stored time under ``"t"``) and ``body`` for ``key``, whose URL
+        varies on the header ``names``.
+        """
+        self._queue_write(self._put, key, names, meta, body)
+
+    def _put(self, key, names, meta, body):
+        meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+        compressed = 0
+        if len(body) >= self.min_compress_size:
+            compressed_body = zlib.compress(body, self.compress_level)
+            if len(compressed_body) < len(body):
+                body = compressed_body
+                compressed = 1
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                self._append(_key_string(key), key[0], names, meta_bytes,
+                             body, compressed, meta["t"])
+                self._evict()
+                self._compact_if_necessary()
+
+    def delete_url(self, url):
+        """Queues deleting the entries of ``url``."""
+        self._queue_write(self._delete_url, url)
+
+    def _delete_url(self, url):
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                entry = self._urls.get(url)
+                if entry is None:
+                    return
+                self._write_index([{"d": key} for key in entry[1]])
+
+    def _write_index(self, ops):
+        data = b"".join(
+            json.dumps(op, separators=(",", ":")).encode("utf-8") + b"\n"
+            for op in ops)
+        with open(self._index_path, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 结束之前的不完整的行，否则新写入的第一行也无法解析
+                    data = b"\n" + data
+            f.write(data)
+        self._refresh()
+
+    def _current_segment(self):
+        segment = self._max_segment
+        if segment < 0:
+            return 0
+        if segment not in self._segments:
+            # 段已经被删除，段号不再使用
+            return segment + 1
+        try:
+            size = os.path.getsize(self._segment_path(segment))
+        except OSError:
+            return segment + 1
+        if size >= self.segment_bytes:
+            return segment + 1
+        return segment
+
+    def _append(self, key, url, names, meta, body, compressed, stored_at):
+        segment = self._current_segment()
+        with open(self._segment_path(segment), "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(meta + body)
+        self._stats["writes"] += 1
+        self._stats["bytes_written"] += len(meta) + len(body)
+        self._write_index([{
+            "k": key, "u": url, "v": list(names), "s": segment,
+            "o": offset, "m": len(meta), "b": len(body), "z": compressed,
+            "t": stored_at}])
+
+    def _disk_bytes(self):
+        sizes = {}
+        for segment in self._segments:
+            try:
+                sizes[segment] = os.path.getsize(self._segment_path(segment))
+            except OSError:
+                sizes[segment] = 0
+        return sizes
+
+    def _evict(self):
+        sizes = self._disk_bytes()
+        total = sum(sizes.values())
+        current = max(self._max_segment, 0)
+        now = time.time()
+        drops = []
+        for segment in sorted(sizes):
+            if segment == current:
+                break
+            expired = self.ttl is not None and \
+                now - self._segments[segment][0] > self.ttl
+            if total <= self.max_bytes and not expired:
+                continue
+            drops.append(segment)
+            total -= sizes[segment]
+        if not drops:
+            return
+        self._write_index([{"x": segment} for segment in drops])
+        for segment in drops:
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError:
+                pass
+        self._stats["evicted_segments"] += len(drops)
+
+    def _compact_if_necessary(self):
+        if self._index_lines <= 2 * len(self._records) + 1024:
+            return
+        # 只保留有效的条目，重写索引，其他进程根据 inode 的变化重新读取
+        path = self._index_path + ".tmp"
+        ops = [{"n": self._max_segment}] + [
+            record.to_op() for record in sorted(
+                self._records.values(),
+                key=lambda record: (record.segment, record.offset))]
+        with open(path, "wb") as f:
+            f.write(b"".join(
+                json.dumps(op, separators=(",", ":")).encode("utf-8") + b"\n"
+                for op in ops))
+        os.rename(path, self._index_path)
+        self._stats["compactions"] += 1
+        self._refresh()
+
+    def recent(self, max_bytes):
+        """Returns ``(key, meta, body)`` of the most recently stored
+        entries, at most ``max_bytes`` of stored data.
+        """
+        with self._lock:
+            self._refresh()
+            records = sorted(self._records.values(),
+                             key=lambda record: record.stored_at,
+                             reverse=True)
+        entries = []
+        total = 0
+        for record in records:
+            size = record.meta_length + record.body_length
+            if total + size > max_bytes:
+                break
+            loaded = self._load(record.key, False)
+            if loaded is None:
+                continue
+            total += size
+            entries.append((_key_tuple(record.key),) + loaded)
+        return entries
+
+    def close(self):
+        self._writes.put((None, ()))
+        self._writer.join()
+        with self._lock:
+            self._reset()
+            self._lock_file.close()
+
+    def get_stats(self):
+        """Returns the counters ``reads``, ``read_hits``, ``expired``,
+        ``writes``, ``bytes_written``, ``promotions`` (entries moved out
+        of the oldest segment), ``evicted_segments`` and
+        ``compactions``, ``dropped_writes`` (the write queue was full) and
+        ``bad_lines`` (unparsable index lines skipped) of this process, and the current ``pending_writes``, ``entries``,
+        ``segments`` and ``disk_bytes``.
+        """
+        with self._lock:
+            self._refresh()
+            stats = dict(self._stats)
+            stats["pending_writes"] = self._writes.qsize()
+            stats["entries"] = len(self._records)
+            stats["segments"] = len(self._segments)
+            stats["disk_bytes"] = sum(self._disk_bytes().values())
+        return stats
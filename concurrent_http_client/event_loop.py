@@ -158,6 +158,24 @@ class EventLoop(object):
         self.wake()
         return True
 
+    def get_stats(self):
+        """Returns the number of pending ``timeouts`` (not counting the
+        removed ones), queued ``callbacks`` and registered ``handlers``
+        (including the internal waker).
+        """
+        with self._timeout_lock:
+            # 移除已经执行过的 timeout 也会被计入 _cancellations ，所以
+            # 直接数堆中仍然有效的 timeout
+            timeouts = sum(1 for timeout in self._timeouts
+                           if timeout.callback is not None)
+        with self._handler_lock:
+            handlers = len(self._handlers)
+        return {
+            "timeouts": timeouts,
+            "callbacks": len(self._callbacks),
+            "handlers": handlers,
+        }
+
     def _run_callback(self, callback):
         if callback == None:
             return
@@ -31,6 +31,18 @@ class CurlSetupException(CurlAsyncHTTPClientException):
             self.exc) + "@" + hex(id(self))
 
 
+class CircuitOpenException(CurlAsyncHTTPClientException):
+    def __init__(self, origin, *args, **kwargs):
+        CurlAsyncHTTPClientException.__init__(self, *args, **kwargs)
+        self.origin = origin
+
+    def __str__(self):
+        return "%s{origin=%s}" % (self.__class__.__name__, self.origin)
+
+    def __repr__(self):
+        return self.__str__() + "@" + hex(id(self))
+
+
 class CurlException(CurlAsyncHTTPClientException):
     def __init__(self, errno, message, *args, **kwargs):
         CurlAsyncHTTPClientException.__init__(self, *args, **kwargs)
@@ -0,0 +1,109 @@
+# coding: utf8
+
+# 对冲请求：如果请求在一定时间内没有完成，就在同一个 worker 中用另一个
+# curl 句柄（以及一个新的连接）再发送一次，先成功完成的传输决定请求的
+# 结果，另一个传输立即从 CurlMulti 中移除。对冲请求的比例受预算的限制
+
+import collections
+import threading
+
+from .retry import DEFAULT_RETRY_METHODS, RetryBudget
+
+
+class HedgePolicy(object):
+    """Decides when an idempotent request gets a duplicate transfer.
+
+    The duplicate is started ``delay`` seconds after the first
+    transfer, or, if ``delay`` is None, after the ``percentile`` of the
+    latencies of the last ``window`` requests (the request is not
+    hedged until ``min_samples`` latencies were observed).  The delay
+    is at least ``min_delay``.  Duplicates are limited to ``max_ratio``
+    of the eligible requests.  With ``fresh_connect`` the duplicate
+    does not reuse a pooled connection, so that it is likely to reach
+    another upstream replica.
+
+    Only requests using one of ``methods`` without ``body_producer``
+    or ``streaming_callback`` are hedged.  The policy is thread-safe
+    and may be shared by all the workers of a manager.
+    """
+    def __init__(self, delay=None, percentile=95, window=1000,
+                 min_samples=50, min_delay=0.005, max_ratio=0.05,
+                 methods=DEFAULT_RETRY_METHODS, fresh_connect=True):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.methods = frozenset(methods)
+        self.fresh_connect = fresh_connect
+        self.budget = RetryBudget(ratio=max_ratio, min_per_second=0,
+                                  max_balance=max(1.0, max_ratio * window))
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._recompute_every = max(1, window // 10)
+        self._records = 0
+        self._adaptive_delay = None
+        self._stats = {
+            "eligible": 0,
+            "hedges": 0,
+            "wins": 0,
+            "cancelled": 0,
+            "budget_denied": 0,
+            "no_handle": 0,
+        }
+
+    def is_eligible(self, request):
+        return request.method in self.methods and \
+            request.body_producer is None and \
+            request.streaming_callback is None
+
+    def get_delay(self):
+        """Returns the delay before hedging a request, or None if it
+        is not known yet.
+        """
+        if self.delay is not None:
+            return max(self.delay, self.min_delay)
+        delay = self._adaptive_delay
+        if delay is None:
+            return None
+        return max(delay, self.min_delay)
+
+    def record(self, latency):
+        """Records the latency of a completed request."""
+        with self._lock:
+            self._latencies.append(latency)
+            self._records = self._records + 1
+            if self._records % self._recompute_every or \
+                    len(self._latencies) < self.min_samples:
+                return
+            latencies = sorted(self._latencies)
+        index = int(len(latencies) * self.percentile / 100.0)
+        self._adaptive_delay = latencies[min(index, len(latencies) - 1)]
+
+    def count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_stats(self):
+        """Returns the counters ``eligible`` (requests that could be
+        hedged), ``hedges`` (duplicates started), ``wins`` (requests
+        completed by the duplicate), ``cancelled`` (losing transfers
+        removed), ``budget_denied`` and ``no_handle`` (duplicates not
+        started because of the load cap or because no curl handle was
+        free), and the current ``delay``.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["delay"] = self.get_delay()
+        return stats
+
+
+class _Hedge(object):
+    """The transfers of one hedged request."""
+    __slots__ = ("policy", "primary", "curls", "timeout")
+
+    def __init__(self, policy, curl):
+        self.policy = policy
+        self.primary = curl
+        # 正在进行的传输，第一个是原始的传输
+        self.curls = [curl]
+        self.timeout = None
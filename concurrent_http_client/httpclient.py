@@ -2,6 +2,8 @@
 
 # 本段代码修改自：tornado
 
+import collections
+import numbers
 import time
 
 from . import httputil
@@ -9,21 +11,74 @@ from .escape import utf8
 from .exceptions import HTTPException
 
 
+class TimeInfo(collections.namedtuple("TimeInfo", [
+        "queue", "namelookup", "connect", "appconnect", "pretransfer",
+        "starttransfer", "total", "redirect"])):
+    """The timings of a response, in seconds: the time spent in the
+    queue, and the curl timings documented at
+    http://curl.haxx.se/libcurl/c/curl_easy_getinfo.html
+
+    Timings that were not collected (see ``collect_metrics``) are None.
+    Besides the tuple fields, it supports the read-only dict interface
+    of the ``time_info`` dict it replaces; iterating over it yields the
+    values, as for any tuple.
+
+    >>> info = TimeInfo(0.5, None, None, None, None, None, 1.5, None)
+    >>> info.total, info["total"], info.get("connect", 0)
+    (1.5, 1.5, 0)
+    >>> sorted(info.keys())
+    ['queue', 'total']
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, (numbers.Integral, slice)):
+            return tuple.__getitem__(self, key)
+        try:
+            index = self._fields.index(key)
+        except ValueError:
+            raise KeyError(key)
+        return tuple.__getitem__(self, index)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        if key not in self._fields:
+            return default
+        value = self[key]
+        return default if value is None else value
+
+    def keys(self):
+        return [name for name, value in zip(self._fields, self)
+                if value is not None]
+
+    def items(self):
+        return [(name, value) for name, value in zip(self._fields, self)
+                if value is not None]
+
+# 可以通过 collect_metrics 选择收集的指标
+METRICS = TimeInfo._fields + ("primary_ip", "speed_download", "speed_upload")
+
+
 class HTTPResponse(object):
+    __slots__ = (
+        "request", "code", "reason", "_headers", "_raw_headers", "buffer",
+        "_body", "effective_url", "_error_is_response_code", "error",
+        "start_time", "request_time", "time_info", "primary_ip",
+        "speed_download", "speed_upload")
+
     def __init__(self, request, code, headers=None, buffer=None,
                  effective_url=None, error=None, request_time=None,
                  time_info=None, reason=None, start_time=None,
-                 primary_ip=None, speed_download=None, speed_upload=None):
-        if isinstance(request, _RequestProxy):
-            self.request = request.request
-        else:
-            self.request = request
+                 primary_ip=None, speed_download=None, speed_upload=None,
+                 raw_headers=None):
+        self.request = request
         self.code = code
         self.reason = reason or httputil.responses.get(code, "Unknown")
-        if headers is not None:
-            self.headers = headers
-        else:
-            self.headers = httputil.HTTPHeaders()
+        # raw_headers 是 curl 传递的原始头部行，在第一次访问 headers 时解析
+        self._headers = headers
+        self._raw_headers = raw_headers
         self.buffer = buffer
         self._body = None
         if effective_url is None:
@@ -47,6 +102,23 @@ class HTTPResponse(object):
         self.speed_download = speed_download
         self.speed_upload = speed_upload
 
+    @property
+    def headers(self):
+        headers = self._headers
+        if headers is None:
+            raw_headers = self._raw_headers
+            if raw_headers is not None:
+                headers = httputil.parse_raw_headers(raw_headers)
+            else:
+                headers = httputil.HTTPHeaders()
+            self._headers = headers
+        return headers
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers = headers
+        self._raw_headers = None
+
     @property
     def body(self):
         if self.buffer is None:
@@ -56,17 +128,65 @@ class HTTPResponse(object):
 
         return self._body
 
+    @property
+    def body_file(self):
+        """The body as a file object positioned at its start: the file
+        it was spilled to, or the in-memory buffer otherwise.
+        """
+        if self.buffer is None:
+            return None
+        body_file = getattr(self.buffer, "file", None) or self.buffer
+        body_file.seek(0)
+        return body_file
+
+    @property
+    def body_view(self):
+        """The body as a read-only ``memoryview``, without copying it.
+        Spilled bodies are viewed through an ``mmap`` of their file.
+        The view is only valid until `release` is called.
+        """
+        if self.buffer is None:
+            return None
+        return self.buffer.getbuffer()
+
+    def release(self):
+        """Returns the body buffer to the client's buffer pool.  Calling
+        it is optional; `body` and `body_view` must not be used
+        afterwards, unless `body` was read before.
+        """
+        buffer, self.buffer = self.buffer, None
+        if buffer is not None and hasattr(buffer, "release"):
+            buffer.release()
+
     def rethrow(self):
         """If there was an error on the request, raise an `HTTPException`."""
         if self.error:
             raise self.error
 
     def __repr__(self):
-        args = ",".join("%s=%r" % i for i in sorted(self.__dict__.items()))
+        args = ",".join("%s=%r" % (name, getattr(self, name))
+                        for name in sorted(HTTPResponse.__slots__))
         return "%s(%s)" % (self.__class__.__name__, args)
 
 
 class HTTPRequest(object):
+    # 请求对象可能会在队列中大量堆积，使用 __slots__ 以节省内存
+    __slots__ = (
+        "url", "method", "_headers", "_body", "body_producer", "body_size",
+        "auth_username", "auth_password", "auth_mode",
+        "connect_timeout", "request_timeout", "follow_redirects",
+        "max_redirects", "user_agent", "decompress_response",
+        "network_interface", "streaming_callback", "header_callback",
+        "prepare_curl_callback", "proxy_host", "proxy_port",
+        "proxy_username", "proxy_password", "proxy_auth_mode",
+        "allow_nonstandard_methods", "validate_cert", "ca_certs",
+        "allow_ipv6", "client_key", "client_cert", "ssl_options",
+        "expect_100_continue", "start_time", "max_body_length",
+        "resolve_list", "connect_to_list", "dns_servers",
+        "dns_cache_timeout", "dns_use_global_cache", "prepared",
+        "spill_threshold", "spill_path", "collect_metrics",
+        "accept_encoding", "retry_policy", "hedge_policy", "trace")
+
     _DEFAULTS = dict(
         connect_timeout=20.0,
         request_timeout=20.0,
@@ -93,40 +213,64 @@ class HTTPRequest(object):
                  ssl_options=None, max_body_length=None,
                  resolve_list=None, connect_to_list=None,
                  dns_servers=None, dns_cache_timeout=None,
-                 dns_use_global_cache=None):
+                 dns_use_global_cache=None, prepared=None,
+                 spill_threshold=None, spill_path=None,
+                 body_size=None, collect_metrics=None,
+                 accept_encoding=None, retry_policy=None,
+                 hedge_policy=None):
         # Note that some of these attributes go through property setters
         # defined below.
         self.headers = headers
         if if_modified_since:
             self.headers["If-Modified-Since"] = httputil.format_timestamp(
                 if_modified_since)
+        # 未指定的选项在构造时取 _DEFAULTS 中的默认值
+        defaults = self._DEFAULTS
+        if decompress_response is None:
+            decompress_response = use_gzip
         self.proxy_host = proxy_host
         self.proxy_port = proxy_port
         self.proxy_username = proxy_username
-        self.proxy_password = proxy_password
+        self.proxy_password = defaults["proxy_password"] \
+            if proxy_password is None else proxy_password
         self.proxy_auth_mode = proxy_auth_mode
         self.url = url
         self.method = method
         self.body = body
         self.body_producer = body_producer
+        self.body_size = body_size
+        self.collect_metrics = collect_metrics
         self.auth_username = auth_username
         self.auth_password = auth_password
         self.auth_mode = auth_mode
-        self.connect_timeout = connect_timeout
-        self.request_timeout = request_timeout
-        self.follow_redirects = follow_redirects
-        self.max_redirects = max_redirects
+        self.connect_timeout = defaults["connect_timeout"] \
+            if connect_timeout is None else connect_timeout
+        self.request_timeout = defaults["request_timeout"] \
+            if request_timeout is None else request_timeout
+        self.follow_redirects = defaults["follow_redirects"] \
+            if follow_redirects is None else follow_redirects
+        self.max_redirects = defaults["max_redirects"] \
+            if max_redirects is None else max_redirects
         self.user_agent = user_agent
-        if decompress_response is not None:
-            self.decompress_response = decompress_response
-        else:
-            self.decompress_response = use_gzip
+        self.decompress_response = defaults["decompress_response"] \
+            if decompress_response is None else decompress_response
+        # 按优先级排列的编码列表，或者 "" 表示 libcurl 支持的全部编码；
+        # None 表示使用 client 的 accept_encoding
+        self.accept_encoding = accept_encoding
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        # 由 Manager 的 tracer 设置的 tracing.Trace ，未被采样时为 None
+        self.trace = None
         self.network_interface = network_interface
         self.streaming_callback = streaming_callback
         self.header_callback = header_callback
         self.prepare_curl_callback = prepare_curl_callback
-        self.allow_nonstandard_methods = allow_nonstandard_methods
-        self.validate_cert = validate_cert
+        self.allow_nonstandard_methods = \
+            defaults["allow_nonstandard_methods"] \
+            if allow_nonstandard_methods is None \
+            else allow_nonstandard_methods
+        self.validate_cert = defaults["validate_cert"] \
+            if validate_cert is None else validate_cert
         self.ca_certs = ca_certs
         self.allow_ipv6 = allow_ipv6
         self.client_key = client_key
@@ -140,6 +284,9 @@ class HTTPRequest(object):
         self.dns_servers = dns_servers
         self.dns_cache_timeout = dns_cache_timeout
         self.dns_use_global_cache = dns_use_global_cache
+        self.prepared = prepared
+        self.spill_threshold = spill_threshold
+        self.spill_path = spill_path
 
     @property
     def headers(self):
@@ -160,50 +307,36 @@ class HTTPRequest(object):
     def body(self, value):
         self._body = utf8(value)
 
-    @property
-    def body_producer(self):
-        return self._body_producer
-
-    @body_producer.setter
-    def body_producer(self, value):
-        self._body_producer = value
 
-    @property
-    def streaming_callback(self):
-        return self._streaming_callback
-
-    @streaming_callback.setter
-    def streaming_callback(self, value):
-        self._streaming_callback = value
-
-    @property
-    def header_callback(self):
-        return self._header_callback
-
-    @header_callback.setter
-    def header_callback(self, value):
-        self._header_callback = value
+class PreparedRequest(object):
+    """A template for requests that only differ in URL and body.
 
-    @property
-    def prepare_curl_callback(self):
-        return self._prepare_curl_callback
-
-    @prepare_curl_callback.setter
-    def prepare_curl_callback(self, value):
-        self._prepare_curl_callback = value
+    The options of the template are resolved once, and a curl handle
+    that has already applied the template only needs the URL and the
+    body to be set for the next transfer.  ``prepare_curl_callback`` is
+    therefore called once per handle rather than once per request, and
+    the template's headers must not be modified after construction.
 
+    >>> template = PreparedRequest(headers={"Accept": "text/html"},
+    ...                            connect_timeout=4)
+    >>> request = template.request("http://example.com/")
+    >>> request.connect_timeout, request.prepared is template
+    (4, True)
+    """
+    def __init__(self, method="GET", headers=None, **kwargs):
+        if "url" in kwargs or "body" in kwargs or "prepared" in kwargs:
+            raise TypeError(
+                "url and body are given per request, not per template")
+        self.method = method
+        self.headers = httputil.HTTPHeaders(headers or {})
+        self._kwargs = kwargs
+        # 模板中不包含 URL ，仅用于设置 curl 选项
+        self.prototype = HTTPRequest(None, method=method,
+                                     headers=self.headers, **kwargs)
+        # Filled in by the client the first time the template is applied
+        self.curl_header_lines = None
 
-class _RequestProxy(object):
-    def __init__(self, request, defaults):
-        self.request = request
-        self.defaults = defaults
-
-    def __getattr__(self, name):
-        request_attr = getattr(self.request, name)
-        if request_attr is not None:
-            return request_attr
-        elif self.defaults is not None:
-            return self.defaults.get(name, None)
-        else:
-            return None
+    def request(self, url, body=None):
+        return HTTPRequest(url, method=self.method, headers=self.headers,
+                           body=body, prepared=self, **self._kwargs)
 
@@ -15,6 +15,11 @@ from .escape import native_str, utf8
 from .util import unicode_type, PY3
 from .exceptions import HTTPInputException
 
+try:
+    from collections.abc import MutableMapping  # py3.3+
+except ImportError:
+    from collections import MutableMapping
+
 if PY3:
     from http.client import responses
 else:
@@ -27,36 +32,75 @@ responses
 _CRLF_RE = re.compile(r'\r?\n')
 
 
+def _normalize_header(name):
+    return "-".join([w.capitalize() for w in name.split("-")])
+
+# 常见的头部名称，它们的规范形式被预先计算，并且不会从缓存中淘汰
+_COMMON_HEADER_NAMES = (
+    "Accept", "Accept-Charset", "Accept-Encoding", "Accept-Language",
+    "Accept-Ranges", "Access-Control-Allow-Credentials",
+    "Access-Control-Allow-Headers", "Access-Control-Allow-Methods",
+    "Access-Control-Allow-Origin", "Access-Control-Expose-Headers",
+    "Access-Control-Max-Age", "Age", "Allow", "Alt-Svc",
+    "Authorization", "Cache-Control", "Connection",
+    "Content-Disposition", "Content-Encoding", "Content-Language",
+    "Content-Length", "Content-Location", "Content-Range",
+    "Content-Security-Policy", "Content-Type", "Cookie", "Date",
+    "ETag", "Expect", "Expires", "Host", "If-Match",
+    "If-Modified-Since", "If-None-Match", "If-Range",
+    "If-Unmodified-Since", "Keep-Alive", "Last-Modified", "Link",
+    "Location", "Origin", "P3P", "Pragma", "Proxy-Authenticate",
+    "Proxy-Authorization", "Range", "Referer", "Referrer-Policy",
+    "Retry-After", "Server", "Set-Cookie", "Strict-Transport-Security",
+    "TE", "Trailer", "Transfer-Encoding", "Upgrade", "User-Agent",
+    "Vary", "Via", "Warning", "WWW-Authenticate",
+    "X-Content-Type-Options", "X-Forwarded-For", "X-Frame-Options",
+    "X-Http-Reason", "X-Powered-By", "X-Request-Id", "X-XSS-Protection",
+)
+
+
 class _NormalizedHeaderCache(dict):
     """Dynamic cached mapping of header names to Http-Header-Case.
-    Implemented as a dict subclass so that cache hits are as fast as a
-    normal dict lookup, without the overhead of a python function
-    call.
-    >>> normalized_headers = _NormalizedHeaderCache(10)
+    Implemented as a dict subclass so that looking up one of the
+    ``common_names`` is as fast as a normal dict lookup, without the
+    overhead of a python function call.  Other names go through
+    `__missing__`, which keeps the ``size`` most recently used ones.
+    >>> normalized_headers = _NormalizedHeaderCache(2)
     >>> normalized_headers["coNtent-TYPE"]
     'Content-Type'
+    >>> for name in ("x-a", "x-b", "x-a", "x-c"):
+    ...     _ = normalized_headers[name]
+    >>> list(normalized_headers.lru)
+    ['x-a', 'x-c']
     """
-    def __init__(self, size):
+    def __init__(self, size, common_names=()):
         super(_NormalizedHeaderCache, self).__init__()
         self.size = size
-        self.queue = collections.deque()
+        self.lru = collections.OrderedDict()
+        for name in common_names:
+            normalized = _normalize_header(name)
+            self[name] = normalized
+            self[name.lower()] = normalized
+            self[normalized] = normalized
 
     def __missing__(self, key):
-        normalized = "-".join([w.capitalize() for w in key.split("-")])
-        self[key] = normalized
-        self.queue.append(key)
-        if len(self.queue) > self.size:
-            # Limit the size of the cache.  LRU would be better, but this
-            # simpler approach should be fine.  In Python 2.7+ we could
-            # use OrderedDict (or in 3.2+, @functools.lru_cache).
-            old_key = self.queue.popleft()
-            del self[old_key]
+        lru = self.lru
+        try:
+            normalized = lru.pop(key)
+        except KeyError:
+            normalized = _normalize_header(key)
+            if len(lru) >= self.size:
+                try:
+                    lru.popitem(last=False)
+                except KeyError:
+                    pass
+        lru[key] = normalized
         return normalized
 
-_normalized_headers = _NormalizedHeaderCache(1000)
+_normalized_headers = _NormalizedHeaderCache(1000, _COMMON_HEADER_NAMES)
 
 
-class HTTPHeaders(collections.MutableMapping):
+class HTTPHeaders(MutableMapping):
     """A dictionary that maintains ``Http-Header-Case`` for all keys.
     Supports multiple values per key via a pair of new methods,
     `add()` and `get_list()`.  The regular dictionary interface
@@ -81,15 +125,17 @@ class HTTPHeaders(collections.MutableMapping):
     Set-Cookie: C=D
     """
     def __init__(self, *args, **kwargs):
-        self._dict = {}  # type: typing.Dict[str, str]
+        # 每个头部的所有值保存在一个列表中，多个值只在读取时才拼接
         self._as_list = {}  # type: typing.Dict[str, typing.List[str]]
+        # 拼接后的多值头部的缓存： name -> (values, len(values), joined)
+        self._joined = None
         self._last_key = None
         if (len(args) == 1 and len(kwargs) == 0 and
                 isinstance(args[0], HTTPHeaders)):
             # Copy constructor
-            for k, v in args[0].get_all():
-                self.add(k, v)
-        else:
+            for k, v in args[0]._as_list.items():
+                self._as_list[k] = list(v)
+        elif args or kwargs:
             # Dict-style initialization
             self.update(*args, **kwargs)
 
@@ -100,12 +146,11 @@ class HTTPHeaders(collections.MutableMapping):
         """Adds a new value for the given key."""
         norm_name = _normalized_headers[name]
         self._last_key = norm_name
-        if norm_name in self:
-            self._dict[norm_name] = (native_str(self[norm_name]) + ',' +
-                                     native_str(value))
-            self._as_list[norm_name].append(value)
+        values = self._as_list.get(norm_name)
+        if values is None:
+            self._as_list[norm_name] = [value]
         else:
-            self[norm_name] = value
+            values.append(value)
 
     def get_list(self, name):
         """Returns all values for the given header as a list."""
@@ -135,7 +180,8 @@ class HTTPHeaders(collections.MutableMapping):
                 raise HTTPInputException("first header line cannot start with whitespace")
             new_part = ' ' + line.lstrip()
             self._as_list[self._last_key][-1] += new_part
-            self._dict[self._last_key] += new_part
+            if self._joined is not None:
+                self._joined.pop(self._last_key, None)
         else:
             try:
                 name, value = line.split(":", 1)
@@ -159,24 +205,52 @@ class HTTPHeaders(collections.MutableMapping):
     # MutableMapping abstract method implementations.
 
     def __setitem__(self, name, value):
-        norm_name = _normalized_headers[name]
-        self._dict[norm_name] = value
-        self._as_list[norm_name] = [value]
+        self._as_list[_normalized_headers[name]] = [value]
 
     def __getitem__(self, name):
         # type: (str) -> str
-        return self._dict[_normalized_headers[name]]
+        norm_name = _normalized_headers[name]
+        values = self._as_list[norm_name]
+        if len(values) == 1:
+            return values[0]
+        return self._join(norm_name, values)
+
+    def _join(self, norm_name, values):
+        # 列表被替换（ __setitem__ ）或者追加了新的值之后，缓存会失效
+        if self._joined is None:
+            self._joined = {}
+        else:
+            cached = self._joined.get(norm_name)
+            if cached is not None and cached[0] is values and \
+                    cached[1] == len(values):
+                return cached[2]
+        joined = ",".join([native_str(v) for v in values])
+        self._joined[norm_name] = (values, len(values), joined)
+        return joined
 
     def __delitem__(self, name):
-        norm_name = _normalized_headers[name]
-        del self._dict[norm_name]
-        del self._as_list[norm_name]
+        del self._as_list[_normalized_headers[name]]
 
     def __len__(self):
-        return len(self._dict)
+        return len(self._as_list)
 
     def __iter__(self):
-        return iter(self._dict)
+        return iter(self._as_list)
+
+    # Faster than the MutableMapping implementations, which go through
+    # __getitem__ and catch the KeyError.
+
+    def __contains__(self, name):
+        return _normalized_headers[name] in self._as_list
+
+    def get(self, name, default=None):
+        norm_name = _normalized_headers[name]
+        values = self._as_list.get(norm_name)
+        if values is None:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return self._join(norm_name, values)
 
     def copy(self):
         # defined in dict but not in MutableMapping.
@@ -226,6 +300,8 @@ def format_timestamp(ts):
 ResponseStartLine = collections.namedtuple(
     'ResponseStartLine', ['version', 'code', 'reason'])
 
+_RESPONSE_START_LINE_RE = re.compile("(HTTP/1.[0-9]) ([0-9]+) ([^\r]*)")
+
 def parse_response_start_line(line):
     """Returns a (version, code, reason) tuple for an HTTP 1.x response line.
     The response is a `collections.namedtuple`.
@@ -233,9 +309,92 @@ def parse_response_start_line(line):
     ResponseStartLine(version='HTTP/1.1', code=200, reason='OK')
     """
     line = native_str(line)
-    match = re.match("(HTTP/1.[0-9]) ([0-9]+) ([^\r]*)", line)
+    match = _RESPONSE_START_LINE_RE.match(line)
     if not match:
         raise HTTPInputException("Error parsing response start line")
     return ResponseStartLine(match.group(1), int(match.group(2)),
                              match.group(3))
 
+
+def _last_start_line(lines):
+    # 跟随重定向（以及 100 Continue ）时， curl 会传递每一个响应的头部，
+    # 只有最后一个状态行之后的头部属于最终的响应
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i][:5] == b"HTTP/":
+            return i
+    return 0
+
+def parse_raw_headers(lines):
+    """Returns an `HTTPHeaders` from the raw header lines of a transfer,
+    as passed by curl to its header function (bytes, including the
+    end-of-line characters).  Only the headers of the last response are
+    kept, and its reason phrase is stored as ``X-Http-Reason``.
+    Malformed lines are ignored.
+    >>> h = parse_raw_headers([b"HTTP/1.1 302 Found\\r\\n", b"Location: /a\\r\\n",
+    ...                        b"\\r\\n", b"HTTP/1.1 200 OK\\r\\n",
+    ...                        b"Content-Length: 5\\r\\n", b"\\r\\n"])
+    >>> sorted(h.items())
+    [('Content-Length', '5'), ('X-Http-Reason', 'OK')]
+    """
+    headers = HTTPHeaders()
+    start = _last_start_line(lines)
+    if lines and lines[start][:5] == b"HTTP/":
+        try:
+            (__, __, reason) = parse_response_start_line(
+                lines[start].decode('latin1').rstrip())
+            headers.add("X-Http-Reason", reason)
+        except HTTPInputException:
+            pass
+        start = start + 1
+    add = headers.add
+    for i in range(start, len(lines)):
+        # whitespace at the start should be preserved to allow multi-line headers
+        line = lines[i].decode('latin1').rstrip()
+        if not PY3:
+            line = native_str(line)
+        if not line:
+            continue
+        if line[0].isspace():
+            try:
+                headers.parse_line(line)
+            except HTTPInputException:
+                pass
+            continue
+        name, colon, value = line.partition(":")
+        if colon:
+            add(name, value.strip())
+    return headers
+
+def parse_raw_reason(lines):
+    """Returns the reason phrase of the last response in the raw header
+    lines, or None.  Cheaper than `parse_raw_headers`.
+    >>> parse_raw_reason([b"HTTP/1.1 404 Not Found\\r\\n", b"\\r\\n"])
+    'Not Found'
+    """
+    if not lines:
+        return None
+    line = lines[_last_start_line(lines)]
+    if line[:5] != b"HTTP/":
+        return None
+    try:
+        return parse_response_start_line(
+            line.decode('latin1').rstrip()).reason
+    except HTTPInputException:
+        return None
+
+def parse_raw_content_length(lines):
+    """Returns the ``Content-Length`` of the last response in the raw
+    header lines, or None.
+    >>> parse_raw_content_length([b"HTTP/1.1 200 OK\\r\\n", b"content-length: 42\\r\\n"])
+    42
+    """
+    for i in range(len(lines) - 1, -1, -1):
+        line = lines[i]
+        if line[:5] == b"HTTP/":
+            break
+        if line[:15].lower() == b"content-length:":
+            try:
+                return int(line[15:])
+            except ValueError:
+                return None
+    return None
@@ -5,13 +5,17 @@ import threading
 import time
 import logging
 
-from concurrent.futures import Future
+from concurrent.futures import Future, wait
 
 from .exceptions import *
 from .status import Status
 from .event_loop import EventLoop
 from .waker import Waker
 from .curl_async_http_client import CurlAsyncHTTPClient
+from .buffer_pool import BufferPool
+from .stream import ResponseStream
+from .httpclient import METRICS
+from .tracing import monotonic
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,7 +23,8 @@ LOGGER = logging.getLogger(__name__)
 class AbstractManager(object):
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, max_queue_size, worker_count):
+    def __init__(self, max_queue_size, worker_count, cache=None,
+                 coalescer=None, tracer=None):
         self._max_queue_size = max_queue_size
         self._worker_count = worker_count
         self._queue_lock = threading.Lock()
@@ -31,6 +36,14 @@ class AbstractManager(object):
         self._contexts = {}   # Map: worker id -> context
         self._tid_to_wid = {} # Map: thread id -> worker id
         self._quited_worker_count = 0
+        # HTTPCache ，新鲜的响应不进入队列
+        self._cache = cache
+        # RequestCoalescer ，相同的请求只进行一次传输
+        self._coalescer = coalescer
+        # tracing.Tracer ，为被采样的请求调用生命周期的钩子
+        self._tracer = tracer
+        # start_stats_reporter 启动的线程的停止事件
+        self._stats_reporter = None
 
     def start(self):
         if not self._status.ensure_start_once(
@@ -85,6 +98,8 @@ class AbstractManager(object):
         if not self._status.transfer_to_stopping():
             raise RuntimeError("fail to stop Manager")
 
+        self.stop_stats_reporter()
+
         while self._workers:
             worker_id, thread = self._workers.popitem()
             with self._context_lock:
@@ -94,8 +109,8 @@ class AbstractManager(object):
             waker.wake()
             waker.close()
             thread.join(timeout)
-            thread_name = thread.getName()
-            if thread.isAlive():
+            thread_name = thread.name
+            if thread.is_alive():
                 LOGGER.error(
                     "%s is still running",
                     thread_name)
@@ -162,6 +177,24 @@ class AbstractManager(object):
         self.worker_main(worker_id, waker)
 
     def fetch(self, request):
+        if self._tracer is not None:
+            request.trace = self._tracer.start_trace(request)
+        if self._cache is not None:
+            future = self._cache.fetch(request, self._coalesced_fetch)
+        else:
+            future = self._coalesced_fetch(request)
+        trace = request.trace
+        if trace is not None:
+            future.add_done_callback(
+                lambda f: trace.on_complete(monotonic(), f))
+        return future
+
+    def _coalesced_fetch(self, request):
+        if self._coalescer is not None:
+            return self._coalescer.fetch(request, self._fetch)
+        return self._fetch(request)
+
+    def _fetch(self, request):
         f = Future()
         with self._status.expect(self._status.STARTED) as ret:
             if not ret:
@@ -174,6 +207,8 @@ class AbstractManager(object):
                         QueueFullException(
                             "queue is full"))
                 else:
+                    if request.trace is not None:
+                        request.trace.on_enqueue(monotonic())
                     self._queued_requests.append((
                         request,
                         f, 
@@ -181,6 +216,17 @@ class AbstractManager(object):
         self._wake_up_workers()
         return f
 
+    def fetch_stream(self, request, max_buffer_size=1024 * 1024):
+        """Submits the request and returns a `ResponseStream` that
+        iterates over the body chunks as they arrive.  The request's
+        ``streaming_callback`` is replaced by the stream.
+        """
+        stream = ResponseStream(max_buffer_size)
+        request.streaming_callback = stream
+        stream.future = self.fetch(request)
+        stream.future.add_done_callback(stream._finish)
+        return stream
+
     def _wake_up_workers(self):
         for waker in self._wakers.values():
             waker.wake()
@@ -191,15 +237,140 @@ class AbstractManager(object):
                 return self._queued_requests.pop(0)
             return None
 
+    def start_stats_reporter(self, interval, callback=None):
+        """Calls ``callback(self.stats())`` every ``interval`` seconds on a
+        daemon thread until the manager is stopped; by default the stats
+        are logged.
+        """
+        if callback is None:
+            callback = lambda stats: LOGGER.info("manager stats: %r", stats)
+        self.stop_stats_reporter()
+        stopped = threading.Event()
+        self._stats_reporter = stopped
+
+        def report():
+            while not stopped.wait(interval):
+                try:
+                    callback(self.stats())
+                except Exception:
+                    LOGGER.error("fail to report stats", exc_info=True)
+
+        thread = threading.Thread(target=report)
+        thread.setName("stats-reporter")
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop_stats_reporter(self):
+        if self._stats_reporter is not None:
+            self._stats_reporter.set()
+            self._stats_reporter = None
+
+
+# 这些关键字参数会被传递给每个 worker 线程的 CurlAsyncHTTPClient
+_CLIENT_OPTIONS = (
+    "force_scan",
+    "force_scan_interval",
+    "force_scan_threshold",
+    "min_clients",
+    "idle_handle_timeout",
+    "buffer_pool",
+    "spill_threshold",
+    "collect_metrics",
+    "accept_encoding",
+    "retry_policy",
+    "hedge_policy",
+    "circuit_breaker",
+    "resolver",
+    "metrics",
+)
+
+
+def _collect_stats(client, f):
+    try:
+        f.set_result(client.get_stats())
+    except Exception as e:
+        f.set_exception(e)
+
 
 class CurlAsyncHTTPClientManager(AbstractManager):
     def __init__(self, max_clients=10, *args, **kwargs):
+        self._client_options = dict(
+            (name, kwargs.pop(name)) for name in _CLIENT_OPTIONS
+            if name in kwargs)
+        # 所有 worker 线程共享同一个响应体缓冲池
+        self._client_options.setdefault("buffer_pool", BufferPool())
+        collect_metrics = self._client_options.get("collect_metrics")
+        if collect_metrics is not None:
+            unknown = set(collect_metrics).difference(METRICS)
+            if unknown:
+                raise ValueError(
+                    "unknown metrics: %s" % ", ".join(sorted(unknown)))
         AbstractManager.__init__(self, *args, **kwargs)
         self._max_clients = max_clients
 
     def make_waker(self):
         return Waker()
 
+    def get_encoding_stats(self):
+        """Returns the content encoding counters (see
+        `CurlAsyncHTTPClient.get_encoding_stats`) summed over all
+        worker threads.
+        """
+        total = {}
+        with self._context_lock:
+            clients = [context.get("client")
+                       for context in self._contexts.values()]
+        for client in clients:
+            if client is None:
+                continue
+            for key, value in client.get_encoding_stats().items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def stats(self, timeout=1.0):
+        """Returns a snapshot of the scheduler: ``queue_depth`` (requests
+        waiting in the manager's queue), ``max_queue_size``,
+        ``worker_count``, ``workers`` (a dict of worker id to
+        `CurlAsyncHTTPClient.get_stats`) and ``total`` (the sum of the
+        workers' stats).
+
+        The stats of a worker are collected on its event loop, so each of
+        them is consistent; a worker that does not answer within
+        ``timeout`` seconds is reported as None.  Must not be called on a
+        worker thread.
+        """
+        with self._queue_lock:
+            queue_depth = len(self._queued_requests)
+        with self._context_lock:
+            contexts = list(self._contexts.items())
+        futures = {}
+        for worker_id, context in contexts:
+            client = context.get("client")
+            if client is None:
+                continue
+            f = Future()
+            if context["event_loop"].add_callback(
+                    _collect_stats, client, f):
+                futures[worker_id] = f
+        wait(futures.values(), timeout)
+        workers = {}
+        total = {}
+        for worker_id, _ in contexts:
+            f = futures.get(worker_id)
+            stats = None
+            if f is not None and f.done() and f.exception() is None:
+                stats = f.result()
+            workers[worker_id] = stats
+            for key, value in (stats or {}).items():
+                total[key] = total.get(key, 0) + value
+        return {
+            "queue_depth": queue_depth,
+            "max_queue_size": self._max_queue_size,
+            "worker_count": self._worker_count,
+            "workers": workers,
+            "total": total,
+        }
+
     def initialize_context(self, worker_id):
         context = {}
         context["event_loop"] = EventLoop()
@@ -216,7 +387,9 @@ class CurlAsyncHTTPClientManager(AbstractManager):
                         self._max_clients,
                         event_loop,
                         waker,
-                        self.get_request)
+                        self.get_request,
+                        **self._client_options)
+        context["client"] = client
         event_loop.add_handler(
                         waker.fileno(),
                         client.wake_up,
@@ -0,0 +1,183 @@
+# coding: utf8
+
+# 汇总每个完成的响应的各阶段耗时：固定分桶的直方图和计数器，按源站、
+# 状态码类别和 worker 线程区分，以 Prometheus 的文本格式导出。
+# 每个时间序列只会被所属的 worker 线程更新，因此更新时不需要加锁，
+# 只有创建新的时间序列时才需要加锁
+
+import bisect
+import threading
+
+from .exceptions import CurlException
+from .httpclient import TimeInfo
+
+# 秒
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# TimeInfo 中的阶段，除 queue 以外都是从传输开始时计算的累计时间
+DEFAULT_PHASES = ("queue", "namelookup", "connect", "appconnect",
+                  "starttransfer", "total")
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return ",".join('%s="%s"' % (name, _escape(value))
+                    for name, value in labels)
+
+
+def get_status_class(response):
+    """Returns "2xx" ... "5xx", or "error" for curl errors."""
+    if isinstance(response.error, CurlException):
+        return "error"
+    return "%dxx" % (response.code // 100)
+
+
+class _Histogram(object):
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class ResponseMetrics(object):
+    """Aggregates the ``phases`` of `HTTPResponse.time_info` into
+    histograms with the upper bounds ``buckets``, and counts the
+    responses, labelled by ``host``, ``status_class`` and ``worker``.
+
+    At most ``max_hosts`` hosts get their own label, the other ones are
+    labelled ``"other"``.  Pass it as the ``metrics`` option of the
+    manager; `export` returns the Prometheus text format.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, phases=DEFAULT_PHASES,
+                 max_hosts=100, prefix="concurrent_http_client"):
+        self.buckets = tuple(sorted(buckets))
+        self.phases = tuple(phases)
+        # 阶段在 TimeInfo 中的位置，避免按名称查找
+        self._indexes = tuple(TimeInfo._fields.index(phase)
+                              for phase in self.phases)
+        self.max_hosts = max_hosts
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._hosts = set()
+        # Map: (host, status_class, worker) -> (response count, histograms)
+        self._series = {}
+
+    def _get_host(self, url):
+        parts = url.split("/", 3)
+        host = parts[2].rpartition("@")[2].lower() if len(parts) > 2 else ""
+        if host in self._hosts:
+            return host
+        with self._lock:
+            if len(self._hosts) >= self.max_hosts:
+                return "other"
+            self._hosts.add(host)
+        return host
+
+    def observe(self, response, worker):
+        """Records a completed response; called by the worker thread
+        ``worker``.
+        """
+        key = (self._get_host(response.request.url),
+               get_status_class(response), worker)
+        series = self._series.get(key)
+        if series is None:
+            series = [0, [_Histogram(len(self.buckets) + 1)
+                          for _ in self.phases]]
+            with self._lock:
+                series = self._series.setdefault(key, series)
+        series[0] += 1
+        time_info = response.time_info
+        if not isinstance(time_info, TimeInfo):
+            return
+        # TimeInfo 的 __getitem__ 支持按名称访问，比较慢，先转为 tuple
+        values = tuple(time_info)
+        buckets = self.buckets
+        for index, histogram in zip(self._indexes, series[1]):
+            value = values[index]
+            if value is None:
+                continue
+            histogram.counts[bisect.bisect_left(buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def export(self):
+        """Returns the metrics in the Prometheus text exposition
+        format.
+        """
+        with self._lock:
+            series = sorted(self._series.items())
+        prefix = self.prefix
+        lines = [
+            "# HELP %s_responses_total Completed responses." % prefix,
+            "# TYPE %s_responses_total counter" % prefix,
+        ]
+        for (host, status_class, worker), (count, _) in series:
+            labels = _format_labels((("host", host),
+                                     ("status_class", status_class),
+                                     ("worker", worker)))
+            lines.append("%s_responses_total{%s} %d" % (
+                prefix, labels, count))
+        name = "%s_phase_seconds" % prefix
+        lines.append("# HELP %s Time of the transfer phases, from the start "
+                     "of the transfer (queue: time in the queue)." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for (host, status_class, worker), (_, histograms) in series:
+            for phase, histogram in zip(self.phases, histograms):
+                if not histogram.count:
+                    continue
+                labels = _format_labels((("phase", phase), ("host", host),
+                                         ("status_class", status_class),
+                                         ("worker", worker)))
+                # worker 线程不加锁地更新直方图，所有的桶都从同一份
+                # 快照计算，保证 +Inf 和 _count 不小于其他的桶
+                counts = list(histogram.counts)
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        name, labels, repr(float(bound)), cumulative))
+                cumulative += counts[-1]
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+                    name, labels, cumulative))
+                lines.append("%s_sum{%s} %r" % (name, labels,
+                                                histogram.sum))
+                lines.append("%s_count{%s} %d" % (name, labels,
+                                                  cumulative))
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, address=""):
+    """Serves ``metrics.export()`` over HTTP on a daemon thread; returns
+    the server.
+    """
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.export().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setName("metrics-server")
+    thread.setDaemon(True)
+    thread.start()
+    return server
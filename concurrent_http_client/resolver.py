@@ -0,0 +1,232 @@
+# coding: utf8
+
+# 在 worker 线程之外解析域名：解析结果被所有 worker 共享，在过期之前
+# 就在后台刷新，通过 CURLOPT_RESOLVE 传递给 curl ，因此 curl 不再自己解析，
+# 即使 libcurl 使用阻塞的解析器，也不会阻塞 worker 线程的事件循环
+
+import collections
+import socket
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def system_resolver(host, port):
+    """Resolves ``host`` with ``getaddrinfo``; returns the addresses."""
+    addresses = []
+    for info in socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                   socket.SOCK_STREAM):
+        address = info[4][0]
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+class StubResolver(object):
+    """A resolver answering from ``hosts`` (a dict of host names to
+    lists of addresses), after ``delay`` seconds.  Unknown hosts fail
+    with ``socket.gaierror``.  Meant for tests.
+    """
+    def __init__(self, hosts, delay=0.0):
+        self.hosts = hosts
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, host, port):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if host not in self.hosts:
+            raise socket.gaierror(socket.EAI_NONAME, "unknown host")
+        return list(self.hosts[host])
+
+
+def _is_ip_address(host):
+    if ":" in host:
+        return True
+    try:
+        socket.inet_aton(host)
+    except (socket.error, ValueError):
+        return False
+    # inet_aton 也接受 "1" 这样的地址
+    return host.count(".") == 3
+
+
+def get_host_port(url):
+    """Returns the ``(host, port)`` a request to ``url`` connects to, or
+    None if the host is an IP address.
+
+    >>> get_host_port("https://user@Example.com/a")
+    ('example.com', 443)
+    >>> get_host_port("http://example.com:8080")
+    ('example.com', 8080)
+    >>> get_host_port("http://127.0.0.1/") is None
+    True
+    """
+    scheme, _, rest = url.partition("://")
+    netloc = rest.split("/", 1)[0].split("?", 1)[0].rpartition("@")[2]
+    if netloc.startswith("["):
+        return None
+    host, sep, port = netloc.partition(":")
+    if not host or _is_ip_address(host):
+        return None
+    if sep and port:
+        try:
+            port = int(port)
+        except ValueError:
+            return None
+    else:
+        port = _DEFAULT_PORTS.get(scheme.lower())
+        if port is None:
+            return None
+    return host.lower(), port
+
+
+def format_resolve(host, port, addresses):
+    """Returns the ``CURLOPT_RESOLVE`` entry for ``addresses``.
+
+    >>> format_resolve("example.com", 80, ["10.0.0.1", "::1"])
+    'example.com:80:10.0.0.1,[::1]'
+    """
+    return "%s:%d:%s" % (host, port, ",".join(
+        "[%s]" % address if ":" in address else address
+        for address in addresses))
+
+
+class _Resolution(object):
+    __slots__ = ("addresses", "expires_at", "refresh_at", "resolving")
+
+    def __init__(self, addresses, expires_at, refresh_at):
+        self.addresses = addresses
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at
+        self.resolving = False
+
+
+class ResolverCache(object):
+    """Resolves host names on ``max_workers`` background threads and
+    caches the addresses for ``ttl`` seconds (``negative_ttl`` for
+    failures).  An entry used after ``refresh_ahead`` of its ``ttl`` is
+    refreshed in the background while it keeps being used.
+
+    ``resolver`` is called as ``resolver(host, port)`` and returns a
+    list of addresses (`system_resolver` by default, `StubResolver` in
+    tests).  At most ``max_entries`` host names are kept.  It is
+    thread-safe and meant to be shared by all the workers of a manager.
+    """
+    def __init__(self, resolver=None, ttl=60.0, negative_ttl=5.0,
+                 refresh_ahead=0.75, max_workers=2, max_entries=10000):
+        self.resolver = resolver or system_resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        # Map: (host, port) -> callbacks waiting for the first resolution
+        self._waiters = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "refreshes": 0,
+            "resolutions": 0,
+            "failures": 0,
+        }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def lookup(self, host, port):
+        """Returns the cached addresses of ``host`` (an empty list if it
+        could not be resolved), or None if they are not known.  Never
+        blocks on resolution.
+        """
+        key = (host, port)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry.expires_at:
+                self._stats["expired" if entry else "misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            if now < entry.refresh_at or entry.resolving:
+                return entry.addresses
+            entry.resolving = True
+            self._stats["refreshes"] += 1
+        self._executor.submit(self._resolve, host, port)
+        return entry.addresses
+
+    def resolve_async(self, host, port, callback):
+        """Resolves ``host`` in the background and calls
+        ``callback(addresses)`` on a resolver thread.
+        """
+        key = (host, port)
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.append(callback)
+                return
+            self._waiters[key] = [callback]
+        self._executor.submit(self._resolve, host, port)
+
+    def _resolve(self, host, port):
+        start_time = time.time()
+        try:
+            addresses = self.resolver(host, port)
+        except Exception:
+            addresses = []
+        now = time.time()
+        latency = now - start_time
+        key = (host, port)
+        with self._lock:
+            self._stats["resolutions"] += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            entry = self._entries.pop(key, None)
+            if addresses:
+                entry = _Resolution(addresses, now + self.ttl,
+                                    now + self.ttl * self.refresh_ahead)
+            elif entry is not None and entry.addresses and \
+                    now < entry.expires_at:
+                # 刷新失败时继续使用之前的结果，直到过期
+                self._stats["failures"] += 1
+                entry.resolving = False
+                entry.refresh_at = min(entry.expires_at,
+                                       now + self.negative_ttl)
+                addresses = entry.addresses
+            else:
+                self._stats["failures"] += 1
+                entry = _Resolution(addresses, now + self.negative_ttl,
+                                    now + self.negative_ttl)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            waiters = self._waiters.pop(key, ())
+        for callback in waiters:
+            callback(addresses)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        """Returns the counters ``hits``, ``misses``, ``expired`` (used
+        after expiry), ``refreshes`` (started ahead of expiry),
+        ``resolutions`` and ``failures``, the ``hit_rate``, the average
+        and maximum resolution latency in seconds, and the number of
+        cached ``entries``.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            resolutions = stats["resolutions"]
+            stats["latency_avg"] = self._latency_total / resolutions \
+                if resolutions else None
+            stats["latency_max"] = self._latency_max
+            lookups = stats["hits"] + stats["misses"] + stats["expired"]
+            stats["hit_rate"] = float(stats["hits"]) / lookups \
+                if lookups else None
+            stats["entries"] = len(self._entries)
+        return stats
@@ -0,0 +1,193 @@
+# coding: utf8
+
+# 在 worker 线程中重试失败的请求：退避期间不占用 curl 句柄，重试的请求
+# 优先于队列中的新请求，并且不会超过第一次尝试时的截止时间。
+# 重试预算限制重试请求占全部请求的比例，以免下游故障时重试请求雪崩
+
+import calendar
+import email.utils
+import random
+import threading
+import time
+
+import pycurl
+
+from .exceptions import CurlException, HTTPException
+
+# 连接失败、超时以及连接被对方中断等，通常是暂时性的错误
+DEFAULT_RETRY_ERRNOS = frozenset([
+    pycurl.E_COULDNT_CONNECT,
+    pycurl.E_OPERATION_TIMEDOUT,
+    pycurl.E_PARTIAL_FILE,
+    pycurl.E_GOT_NOTHING,
+    pycurl.E_SEND_ERROR,
+    pycurl.E_RECV_ERROR,
+])
+
+DEFAULT_RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+# 幂等的方法，重复发送不会产生额外的副作用
+DEFAULT_RETRY_METHODS = frozenset(
+    ["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"])
+
+
+class RetryBudget(object):
+    """A token bucket that limits retries to a fraction of the traffic.
+
+    Every first attempt deposits ``ratio`` tokens and every retry
+    withdraws one, so that retries stay below ``ratio`` of the
+    requests.  ``min_per_second`` tokens are added per second so that
+    low traffic can still be retried, and at most ``max_balance``
+    tokens are kept.  It is thread-safe and meant to be shared by all
+    the workers of a manager.
+
+    >>> budget = RetryBudget(ratio=0.5, min_per_second=0)
+    >>> budget.deposit(); budget.deposit()
+    >>> budget.withdraw(), budget.withdraw()
+    (True, False)
+    """
+    def __init__(self, ratio=0.1, min_per_second=10, max_balance=100):
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._max_balance = max_balance
+        self._lock = threading.Lock()
+        # 开始时允许一秒的最低重试量
+        self._balance = float(min(min_per_second, max_balance))
+        self._last_refill_time = time.time()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self._ratio,
+                                self._max_balance)
+
+    def withdraw(self):
+        """Takes one token for a retry; returns False if the budget is
+        exhausted.
+        """
+        with self._lock:
+            now = time.time()
+            if self._min_per_second:
+                self._balance = min(
+                    self._balance + (now - self._last_refill_time) *
+                    self._min_per_second,
+                    self._max_balance)
+            self._last_refill_time = now
+            if self._balance < 1:
+                return False
+            self._balance = self._balance - 1
+            return True
+
+
+class RetryPolicy(object):
+    """Decides whether and when a failed request is retried.
+
+    A response is retried if its request uses one of ``methods``, it
+    failed with a curl error in ``errnos`` or an HTTP status in
+    ``statuses``, fewer than ``max_retries`` retries were made, and the
+    ``budget`` (a `RetryBudget`, or None for no limit) allows it.
+
+    The n-th retry waits ``backoff * 2 ** (n - 1)`` seconds, at most
+    ``max_backoff``, of which a random ``jitter`` fraction is removed.
+    A ``Retry-After`` header is honoured (as a lower bound of the
+    delay) unless it asks to wait longer than ``max_retry_after``, in
+    which case the request is not retried.
+
+    Requests whose body or response is streamed (``body_producer``,
+    ``streaming_callback``) are never retried.
+    """
+    def __init__(self, max_retries=3, errnos=DEFAULT_RETRY_ERRNOS,
+                 statuses=DEFAULT_RETRY_STATUSES,
+                 methods=DEFAULT_RETRY_METHODS, backoff=0.1,
+                 max_backoff=10.0, jitter=0.5, max_retry_after=60.0,
+                 budget=None):
+        self.max_retries = max_retries
+        self.errnos = frozenset(errnos)
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(methods)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "exhausted": 0, "budget_denied": 0}
+
+    def is_retryable(self, request, response):
+        if request.method not in self.methods or \
+                request.body_producer is not None or \
+                request.streaming_callback is not None:
+            return False
+        error = response.error
+        if error is None:
+            return False
+        if isinstance(error, CurlException):
+            return error.errno in self.errnos
+        if isinstance(error, HTTPException):
+            return error.code in self.statuses
+        return False
+
+    def get_delay(self, request, response, retries, max_delay=None):
+        """Returns the number of seconds to wait before retrying a
+        request that has already been retried ``retries`` times, or
+        None if it should not be retried.  ``max_delay`` is the time
+        left before the request's deadline.
+        """
+        if not self.is_retryable(request, response):
+            return None
+        if retries >= self.max_retries:
+            self._count("exhausted")
+            return None
+        delay = min(self.backoff * (2 ** retries), self.max_backoff)
+        delay = delay * (1 - self.jitter * random.random())
+        if response.code in (429, 503):
+            retry_after = parse_retry_after(
+                response.headers.get("Retry-After"))
+            if retry_after is not None:
+                if retry_after > self.max_retry_after:
+                    return None
+                delay = max(delay, retry_after)
+        if max_delay is not None and delay >= max_delay:
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            self._count("budget_denied")
+            return None
+        self._count("retries")
+        return delay
+
+    def on_first_attempt(self):
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_stats(self):
+        """Returns the counters ``retries`` (retries scheduled),
+        ``exhausted`` (retryable failures after ``max_retries``) and
+        ``budget_denied`` (retries refused by the budget).
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+def parse_retry_after(value, now=None):
+    """Returns the delay in seconds requested by a ``Retry-After``
+    header (delta-seconds or an HTTP-date), or None.
+
+    >>> parse_retry_after("120")
+    120.0
+    >>> parse_retry_after("Sun, 27 Jan 2013 18:43:20 GMT", now=1359312190)
+    10.0
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = email.utils.parsedate(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, float(calendar.timegm(parsed) - now))
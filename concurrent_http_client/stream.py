@@ -0,0 +1,251 @@
+# coding: utf8
+
+# 拉取式的响应体流：消费者通过迭代获取响应体数据块。当缓冲的数据超过
+# max_buffer_size 时，暂停 curl 的传输，直到消费者赶上来。
+# 请求体流与之相反：生产者写入数据块，没有数据可发送时暂停 curl 的传输
+
+import collections
+import threading
+
+import pycurl
+
+
+class ResponseStream(object):
+    """An iterator over the body chunks of a request submitted with
+    `AbstractManager.fetch_stream`.
+
+    It is used as the request's ``streaming_callback``.  The chunks are
+    kept in a buffer bounded by ``max_buffer_size``; when it is full the
+    transfer is paused with ``WRITEFUNC_PAUSE`` and resumed once the
+    consumer has drained half of it.  Note that libcurl's timeouts keep
+    running while a transfer is paused.
+
+    Both ``for chunk in stream`` (blocking) and ``async for chunk in
+    stream`` (asyncio) are supported.  The iteration ends when the
+    transfer completes, and raises the transfer error if it failed; the
+    `HTTPResponse` (with an empty body) is then available as
+    `response`.  `close` aborts the transfer.
+    """
+    def __init__(self, max_buffer_size=1024 * 1024):
+        self._max_buffer_size = max_buffer_size
+        self._condition = threading.Condition()
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._paused = False
+        self._closed = False
+        self._done = False
+        self._resume = None
+        self._waiter = None
+        self.future = None
+
+    def bind_transfer(self, resume):
+        """Called by the client with a thread-safe function that
+        resumes the paused transfer.
+        """
+        self._resume = resume
+
+    def __call__(self, chunk):
+        # 在 worker 线程中被调用
+        with self._condition:
+            if self._closed:
+                # 返回值与数据块的长度不同时， curl 会中止传输
+                return 0
+            if self._buffered and \
+                    self._buffered + len(chunk) > self._max_buffer_size:
+                # curl 会在恢复传输之后，重新传递该数据块
+                self._paused = True
+                return pycurl.WRITEFUNC_PAUSE
+            self._chunks.append(chunk)
+            self._buffered = self._buffered + len(chunk)
+            self._notify_locked()
+
+    def _finish(self, future):
+        with self._condition:
+            self._done = True
+            self._notify_locked()
+
+    def _notify_locked(self):
+        self._condition.notify()
+        if self._waiter is not None:
+            loop, waiter = self._waiter
+            self._waiter = None
+            loop.call_soon_threadsafe(self._resolve_waiter, loop, waiter)
+
+    def _next_locked(self):
+        """Returns ``(chunk, resume)``, or raises StopIteration or the
+        transfer error once the transfer is over and drained.  Returns
+        None if no chunk is available yet.
+        """
+        if self._chunks:
+            chunk = self._chunks.popleft()
+            self._buffered = self._buffered - len(chunk)
+            resume = None
+            if self._paused and \
+                    self._buffered <= self._max_buffer_size // 2:
+                self._paused = False
+                resume = self._resume
+            return chunk, resume
+        if not self._done:
+            return None
+        exc = self.future.exception()
+        if exc is None:
+            response = self.future.result()
+            if response.error and not response._error_is_response_code:
+                exc = response.error
+        if exc is not None:
+            raise exc
+        raise StopIteration()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._condition:
+            while True:
+                item = self._next_locked()
+                if item is not None:
+                    break
+                self._condition.wait()
+        chunk, resume = item
+        if resume is not None:
+            resume()
+        return chunk
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        self._resolve_waiter(loop, waiter)
+        return waiter
+
+    def _resolve_waiter(self, loop, waiter):
+        # 在 asyncio 的事件循环中被调用
+        if waiter.done():
+            return
+        resume = None
+        with self._condition:
+            try:
+                item = self._next_locked()
+            except StopIteration:
+                waiter.set_exception(StopAsyncIteration())
+                return
+            except Exception as e:
+                waiter.set_exception(e)
+                return
+            if item is None:
+                self._waiter = (loop, waiter)
+                return
+            chunk, resume = item
+        waiter.set_result(chunk)
+        if resume is not None:
+            resume()
+
+    @property
+    def response(self):
+        return self.future.result()
+
+    def close(self):
+        """Stops consuming the body; the transfer is aborted."""
+        with self._condition:
+            self._closed = True
+            self._chunks.clear()
+            self._buffered = 0
+            resume = self._resume if self._paused else None
+            self._paused = False
+        if resume is not None:
+            resume()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RequestBodyStream(object):
+    """A push-style request body, used as ``body_producer``.
+
+    Producer threads call `write` and then `finish`.  When curl wants
+    more data than has been written, the transfer is paused with
+    ``READFUNC_PAUSE`` and resumed by the next `write`.  `write` blocks
+    while more than ``max_buffer_size`` bytes are waiting to be sent.
+    The length of the body is unknown, so it is sent with chunked
+    transfer encoding unless the request sets ``body_size``.
+    """
+    def __init__(self, max_buffer_size=1024 * 1024):
+        self._max_buffer_size = max_buffer_size
+        self._condition = threading.Condition()
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._paused = False
+        self._finished = False
+        self._aborted = False
+        self._resume = None
+
+    def bind_transfer(self, resume):
+        self._resume = resume
+
+    def write(self, data):
+        data = memoryview(data)
+        with self._condition:
+            if self._finished or self._aborted:
+                raise ValueError("write to a finished RequestBodyStream")
+            while self._buffered >= self._max_buffer_size and \
+                    not self._aborted:
+                self._condition.wait()
+            if self._aborted:
+                raise ValueError("write to an aborted RequestBodyStream")
+            self._chunks.append(data)
+            self._buffered = self._buffered + len(data)
+            resume = self._take_resume_locked()
+        if resume is not None:
+            resume()
+
+    def finish(self):
+        with self._condition:
+            self._finished = True
+            resume = self._take_resume_locked()
+        if resume is not None:
+            resume()
+
+    def abort(self):
+        """Makes the transfer fail instead of sending the rest of the
+        body.
+        """
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+            resume = self._take_resume_locked()
+        if resume is not None:
+            resume()
+
+    def _take_resume_locked(self):
+        if not self._paused:
+            return None
+        self._paused = False
+        return self._resume
+
+    def read(self, size):
+        # 在 worker 线程中被调用
+        with self._condition:
+            if self._aborted:
+                return pycurl.READFUNC_ABORT
+            if not self._chunks:
+                if self._finished:
+                    return b""
+                self._paused = True
+                return pycurl.READFUNC_PAUSE
+            chunk = self._chunks[0]
+            if len(chunk) > size:
+                self._chunks[0] = chunk[size:]
+                chunk = chunk[:size]
+            else:
+                self._chunks.popleft()
+            self._buffered = self._buffered - len(chunk)
+            self._condition.notify_all()
+        return chunk.tobytes()
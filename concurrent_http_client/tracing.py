@@ -0,0 +1,214 @@
+# coding: utf8
+
+# 请求生命周期的跟踪钩子：fetch -> 入队 -> 出队 -> add_handle -> 响应头部 ->
+# 第一个字节 -> 传输结束 -> future 完成。只有被采样的请求才会创建 Trace ，
+# 未采样（或者没有 tracer ）时，每个阶段只有一次 None 判断的开销
+
+import random
+import time
+
+# 钩子的时间戳都来自单调时钟
+monotonic = getattr(time, "monotonic", time.time)
+
+
+class Trace(object):
+    """The lifecycle of one sampled request.  Subclasses override the
+    hooks they need; ``timestamp`` is a `monotonic` time in seconds.
+
+    A request that is retried goes through `on_dequeue` ... `on_finish`
+    once per attempt; ``attempt`` counts from 0.  The hedged transfer of
+    an attempt goes through `on_start` ... `on_finish` with ``hedge``
+    True, alongside the original transfer.
+    """
+    __slots__ = ("tracer", "request")
+
+    def __init__(self, tracer, request):
+        self.tracer = tracer
+        self.request = request
+
+    def on_enqueue(self, timestamp):
+        """The request is appended to the manager's queue."""
+
+    def on_dequeue(self, timestamp, attempt):
+        """A worker took the request from the queue."""
+
+    def on_start(self, timestamp, attempt, hedge=False):
+        """The transfer was added to the ``CurlMulti``."""
+
+    def on_headers(self, timestamp, attempt, hedge=False):
+        """The response headers were received."""
+
+    def on_first_byte(self, timestamp, attempt, hedge=False):
+        """The first byte of the response body was received."""
+
+    def on_finish(self, timestamp, attempt, response, hedge=False):
+        """The transfer is finished; it may still be retried.
+        ``response`` is None for a transfer of a hedged request that was
+        cancelled or discarded in favour of the other one.
+        """
+
+    def on_complete(self, timestamp, future):
+        """The future of the request is done."""
+
+
+class Tracer(object):
+    """Creates a ``trace_class`` for a ``sample_rate`` fraction of the
+    requests.  Pass it as the ``tracer`` option of the manager.
+    """
+    trace_class = Trace
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+
+    def start_trace(self, request):
+        """Returns the `Trace` of ``request``, or None if it is not
+        sampled.
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        return self.trace_class(self, request)
+
+
+class _SpanTrace(Trace):
+    # attempt_spans: hedge -> 正在进行的传输的 span
+    __slots__ = ("span", "attempt_spans")
+
+    def __init__(self, tracer, request):
+        Trace.__init__(self, tracer, request)
+        self.span = tracer.start_span(
+            "HTTP %s" % request.method, monotonic(), {
+                "http.method": request.method,
+                "http.url": request.url,
+            })
+        self.attempt_spans = {}
+
+    def on_enqueue(self, timestamp):
+        self.tracer.add_event(self.span, "enqueue", timestamp)
+
+    def on_dequeue(self, timestamp, attempt):
+        self.tracer.add_event(self.span, "dequeue", timestamp,
+                              {"attempt": attempt})
+
+    def on_start(self, timestamp, attempt, hedge=False):
+        self.attempt_spans[hedge] = self.tracer.start_span(
+            "HTTP %s attempt" % self.request.method, timestamp,
+            {"attempt": attempt, "hedge": hedge}, parent=self.span)
+
+    def on_headers(self, timestamp, attempt, hedge=False):
+        self.tracer.add_event(self.attempt_spans.get(hedge), "headers",
+                              timestamp)
+
+    def on_first_byte(self, timestamp, attempt, hedge=False):
+        self.tracer.add_event(self.attempt_spans.get(hedge), "first_byte",
+                              timestamp)
+
+    def on_finish(self, timestamp, attempt, response, hedge=False):
+        span = self.attempt_spans.pop(hedge, None)
+        if span is None:
+            return
+        if response is None:
+            self.tracer.end_span(span, timestamp, {"discarded": True}, None)
+        else:
+            self.tracer.end_span(span, timestamp,
+                                 _response_attributes(response),
+                                 response.error)
+
+    def on_complete(self, timestamp, future):
+        attributes = {}
+        error = None
+        if future.cancelled():
+            attributes["cancelled"] = True
+        elif future.exception() is not None:
+            error = future.exception()
+        else:
+            response = future.result()
+            attributes = _response_attributes(response)
+            error = response.error
+        self.tracer.end_span(self.span, timestamp, attributes, error)
+
+
+def _response_attributes(response):
+    attributes = {"http.status_code": response.code}
+    if response.primary_ip:
+        attributes["net.peer.ip"] = response.primary_ip
+    return attributes
+
+
+class OpenTelemetryTracer(Tracer):
+    """Emits an OpenTelemetry span per sampled request, with an event
+    per lifecycle step and a child span per transfer attempt.
+
+    ``tracer`` is an ``opentelemetry.trace.Tracer``; by default the one
+    of the global tracer provider.  Requires ``opentelemetry-api``.
+    """
+    trace_class = _SpanTrace
+
+    def __init__(self, sample_rate=1.0, tracer=None):
+        Tracer.__init__(self, sample_rate)
+        from opentelemetry import trace
+        self._trace_api = trace
+        if tracer is None:
+            tracer = trace.get_tracer(__name__)
+        self._tracer = tracer
+        # OpenTelemetry 的时间戳是自 epoch 以来的纳秒数
+        self._epoch_offset = time.time() - monotonic()
+
+    def _ns(self, timestamp):
+        return int((timestamp + self._epoch_offset) * 1e9)
+
+    def start_span(self, name, timestamp, attributes, parent=None):
+        context = None
+        if parent is not None:
+            context = self._trace_api.set_span_in_context(parent)
+        return self._tracer.start_span(
+            name, context=context, kind=self._trace_api.SpanKind.CLIENT,
+            attributes=attributes, start_time=self._ns(timestamp))
+
+    def add_event(self, span, name, timestamp, attributes=None):
+        if span is not None:
+            span.add_event(name, attributes or {}, self._ns(timestamp))
+
+    def end_span(self, span, timestamp, attributes, error):
+        for key, value in attributes.items():
+            span.set_attribute(key, value)
+        if error is not None:
+            span.set_status(self._trace_api.Status(
+                self._trace_api.StatusCode.ERROR, str(error)))
+        span.end(end_time=self._ns(timestamp))
+
+
+class _TransferHooks(object):
+    # 只有被采样的请求才会使用这些包装的 curl 回调
+    __slots__ = ("trace", "attempt", "hedge", "header_function",
+                 "write_function", "headers_received", "body_received")
+
+    def __init__(self, trace, attempt, hedge, header_function,
+                 write_function):
+        self.trace = trace
+        self.attempt = attempt
+        self.hedge = hedge
+        self.header_function = header_function
+        self.write_function = write_function
+        self.headers_received = False
+        self.body_received = False
+
+    def on_header(self, header_line):
+        if not self.headers_received and header_line in (b"\r\n", b"\n"):
+            self.headers_received = True
+            self.trace.on_headers(monotonic(), self.attempt, self.hedge)
+        return self.header_function(header_line)
+
+    def on_write(self, chunk):
+        if not self.body_received:
+            self.body_received = True
+            self.trace.on_first_byte(monotonic(), self.attempt, self.hedge)
+        return self.write_function(chunk)
+
+
+def trace_transfer(trace, attempt, hedge, header_function, write_function):
+    """Wraps the curl header and write functions of a transfer to call
+    `Trace.on_headers` and `Trace.on_first_byte`.
+    """
+    hooks = _TransferHooks(trace, attempt, hedge, header_function,
+                           write_function)
+    return hooks.on_header, hooks.on_write
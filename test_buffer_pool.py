@@ -0,0 +1,45 @@
+# coding: utf8
+
+from concurrent_http_client.buffer_pool import \
+    BufferPool, ResponseBuffer
+
+def test():
+    pool = BufferPool(max_bytes=1 << 20)
+
+    buffer = ResponseBuffer(pool)
+    buffer.reserve(10000)
+    for _ in range(100):
+        buffer.write(b"x" * 100)
+    # 写入的数据没有超过预先分配的大小，不需要重新分配
+    assert pool.get_stats()["acquired"] == 1
+    buffer.write(b"y" * 10000)
+    assert buffer.getvalue() == b"x" * 10000 + b"y" * 10000
+    assert buffer.getbuffer().tobytes() == buffer.getvalue()
+
+    buffer.release()
+    stats = pool.get_stats()
+    assert stats["released"] == 2
+    assert stats["pooled_bytes"] == 16384 + 32768
+
+    # 缓冲池中的缓冲区被复用
+    buffer = ResponseBuffer(pool)
+    buffer.write(b"z" * 20000)
+    assert pool.get_stats()["reused"] == 1
+    assert buffer.read(3) == b"zzz"
+    assert buffer.tell() == 3
+
+    # 服务器声明的大小不超过 max_size （请求的 max_body_length ）
+    large_pool = BufferPool(max_bytes=1 << 30)
+    buffer = ResponseBuffer(large_pool, size_hint=lambda: 1 << 30,
+                            max_size=100)
+    buffer.write(b"x" * 10)
+    buffer.release()
+    assert large_pool.get_stats()["pooled_bytes"] == 4096
+
+    # 超过 max_bytes 的缓冲区不会被缓存
+    big = pool.acquire(1 << 21)
+    pool.release(big)
+    assert pool.get_stats()["pooled_bytes"] < 1 << 20
+
+if __name__ == "__main__":
+    test()
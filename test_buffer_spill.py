@@ -0,0 +1,98 @@
+# coding: utf8
+
+import os
+import shutil
+import tempfile
+
+from concurrent_http_client.buffer_pool import \
+    BufferPool, ResponseBuffer
+from concurrent_http_client.httpclient import HTTPRequest, HTTPResponse
+
+def check_threshold():
+    pool = BufferPool()
+    buffer = ResponseBuffer(pool, spill_threshold=100)
+    buffer.write(b"x" * 60)
+    assert not buffer.spilled
+    # 超过阈值之后，已经写入的数据被移到临时文件中，缓冲区还给缓冲池
+    buffer.write(b"y" * 60)
+    assert buffer.spilled and buffer.length == 120
+    assert pool.get_stats()["released"] == 1
+    buffer.write(b"z" * 10)
+    assert buffer.getvalue() == b"x" * 60 + b"y" * 60 + b"z" * 10
+    buffer.seek(58)
+    assert buffer.read(4) == b"xxyy"
+    assert buffer.tell() == 62
+    buffer.release()
+    assert buffer.file is None
+
+def check_spill_path(tmp_dir):
+    path = os.path.join(tmp_dir, "body")
+    buffer = ResponseBuffer(BufferPool(), spill_threshold=10,
+                            spill_path=path)
+    buffer.write(b"a" * 8)
+    assert not os.path.exists(path)
+    buffer.write(b"b" * 8)
+    assert os.path.exists(path)
+
+    response = HTTPResponse(HTTPRequest("http://example.com/"), 200,
+                            buffer=buffer)
+    # 溢出的响应体通过 mmap 访问，不需要复制
+    view = response.body_view
+    assert view.readonly
+    assert view.tobytes() == b"a" * 8 + b"b" * 8
+    del view
+    body_file = response.body_file
+    assert body_file is buffer.file
+    assert body_file.read() == b"a" * 8 + b"b" * 8
+    response.release()
+    # 完整的响应体留在 spill_path 中
+    with open(path, "rb") as f:
+        assert f.read() == b"a" * 8 + b"b" * 8
+
+def check_discard(tmp_dir):
+    path = os.path.join(tmp_dir, "partial")
+    buffer = ResponseBuffer(BufferPool(), spill_threshold=10,
+                            spill_path=path)
+    buffer.write(b"a" * 20)
+    assert os.path.exists(path)
+    # 失败或者被取消的传输删除写了一半的文件
+    buffer.discard()
+    assert not os.path.exists(path)
+    assert buffer.closed
+
+    # 没有溢出时不会删除 spill_path 处已经存在的文件
+    with open(path, "wb") as f:
+        f.write(b"old")
+    buffer = ResponseBuffer(BufferPool(), spill_threshold=10,
+                            spill_path=path)
+    buffer.write(b"a" * 5)
+    buffer.discard()
+    assert os.path.exists(path)
+
+def check_max_size():
+    # Content-Length 超过阈值时，在第一次写入之前就溢出
+    buffer = ResponseBuffer(BufferPool(), spill_threshold=100,
+                            size_hint=lambda: 1 << 30)
+    buffer.write(b"x" * 10)
+    assert buffer.spilled
+    buffer.release()
+    # 服务器声明的大小不超过 max_size ，较小的响应体留在内存中
+    buffer = ResponseBuffer(BufferPool(), spill_threshold=100,
+                            size_hint=lambda: 1 << 30, max_size=50)
+    buffer.write(b"x" * 10)
+    assert not buffer.spilled
+    assert buffer.getvalue() == b"x" * 10
+    buffer.release()
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        check_threshold()
+        check_spill_path(tmp_dir)
+        check_discard(tmp_dir)
+        check_max_size()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,168 @@
+# coding: utf8
+
+from io import BytesIO
+
+from concurrent.futures import Future
+
+from concurrent_http_client.cache import HTTPCache
+from concurrent_http_client.httpclient import HTTPRequest, HTTPResponse, \
+    PreparedRequest
+from concurrent_http_client.httputil import HTTPHeaders
+
+URL = "http://example.com/a"
+
+class _Origin(object):
+    """Answers the requests sent by the cache with ``responses``."""
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        code, headers, body = self.responses.pop(0)
+        future = Future()
+        future.set_result(HTTPResponse(request, code,
+                                       headers=HTTPHeaders(headers),
+                                       buffer=BytesIO(body)))
+        return future
+
+def check_freshness():
+    cache = HTTPCache()
+    origin = _Origin()
+    origin.responses.append(
+        (200, {"Cache-Control": "max-age=60", "ETag": '"v1"'}, b"one"))
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == b"one"
+    # 新鲜的响应不发送请求
+    response = cache.fetch(HTTPRequest(URL), origin).result()
+    assert response.body == b"one" and len(origin.requests) == 1
+    # 请求的 no-cache 要求重新验证， 304 与缓存的响应合并
+    origin.responses.append((304, {"ETag": '"v1"', "X-New": "1"}, b""))
+    response = cache.fetch(
+        HTTPRequest(URL, headers={"Cache-Control": "no-cache"}),
+        origin).result()
+    assert origin.requests[-1].headers["If-None-Match"] == '"v1"'
+    assert response.code == 200 and response.body == b"one"
+    assert response.headers["X-New"] == "1"
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["revalidated"] == 1
+
+    # 过期的响应重新验证，返回新的响应时替换缓存的响应
+    origin.responses.append(
+        (200, {"Cache-Control": "max-age=0", "ETag": '"v2"'}, b"two"))
+    cache.fetch(HTTPRequest(URL, headers={"Cache-Control": "no-cache"}),
+                origin).result()
+    origin.responses.append((200, {"ETag": '"v3"'}, b"three"))
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == b"three"
+    assert origin.requests[-1].headers["If-None-Match"] == '"v2"'
+
+def check_vary():
+    cache = HTTPCache()
+    origin = _Origin()
+    for language in ("en", "fr"):
+        origin.responses.append(
+            (200, {"Cache-Control": "max-age=60",
+                   "Vary": "Accept-Language"}, language.encode()))
+        cache.fetch(HTTPRequest(URL, headers={"Accept-Language": language}),
+                    origin).result()
+    for language in ("en", "fr"):
+        response = cache.fetch(
+            HTTPRequest(URL, headers={"Accept-Language": language}),
+            origin).result()
+        assert response.body == language.encode()
+    assert len(origin.requests) == 2
+
+def check_credentials():
+    cache = HTTPCache()
+    origin = _Origin()
+    private = {"Cache-Control": "max-age=60"}
+    # 带凭据的请求的响应不能被其他调用者使用
+    for request in (HTTPRequest(URL, auth_username="u", auth_password="p"),
+                    HTTPRequest(URL, headers={"Authorization": "Basic x"})):
+        origin.responses.append((200, private, b"secret"))
+        cache.fetch(request, origin).result()
+    assert cache.get_stats()["entries"] == 0
+    origin.responses.append((200, private, b"anonymous"))
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == \
+        b"anonymous"
+
+    # Cookie 和客户端证书也是凭据
+    for request in (HTTPRequest(URL, headers={"Cookie": "session=x"}),
+                    HTTPRequest(URL, client_cert="/tmp/cert.pem")):
+        origin.responses.append((200, private, b"secret"))
+        cache.fetch(request, origin).result()
+    assert cache.get_stats()["entries"] == 1
+
+    # public 的响应可以共享
+    cache = HTTPCache()
+    origin.responses.append(
+        (200, {"Cache-Control": "public, max-age=60"}, b"shared"))
+    cache.fetch(HTTPRequest(URL, auth_username="u", auth_password="p"),
+                origin).result()
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == b"shared"
+
+def check_options():
+    cache = HTTPCache()
+    origin = _Origin()
+    fresh = {"Cache-Control": "max-age=60"}
+    # 未解码的响应体和没有跟随的重定向不能返回给默认的请求
+    origin.responses.append((200, dict(fresh, **{"Content-Encoding": "gzip"}),
+                             b"raw"))
+    cache.fetch(HTTPRequest(URL, decompress_response=False), origin).result()
+    origin.responses.append((301, dict(fresh, Location="/b"), b""))
+    cache.fetch(HTTPRequest(URL, follow_redirects=False), origin).result()
+    origin.responses.append((200, fresh, b"decoded"))
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == b"decoded"
+    for request in (HTTPRequest(URL, validate_cert=False),
+                    HTTPRequest(URL, max_body_length=10)):
+        origin.responses.append((200, fresh, b"other"))
+        cache.fetch(request, origin).result()
+    assert len(origin.requests) == 5
+    # 选项相同的请求使用各自的条目
+    assert cache.fetch(HTTPRequest(URL, decompress_response=False),
+                       origin).result().body == b"raw"
+    assert cache.fetch(HTTPRequest(URL, follow_redirects=False),
+                       origin).result().code == 301
+    assert cache.fetch(HTTPRequest(URL), origin).result().body == b"decoded"
+    assert len(origin.requests) == 5
+
+def check_release():
+    cache = HTTPCache()
+    pending = Future()
+    future = cache.fetch(HTTPRequest(URL), lambda request: pending)
+    pending.set_result(HTTPResponse(
+        HTTPRequest(URL), 200,
+        headers=HTTPHeaders({"Cache-Control": "max-age=60"}),
+        buffer=BytesIO(b"pooled")))
+    # 存储在 future 完成之前，调用者可以立即释放缓冲区
+    future.result().release()
+    response = cache.fetch(HTTPRequest(URL), None).result()
+    assert response.body == b"pooled"
+    # 取消的请求
+    pending = Future()
+    future = cache.fetch(HTTPRequest(URL + "?b"), lambda request: pending)
+    assert future.cancel() and pending.cancelled()
+
+def check_prepared_revalidation():
+    cache = HTTPCache()
+    origin = _Origin()
+    template = PreparedRequest(headers={"Accept": "text/html"})
+    origin.responses.append((200, {"ETag": '"v1"'}, b"one"))
+    cache.fetch(template.request(URL), origin).result()
+    origin.responses.append((304, {}, b""))
+    response = cache.fetch(template.request(URL), origin).result()
+    conditional = origin.requests[-1]
+    # 模板的请求头中没有条件头部，不能使用模板
+    assert conditional.prepared is None
+    assert conditional.headers["If-None-Match"] == '"v1"'
+    assert response.body == b"one"
+
+def test():
+    check_freshness()
+    check_vary()
+    check_credentials()
+    check_options()
+    check_release()
+    check_prepared_revalidation()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,85 @@
+# coding: utf8
+
+import time
+
+from concurrent_http_client.circuit_breaker import CircuitBreaker, \
+    CLOSED, OPEN, HALF_OPEN
+
+ORIGIN = "http://example.com"
+
+def _fail(breaker, origin=ORIGIN, count=1):
+    for _ in range(count):
+        breaker.record(origin, True, breaker.allow(origin))
+
+def check_states():
+    breaker = CircuitBreaker(failure_threshold=3, open_duration=0.05,
+                             half_open_probes=2)
+    # 正常的源站没有状态
+    breaker.record(ORIGIN, False, breaker.allow(ORIGIN))
+    assert breaker.get_stats() == {}
+    _fail(breaker, count=2)
+    assert breaker.get_state(ORIGIN) == CLOSED
+    late = breaker.allow(ORIGIN)
+    _fail(breaker)
+    assert breaker.get_state(ORIGIN) == OPEN
+    assert not breaker.allow(ORIGIN)
+    # 打开之前发出的请求的结果被忽略
+    breaker.record(ORIGIN, False, late)
+    assert breaker.get_state(ORIGIN) == OPEN
+
+    time.sleep(0.06)
+    first = breaker.allow(ORIGIN)
+    second = breaker.allow(ORIGIN)
+    assert first and second
+    assert breaker.get_state(ORIGIN) == HALF_OPEN
+    assert not breaker.allow(ORIGIN)
+    # 没有发出的探测请求可以让给其他请求
+    breaker.release(ORIGIN, second)
+    second = breaker.allow(ORIGIN)
+    assert second
+    # 探测请求失败时重新打开
+    breaker.record(ORIGIN, True, second)
+    assert breaker.get_state(ORIGIN) == OPEN
+
+    time.sleep(0.06)
+    probe = breaker.allow(ORIGIN)
+    # 上一次半开状态的探测请求的结果被忽略
+    breaker.record(ORIGIN, False, first)
+    breaker.record(ORIGIN, False, True)
+    assert breaker.get_state(ORIGIN) == HALF_OPEN
+    breaker.record(ORIGIN, False, probe)
+    assert breaker.get_state(ORIGIN) == CLOSED
+    assert breaker.get_stats() == {}
+
+def check_error_rate():
+    breaker = CircuitBreaker(failure_threshold=100, error_rate=0.5,
+                             window=4, min_requests=4)
+    for failed in (True, False, False, True):
+        breaker.record(ORIGIN, failed, breaker.allow(ORIGIN))
+    assert breaker.get_state(ORIGIN) == OPEN
+    assert breaker.get_stats()[ORIGIN]["opened"] == 1
+
+def check_origins():
+    breaker = CircuitBreaker(window=3, max_origins=2)
+    # 窗口中没有失败之后删除源站的状态
+    _fail(breaker)
+    for _ in range(2):
+        breaker.record(ORIGIN, False, breaker.allow(ORIGIN))
+    assert ORIGIN in breaker.get_stats()
+    breaker.record(ORIGIN, False, breaker.allow(ORIGIN))
+    assert breaker.get_stats() == {}
+    # 最多保存 max_origins 个源站，删除最早失败的
+    for i in range(3):
+        _fail(breaker, "http://%d.example.com" % i)
+    _fail(breaker, "http://1.example.com")
+    _fail(breaker, "http://3.example.com")
+    assert sorted(breaker.get_stats()) == [
+        "http://1.example.com", "http://3.example.com"]
+
+def test():
+    check_states()
+    check_error_rate()
+    check_origins()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,81 @@
+# coding: utf8
+
+from io import BytesIO
+
+from concurrent.futures import Future
+
+from concurrent_http_client.coalesce import RequestCoalescer
+from concurrent_http_client.httpclient import HTTPRequest, HTTPResponse
+
+URL = "http://example.com/a"
+
+def check_key():
+    coalescer = RequestCoalescer()
+    key = coalescer.get_key(HTTPRequest(URL))
+    assert coalescer.get_key(HTTPRequest(URL)) == key
+    # 超时等选项不影响响应，可以合并
+    assert coalescer.get_key(HTTPRequest(URL, request_timeout=5)) == key
+    # 凭据、代理、证书验证、用户代理、网络接口、解码、重定向、响应体大小限制和条件请求头部都会区分请求
+    for request in (
+            HTTPRequest(URL, auth_username="u", auth_password="p"),
+            HTTPRequest(URL, proxy_host="127.0.0.1", proxy_port=8080),
+            HTTPRequest(URL, decompress_response=False),
+            HTTPRequest(URL, accept_encoding=["br"]),
+            HTTPRequest(URL, follow_redirects=False),
+            HTTPRequest(URL, max_body_length=10),
+            HTTPRequest(URL, validate_cert=False),
+            HTTPRequest(URL, ca_certs="/tmp/ca.pem"),
+            HTTPRequest(URL, ssl_options={"certfile": "/tmp/c.pem"}),
+            HTTPRequest(URL, user_agent="bot"),
+            HTTPRequest(URL, network_interface="eth1"),
+            HTTPRequest(URL, allow_ipv6=False),
+            HTTPRequest(URL, headers={"If-None-Match": '"v1"'}),
+            HTTPRequest(URL, headers={"If-Modified-Since": "x"}),
+            HTTPRequest(URL, headers={"If-Range": '"v1"'}),
+            HTTPRequest(URL, headers={"Authorization": "Bearer x"})):
+        assert coalescer.get_key(request) != key
+    assert not coalescer.is_eligible(HTTPRequest(URL, method="POST", body=""))
+    assert not coalescer.is_eligible(
+        HTTPRequest(URL, prepare_curl_callback=lambda curl: None))
+
+def check_fan_out():
+    coalescer = RequestCoalescer()
+    inners = []
+
+    def fetch(request):
+        inners.append(Future())
+        return inners[-1]
+
+    requests = [HTTPRequest(URL) for _ in range(3)]
+    futures = [coalescer.fetch(request, fetch) for request in requests]
+    other = coalescer.fetch(
+        HTTPRequest(URL, auth_username="u", auth_password="p"), fetch)
+    # 带凭据的请求没有加入正在进行的传输
+    assert len(inners) == 2
+    assert coalescer.get_stats()["coalesced"] == 2
+
+    futures[1].cancel()
+    inner = inners[0]
+    inner.set_running_or_notify_cancel()
+    inner.set_result(HTTPResponse(requests[0], 200,
+                                  buffer=BytesIO(b"body")))
+    assert futures[1].cancelled()
+    for request, future in zip(requests[::2], futures[::2]):
+        response = future.result()
+        assert response.request is request
+        assert response.body == b"body"
+    assert not other.done()
+    assert coalescer.get_stats()["in_flight"] == 1
+
+    # 错误被所有等待的请求共享
+    futures = [coalescer.fetch(HTTPRequest(URL), fetch) for _ in range(2)]
+    inners[-1].set_exception(ValueError("boom"))
+    for future in futures:
+        assert isinstance(future.exception(), ValueError)
+
+def test():
+    check_key()
+    check_fan_out()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,91 @@
+# coding: utf8
+
+import os
+import shutil
+import tempfile
+import time
+
+from concurrent_http_client.disk_cache import DiskCacheStore
+
+def _meta(**kwargs):
+    meta = {"c": 200, "t": time.time()}
+    meta.update(kwargs)
+    return meta
+
+def check_put_get(directory):
+    store = DiskCacheStore(directory)
+    body = b"x" * 10000
+    store.put(("http://h/a", ("gzip",)), ("Accept-Encoding",),
+              _meta(n=1), body)
+    store.put(("http://h/b", ()), (), _meta(n=2), b"small")
+    store.flush()
+    assert store.get_vary("http://h/a") == ("Accept-Encoding",)
+    assert store.get_vary("http://h/c") is None
+    meta, loaded = store.get(("http://h/a", ("gzip",)))
+    assert meta["n"] == 1 and loaded == body
+    assert store.get(("http://h/a", ("br",))) is None
+    # 键的其他部分（请求选项）在读写之后不变
+    key = ("http://h/o", (None,), (False, ("br", "gzip"), True, 5))
+    store.put(key, ("Accept",), _meta(n=3), b"options")
+    store.flush()
+    assert store.get(key)[1] == b"options"
+    assert key in [recent[0] for recent in store.recent(1 << 20)]
+    # 大的响应体被压缩
+    assert store.get_stats()["bytes_written"] < len(body)
+
+    # 另一个实例（相当于另一个进程）看到同一个目录中的条目
+    other = DiskCacheStore(directory)
+    assert other.get(("http://h/b", ()))[1] == b"small"
+    other.delete_url("http://h/b")
+    other.flush()
+    assert store.get(("http://h/b", ())) is None
+    other.close()
+    store.close()
+
+def check_bad_index_lines(directory):
+    store = DiskCacheStore(directory)
+    store.put(("http://h/1", ()), (), _meta(), b"one")
+    store.flush()
+    # 进程在写入索引时崩溃，留下不完整的行
+    with open(os.path.join(directory, "index"), "ab") as f:
+        f.write(b'{"k":"[\\"http://h/broken')
+    store.put(("http://h/2", ()), (), _meta(), b"two")
+    store.delete_url("http://h/1")
+    store.flush()
+    # 不完整的行被跳过，之后的行（包括删除）都被应用
+    reader = DiskCacheStore(directory)
+    assert reader.get(("http://h/1", ())) is None
+    assert reader.get(("http://h/2", ()))[1] == b"two"
+    assert reader.get_stats()["bad_lines"] == 1
+    assert store.get(("http://h/2", ()))[1] == b"two"
+    reader.close()
+    store.close()
+
+def check_eviction(directory):
+    store = DiskCacheStore(directory, max_bytes=40000, segment_bytes=10000,
+                           min_compress_size=1 << 30)
+    for i in range(20):
+        store.put(("http://h/%d" % i, ()), (), _meta(), b"%d" % i * 3000)
+    store.flush()
+    stats = store.get_stats()
+    assert stats["evicted_segments"] > 0
+    assert stats["disk_bytes"] <= 40000 + 10000
+    assert store.get(("http://h/0", ())) is None
+    assert store.get(("http://h/19", ())) is not None
+    store.close()
+
+    expired = DiskCacheStore(directory, ttl=0.001)
+    time.sleep(0.01)
+    assert expired.get(("http://h/19", ())) is None
+    expired.close()
+
+def test():
+    for check in (check_put_get, check_bad_index_lines, check_eviction):
+        directory = tempfile.mkdtemp()
+        try:
+            check(directory)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test()
@@ -9,7 +9,23 @@ def timeout_callback(event_loop):
     print("timeout_callback")
     event_loop.add_callback(callback, event_loop)
 
+def check_stats():
+    event_loop = EventLoop()
+    try:
+        pending = [event_loop.call_later(60, lambda: None)
+                   for _ in range(3)]
+        event_loop.remove_timeout(pending[0])
+        assert event_loop.get_stats()["timeouts"] == 2
+        # 移除已经执行过的 timeout 不影响仍然有效的 timeout 的数目
+        fired = event_loop.call_later(0, lambda: None)
+        event_loop._schedule_timeouts()
+        event_loop.remove_timeout(fired)
+        assert event_loop.get_stats()["timeouts"] == 2
+    finally:
+        event_loop.close()
+
 def test():
+    check_stats()
     print("start testing")
     event_loop = EventLoop()
     event_loop.call_later(
@@ -0,0 +1,66 @@
+# coding: utf8
+
+import os
+import time
+import warnings
+
+from bench_server import BenchServerProcess
+from concurrent_http_client.manager import CurlAsyncHTTPClientManager
+from concurrent_http_client.httpclient import HTTPRequest
+
+def _open_sockets():
+    # 只支持 Linux ；服务器运行在子进程中，不计入
+    count = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            if os.readlink("/proc/self/fd/" + fd).startswith("socket:"):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+def _fetch_all(manager, url, count):
+    futures = [manager.fetch(HTTPRequest(url)) for _ in range(count)]
+    for f in futures:
+        assert f.result().code == 200
+
+def test(max_clients=8):
+    server = BenchServerProcess(latency=0.1).start()
+    baseline = _open_sockets()
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", RuntimeWarning)
+            manager = CurlAsyncHTTPClientManager(
+                max_clients=max_clients, max_queue_size=100,
+                worker_count=1, idle_handle_timeout=0.2,
+                force_scan=True, force_scan_interval=50)
+            manager.start()
+            try:
+                # 等待 worker 线程启动， waker 等也使用 socket
+                manager.stats()
+                started = _open_sockets()
+                _fetch_all(manager, server.url, max_clients)
+                connections = _open_sockets() - started
+                assert 0 < connections <= max_clients
+                # 空闲的句柄被关闭，连接留在连接池中
+                time.sleep(0.6)
+                total = manager.stats()["total"]
+                assert total["handles"] == 0
+                # 周期扫描的计数器也汇总到 total 中
+                assert total["force_scan_enabled"] == 1
+                assert total["force_scan_checks"] > 0
+                assert _open_sockets() - started <= connections
+                # 新的句柄复用连接池中的连接
+                _fetch_all(manager, server.url, max_clients)
+                assert _open_sockets() - started <= max_clients
+            finally:
+                manager.stop()
+        # 停止之后所有的连接都被关闭
+        assert _open_sockets() == baseline
+        assert not [w for w in caught
+                    if issubclass(w.category, RuntimeWarning)]
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    test()
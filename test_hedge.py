@@ -0,0 +1,177 @@
+# coding: utf8
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from concurrent_http_client.buffer_pool import BufferPool
+from concurrent_http_client.hedge import HedgePolicy
+from concurrent_http_client.httpclient import HTTPRequest
+from concurrent_http_client.manager import CurlAsyncHTTPClientManager
+from concurrent_http_client.tracing import Trace, Tracer
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+BODY_SIZE = 1000
+
+# 每个路径的第 n 次请求（原始的传输或者对冲的传输）的行为：
+# (延迟的秒数, 状态码, 在延迟之前发送的响应体字节数)
+BEHAVIOURS = {
+    # 原始的传输发送了一部分响应体之后停顿，对冲的传输胜出
+    "/stall": [(1.0, 200, 100), (0, 200, 0)],
+    # 对冲的传输立即失败，原始的传输完成请求
+    "/hedge-fails": [(0.3, 200, 0), (0, 503, 0)],
+    # 原始的传输先失败，对冲的传输完成请求
+    "/primary-fails": [(0.2, 500, 0), (0.3, 200, 0)],
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            attempt = server.attempts.get(self.path, 0)
+            server.attempts[self.path] = attempt + 1
+        path = self.path.split("?")[0]
+        behaviours = BEHAVIOURS.get(path, [(0.2, 200, 0)])
+        delay, status, head = behaviours[min(attempt, len(behaviours) - 1)]
+        body = (b"p" if attempt == 0 else b"h") * BODY_SIZE
+        try:
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:head])
+            self.wfile.flush()
+            time.sleep(delay)
+            self.wfile.write(body[head:])
+        except (IOError, OSError):
+            # 被取消的传输已经关闭了连接
+            self.close_connection = True
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class _RecordingTrace(Trace):
+    __slots__ = ("finished",)
+
+    def __init__(self, tracer, request):
+        Trace.__init__(self, tracer, request)
+        self.finished = []
+
+    def on_finish(self, timestamp, attempt, response, hedge=False):
+        self.finished.append(
+            (hedge, None if response is None else response.code))
+
+
+class _RecordingTracer(Tracer):
+    trace_class = _RecordingTrace
+
+
+def _fetch(manager, url, **kwargs):
+    request = HTTPRequest(url, **kwargs)
+    response = manager.fetch(request).result()
+    return request, response
+
+def check_winner(manager, pool, url):
+    policy = HedgePolicy(delay=0.1, max_ratio=1)
+    request, response = _fetch(manager, url + "/stall", hedge_policy=policy)
+    assert response.code == 200 and response.body == b"h" * BODY_SIZE
+    assert response.request_time < 0.8
+    stats = policy.get_stats()
+    assert stats["hedges"] == 1 and stats["wins"] == 1
+    assert stats["cancelled"] == 1
+    # 被取消的传输报告为没有响应，它的缓冲区还给了缓冲池
+    assert sorted(request.trace.finished) == [(False, None), (True, 200)]
+    response.release()
+    pool_stats = pool.get_stats()
+    assert pool_stats["acquired"] == pool_stats["released"]
+
+def check_dropped(manager, url):
+    # 对冲的传输失败时，原始的传输仍在进行，失败的传输被丢弃
+    policy = HedgePolicy(delay=0.05, max_ratio=1)
+    request, response = _fetch(
+        manager, url + "/hedge-fails", hedge_policy=policy)
+    assert response.code == 200 and response.body == b"p" * BODY_SIZE
+    stats = policy.get_stats()
+    assert stats["hedges"] == 1 and stats["wins"] == 0
+    assert stats["cancelled"] == 0
+    assert sorted(request.trace.finished) == [(False, 200), (True, None)]
+
+    # 原始的传输失败时，由对冲的传输完成请求
+    policy = HedgePolicy(delay=0.05, max_ratio=1)
+    request, response = _fetch(
+        manager, url + "/primary-fails", hedge_policy=policy)
+    assert response.code == 200 and response.body == b"h" * BODY_SIZE
+    stats = policy.get_stats()
+    assert stats["hedges"] == 1 and stats["wins"] == 1
+    assert sorted(request.trace.finished) == [(False, None), (True, 200)]
+
+def check_not_hedged(manager, url):
+    # 预算不允许对冲
+    policy = HedgePolicy(delay=0.05, max_ratio=0)
+    _, response = _fetch(manager, url + "/denied", hedge_policy=policy)
+    assert response.code == 200
+    stats = policy.get_stats()
+    assert stats["eligible"] == 1 and stats["budget_denied"] == 1
+    assert stats["hedges"] == 0
+
+    # 两个传输不能写入同一个文件
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "body")
+        policy = HedgePolicy(delay=0.05, max_ratio=1)
+        _, response = _fetch(manager, url + "/spill", hedge_policy=policy,
+                             spill_path=path, spill_threshold=10)
+        assert response.code == 200
+        assert policy.get_stats()["eligible"] == 0
+        assert policy.get_stats()["hedges"] == 0
+        response.release()
+        with open(path, "rb") as f:
+            assert f.read() == b"p" * BODY_SIZE
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test():
+    server = _Server()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    pool = BufferPool()
+    manager = CurlAsyncHTTPClientManager(
+        max_clients=4, max_queue_size=100, worker_count=1,
+        buffer_pool=pool, tracer=_RecordingTracer())
+    manager.start()
+    try:
+        check_winner(manager, pool, server.url)
+        check_dropped(manager, server.url)
+        check_not_hedged(manager, server.url)
+    finally:
+        manager.stop()
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,139 @@
+# coding: utf8
+
+import threading
+import time
+
+import pycurl
+
+from bench_server import BenchServerProcess
+from concurrent_http_client.manager import CurlAsyncHTTPClientManager
+from concurrent_http_client.httpclient import HTTPRequest
+from concurrent_http_client.resolver import ResolverCache, StubResolver
+
+def _resolve(cache, host, port=80):
+    # resolve_async 在解析线程中调用回调
+    done = threading.Event()
+    result = []
+
+    def callback(addresses):
+        result.append(addresses)
+        done.set()
+
+    cache.resolve_async(host, port, callback)
+    assert done.wait(5)
+    return result[0]
+
+def check_lookup():
+    stub = StubResolver({"a.test": ["10.0.0.1", "::1"]})
+    cache = ResolverCache(stub, ttl=60.0, negative_ttl=60.0)
+    try:
+        assert cache.lookup("a.test", 80) is None
+        assert _resolve(cache, "a.test") == ["10.0.0.1", "::1"]
+        assert cache.lookup("a.test", 80) == ["10.0.0.1", "::1"]
+        # 端口不同的是另一个条目
+        assert cache.lookup("a.test", 443) is None
+        # 解析失败时缓存空的结果
+        assert _resolve(cache, "unknown.test") == []
+        assert cache.lookup("unknown.test", 80) == []
+        stats = cache.get_stats()
+        assert stats["hits"] == 2 and stats["misses"] == 2
+        assert stats["resolutions"] == 2 and stats["failures"] == 1
+        assert stub.calls == 2
+    finally:
+        cache.close()
+
+def check_waiters():
+    # 同一个域名的多个请求只解析一次
+    stub = StubResolver({"a.test": ["10.0.0.1"]}, delay=0.1)
+    cache = ResolverCache(stub)
+    try:
+        lock = threading.Lock()
+        results = []
+        done = threading.Event()
+
+        def callback(addresses):
+            with lock:
+                results.append(addresses)
+                if len(results) == 3:
+                    done.set()
+
+        for _ in range(3):
+            cache.resolve_async("a.test", 80, callback)
+        assert done.wait(5)
+        assert results == [["10.0.0.1"]] * 3
+        assert stub.calls == 1
+    finally:
+        cache.close()
+
+def check_expiry():
+    stub = StubResolver({"a.test": ["10.0.0.1"]})
+    cache = ResolverCache(stub, ttl=0.2, refresh_ahead=0.5, max_entries=1)
+    try:
+        _resolve(cache, "a.test")
+        assert cache.lookup("a.test", 80) == ["10.0.0.1"]
+        # 超过 ttl 的 refresh_ahead 之后，继续返回旧的结果并在后台刷新
+        time.sleep(0.12)
+        stub.hosts["a.test"] = ["10.0.0.2"]
+        assert cache.lookup("a.test", 80) == ["10.0.0.1"]
+        deadline = time.time() + 5
+        while cache.lookup("a.test", 80) != ["10.0.0.2"]:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert cache.get_stats()["refreshes"] == 1
+        # 刷新失败时使用之前的结果，直到过期
+        del stub.hosts["a.test"]
+        time.sleep(0.12)
+        cache.lookup("a.test", 80)
+        time.sleep(0.05)
+        assert cache.lookup("a.test", 80) == ["10.0.0.2"]
+        time.sleep(0.2)
+        assert cache.lookup("a.test", 80) is None
+        assert cache.get_stats()["expired"] == 1
+
+        # 超过 max_entries 时淘汰最早的条目
+        stub.hosts["b.test"] = ["10.0.0.3"]
+        _resolve(cache, "b.test")
+        assert cache.lookup("a.test", 80) is None
+        assert cache.get_stats()["entries"] == 1
+    finally:
+        cache.close()
+
+def check_client():
+    server = BenchServerProcess().start()
+    port = int(server.url.rsplit(":", 1)[1])
+    hosts = dict(("h%d.test" % i, ["127.0.0.1"]) for i in range(10))
+    cache = ResolverCache(StubResolver(hosts, delay=0.3), max_workers=10)
+    manager = CurlAsyncHTTPClientManager(
+        max_clients=2, max_queue_size=100, worker_count=1,
+        resolver=cache)
+    manager.start()
+    try:
+        futures = [manager.fetch(HTTPRequest("http://%s:%d/" % (host, port)))
+                   for host in sorted(hosts)]
+        time.sleep(0.1)
+        # 等待解析的请求最多为 max_clients ，其他的留在队列中
+        stats = manager.stats()
+        assert stats["total"]["resolving"] == 2
+        assert stats["queue_depth"] == 8
+        assert [f.result().code for f in futures] == [200] * 10
+
+        # 解析失败的域名在 negative_ttl 内直接失败
+        url = "http://unknown.test:%d/" % port
+        assert manager.fetch(HTTPRequest(url)).result().code == 599
+        start_time = time.time()
+        response = manager.fetch(HTTPRequest(url)).result()
+        assert time.time() - start_time < 0.1
+        assert response.error.errno == pycurl.E_COULDNT_RESOLVE_HOST
+    finally:
+        manager.stop()
+        cache.close()
+        server.stop()
+
+def test():
+    check_lookup()
+    check_waiters()
+    check_expiry()
+    check_client()
+
+if __name__ == "__main__":
+    test()
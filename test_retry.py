@@ -0,0 +1,136 @@
+# coding: utf8
+
+import time
+
+import pycurl
+
+from bench_server import BenchServerProcess
+from concurrent_http_client.exceptions import CurlException
+from concurrent_http_client.httpclient import HTTPRequest, HTTPResponse
+from concurrent_http_client.httputil import HTTPHeaders
+from concurrent_http_client.manager import CurlAsyncHTTPClientManager
+from concurrent_http_client.retry import RetryBudget, RetryPolicy, \
+    parse_retry_after
+
+URL = "http://example.com/"
+
+def _response(request, code=599, error=None, headers=None):
+    return HTTPResponse(request, code, headers=HTTPHeaders(headers or {}),
+                        error=error)
+
+def check_backoff():
+    policy = RetryPolicy(max_retries=3, backoff=0.1, max_backoff=0.3,
+                         jitter=0.5)
+    request = HTTPRequest(URL)
+    response = _response(request, error=CurlException(
+        pycurl.E_COULDNT_CONNECT, "Failed to connect"))
+    for retries, base in ((0, 0.1), (1, 0.2), (2, 0.3)):
+        delay = policy.get_delay(request, response, retries)
+        assert base * 0.5 <= delay <= base
+    assert policy.get_delay(request, response, 3) is None
+    # 截止时间之前来不及重试
+    assert policy.get_delay(request, response, 0, max_delay=0.01) is None
+    assert policy.get_stats() == {
+        "retries": 3, "exhausted": 1, "budget_denied": 0}
+
+    # 只重试暂时性的错误和幂等的方法
+    assert policy.get_delay(request, _response(request, error=CurlException(
+        pycurl.E_SSL_CONNECT_ERROR, "SSL")), 0) is None
+    assert policy.get_delay(request, _response(request, 500), 0) is None
+    post = HTTPRequest(URL, method="POST", body="")
+    assert policy.get_delay(post, _response(post, 503), 0) is None
+    # 流式的请求和响应不会被重试
+    for streamed in (
+            HTTPRequest(URL, streaming_callback=lambda chunk: None),
+            HTTPRequest(URL, method="PUT",
+                        body_producer=lambda write: None)):
+        assert not policy.is_retryable(streamed, _response(streamed, 503))
+
+def check_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(" 0 ") == 0.0
+    assert parse_retry_after(
+        "Sun, 27 Jan 2013 18:43:20 GMT", now=1359312190) == 10.0
+    # 已经过去的时间
+    assert parse_retry_after(
+        "Sun, 27 Jan 2013 18:43:20 GMT", now=1359312300) == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+    policy = RetryPolicy(backoff=0.1, jitter=0, max_retry_after=5)
+    request = HTTPRequest(URL)
+    delay = policy.get_delay(request, _response(
+        request, 503, headers={"Retry-After": "2"}), 0)
+    assert delay == 2.0
+    # 要求等待的时间过长，或者超过截止时间，不重试
+    assert policy.get_delay(request, _response(
+        request, 429, headers={"Retry-After": "10"}), 0) is None
+    assert policy.get_delay(request, _response(
+        request, 503, headers={"Retry-After": "2"}), 0, max_delay=1) is None
+
+def check_budget():
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+    policy = RetryPolicy(backoff=0.01, budget=budget)
+    request = HTTPRequest(URL)
+    response = _response(request, 503)
+    # 两次第一次尝试只够一次重试
+    policy.on_first_attempt()
+    policy.on_first_attempt()
+    assert policy.get_delay(request, response, 0) is not None
+    assert policy.get_delay(request, response, 0) is None
+    assert policy.get_stats()["budget_denied"] == 1
+
+def check_client(url):
+    policy = RetryPolicy(max_retries=2, backoff=0.05, jitter=0)
+    manager = CurlAsyncHTTPClientManager(
+        max_clients=4, max_queue_size=100, worker_count=1,
+        retry_policy=policy)
+    manager.start()
+    try:
+        start_time = time.time()
+        response = manager.fetch(HTTPRequest(url + "/?status=503")).result()
+        elapsed = time.time() - start_time
+        # 退避 0.05 + 0.1 秒之后放弃，返回最后一次的响应
+        assert response.code == 503
+        assert 0.15 <= elapsed < 2
+        stats = manager.stats()["total"]
+        assert stats["retries"] == 2
+        assert stats["pending_retries"] == 0 and stats["retry_queue"] == 0
+
+        # 退避的时间超过请求的截止时间，不重试
+        slow = RetryPolicy(backoff=5, jitter=0)
+        response = manager.fetch(HTTPRequest(
+            url + "/?status=503", request_timeout=1,
+            retry_policy=slow)).result()
+        assert response.code == 503
+        assert slow.get_stats()["retries"] == 0
+        # 流式的响应不重试
+        response = manager.fetch(HTTPRequest(
+            url + "/?status=503",
+            streaming_callback=lambda chunk: None)).result()
+        assert response.code == 503
+        assert manager.stats()["total"]["retries"] == 2
+
+        # 拒绝重试的预算
+        denied = RetryPolicy(backoff=0.01, budget=RetryBudget(
+            ratio=0, min_per_second=0))
+        response = manager.fetch(HTTPRequest(
+            url + "/?status=503", retry_policy=denied)).result()
+        assert response.code == 503
+        assert denied.get_stats()["budget_denied"] == 1
+        assert manager.stats()["total"]["retries"] == 2
+    finally:
+        manager.stop()
+
+def test():
+    check_backoff()
+    check_retry_after()
+    check_budget()
+    server = BenchServerProcess().start()
+    try:
+        check_client(server.url)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    test()